@@ -1,35 +1,155 @@
-from flask import Flask
+from flask import Flask, current_app, jsonify
+from flask.cli import with_appcontext
+import click
+import json
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from flask_cors import CORS
-from config import Config
-from extensions import db, bcrypt, jwt, limiter
+from config import get_config
+from extensions import db, bcrypt, jwt, limiter, hashing
 from routes import app_routes
+from utils.hashing import HashingPoolBusy
+from utils.email_utils import outbox
+from utils.revocation import revocation_store
+from utils.profile_cache import profile_cache
+from utils.verification import sweeper
+from utils.validators import deliverability
+from utils.metrics import metrics
+from utils.login_guard import login_guard
+from utils.sessions import token_generations
+from utils.jwt_cache import verified_tokens
+from utils.jwt_keys import jwt_decode_key, jwt_encode_key, jwt_headers, key_ring
+from utils.bulk_users import FORMATS, export_users, import_users, read_rows
+from utils.sharding import user_shards
+from utils.replicas import read_replicas
+from utils.structured_logging import structured_logging
+from utils.compression import compression
+from utils.frontend_assets import frontend_assets
+from utils.json_provider import json_provider
+from utils.resharding import reshard_users
+import utils.rate_limit  # registers the sql:// rate limit storage
 
-jwt_blacklist = set()
 
-app = Flask(__name__)
-app.config.from_object(Config)
+def create_app(config=None):
+    """
+    Builds the app. `config` is a config class or a name from config_by_name (default: APP_ENV).
+    Nothing here touches the database: the schema is managed by Alembic (`alembic upgrade head`),
+    and every extension connects lazily on first use, so workers boot without a DB round trip.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config if config is not None and not isinstance(config, str) else get_config(config))
+    app.json = json_provider(app)
 
-# 🟢 את כל ההרחבות מאתחלים כאן פעם אחת
-limiter.init_app(app)
-db.init_app(app)
-bcrypt.init_app(app)
-jwt.init_app(app)
+    # 🟢 את כל ההרחבות מאתחלים כאן פעם אחת
+    # Logging first, so the other extensions' startup messages (e.g. hash calibration) go through it.
+    structured_logging.init_app(app)
+    limiter.init_app(app)
+    db.init_app(app)
+    user_shards.init_app(app)
+    read_replicas.init_app(app)
+    bcrypt.init_app(app)
+    jwt.init_app(app)
+    hashing.init_app(app)
+    outbox.init_app(app)
+    revocation_store.init_app(app)
+    profile_cache.init_app(app)
+    sweeper.init_app(app)
+    deliverability.init_app(app)
+    metrics.init_app(app)
+    login_guard.init_app(app)
+    token_generations.init_app(app)
+    key_ring.init_app(app)
+    verified_tokens.init_app(app)
+    # Registered last so its after_request hook runs first: the views' own hooks (ETags, 304s) see the
+    # uncompressed body, and the metrics/logging hooks time the compression too.
+    compression.init_app(app)
+    frontend_assets.init_app(app)
+
+    CORS(app, supports_credentials=True)
+    app.register_blueprint(app_routes)
+    app.add_url_rule("/test-limit", view_func=test_limit)
+
+    jwt.token_in_blocklist_loader(check_if_token_revoked)
+    jwt.additional_headers_loader(jwt_headers)
+    jwt.encode_key_loader(jwt_encode_key)
+    jwt.decode_key_loader(jwt_decode_key)
+    app.register_error_handler(HashingPoolBusy, hashing_pool_busy)
+    app.register_error_handler(PoolTimeoutError, db_pool_exhausted)
+
+    for command in (
+        sweep_verification_command, import_users_command, export_users_command, rotate_jwt_keys_command,
+        reshard_users_command,
+    ):
+        app.cli.add_command(command)
+    return app
 
-CORS(app, supports_credentials=True)
-app.register_blueprint(app_routes)
-app.jwt_blacklist = jwt_blacklist
 
-@jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload):
-    return jwt_payload["jti"] in jwt_blacklist
+    # Both answers normally come from per-process memory: the Bloom filter and the generation cache.
+    if revocation_store.is_revoked(jwt_payload["jti"]) or token_generations.is_stale(jwt_payload):
+        verified_tokens.discard(jwt_payload["jti"])
+        return True
+    return False
+
+def hashing_pool_busy(e):
+    response = jsonify({"error": "Server busy, try again later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+def db_pool_exhausted(e):
+    response = jsonify({"error": "Server busy, try again later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(current_app.config["DB_POOL_RETRY_AFTER"])
+    return response
+
+@click.command("sweep-verification")
+@with_appcontext
+def sweep_verification_command():
+    """Purge expired verification tokens and long-unverified accounts."""
+    click.echo(json.dumps(sweeper.sweep()))
+
+@click.command("import-users")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default="csv")
+@click.option("--verified", is_flag=True, help="Mark accounts verified and skip verification emails.")
+@click.option("--batch-size", type=int, default=None)
+@with_appcontext
+def import_users_command(source, fmt, verified, batch_size):
+    """Create users from a CSV/NDJSON file (email,password[,full_name,phone_number,address]); '-' reads stdin."""
+    click.echo(json.dumps(import_users(read_rows(source, fmt), verified=verified, batch_size=batch_size)))
+
+@click.command("export-users")
+@click.argument("target", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default="csv")
+@with_appcontext
+def export_users_command(target, fmt):
+    """Stream all users (without password hashes) to a CSV/NDJSON file, stdout by default."""
+    for chunk in export_users(fmt):
+        target.write(chunk)
+
+@click.command("rotate-jwt-keys")
+@click.option("--force", is_flag=True, help="Add a new key even if the current one isn't due for rotation.")
+@with_appcontext
+def rotate_jwt_keys_command(force):
+    """Add a signing key when rotation is due and delete retired keys (run from cron with an asymmetric JWT_ALGORITHM)."""
+    if not key_ring.asymmetric:
+        raise click.UsageError("JWT_ALGORITHM is symmetric; there are no signing keys to rotate.")
+    click.echo(json.dumps(key_ring.rotate(force=force)))
+
+@click.command("reshard-users")
+@click.option("--to", "targets", required=True, help="Comma-separated database URLs of the new USER_SHARDS layout.")
+@click.option("--prune", is_flag=True, help="Delete users from their old shard once copied.")
+@click.option("--batch-size", type=int, default=1000)
+@with_appcontext
+def reshard_users_command(targets, prune, batch_size):
+    """Copy users and their tokens/sessions to the shard layout given by --to (pause signups and logins first)."""
+    urls = [url.strip() for url in targets.split(",") if url.strip()]
+    click.echo(json.dumps(reshard_users(urls, batch_size=batch_size, prune=prune)))
 
-@app.route("/test-limit")
 @limiter.limit("2 per minute")
 def test_limit():
     return "OK"
 
-with app.app_context():
-    db.create_all()
-
 if __name__ == "__main__":
-    app.run(debug=True)
+    app = create_app()
+    app.run(debug=app.config["DEBUG"])
@@ -0,0 +1,60 @@
+"""
+Bulk import throughput.
+
+Generates --rows NDJSON users in memory and imports them with import_users(): once hashing inline
+(--workers 0 equivalent) and once across --workers processes, each into a fresh set of emails.
+DNS deliverability checks are skipped. Prints rows/second, the error count and an export pass over
+the resulting table as JSON.
+"""
+import argparse
+import io
+import json
+import os
+import time
+
+from common import configure_env, disable_deliverability_check, emit, load_app
+
+
+def rows(prefix, count):
+    lines = (json.dumps({"email": f"{prefix}{i}@example.com", "password": "Bench123!"}) for i in range(count))
+    return io.StringIO("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(OUTBOX_AUTOSTART="false")
+    app = load_app()
+    import utils.bulk_users as bulk_users
+
+    disable_deliverability_check()
+
+    results = {"rows": args.rows, "batch_size": args.batch_size}
+    with app.app_context():
+        for label, workers in (("inline", 0), (f"{args.workers}_workers", args.workers)):
+            start = time.perf_counter()
+            report = bulk_users.import_users(
+                bulk_users.read_rows(rows(label, args.rows), "ndjson"), batch_size=args.batch_size, workers=workers
+            )
+            elapsed = time.perf_counter() - start
+            results[label] = {
+                "seconds": round(elapsed, 2),
+                "rows_per_second": round(args.rows / elapsed, 1),
+                "created": report["created"],
+                "failed": report["failed"],
+            }
+
+        start = time.perf_counter()
+        exported = sum(chunk.count("\n") for chunk in bulk_users.export_users("ndjson", args.batch_size))
+        elapsed = time.perf_counter() - start
+        results["export"] = {"rows": exported, "rows_per_second": round(exported / elapsed, 1)}
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Database statements per authenticated request.
+
+Counts the SQL statements each route issues (via SQLAlchemy's before_cursor_execute event) for a
+logged-in user, with the profile cache disabled (every GET /profile reads the users row) and enabled.
+It then replays a simulated session of --requests profile reads that refreshes its access token
+every --refresh-every requests and reports the amortized statements per authenticated request.
+"""
+import argparse
+
+from sqlalchemy import event
+
+from common import configure_env, create_verified_user, emit, load_app
+
+PASSWORD = "Test123!"
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def measure(self, fn):
+        before = self.count
+        response = fn()
+        assert response.status_code < 400, (response.status_code, response.get_json())
+        return self.count - before, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--refresh-every", type=int, default=60)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env()
+    app = load_app()
+    from extensions import db
+    from utils.profile_cache import profile_cache
+
+    create_verified_user(app, "bench@example.com", PASSWORD)
+    client = app.test_client()
+    with app.app_context():
+        counter = StatementCounter(db.engine)
+
+    per_route = {}
+    login_count, res = counter.measure(
+        lambda: client.post("/logintoken", json={"email": "bench@example.com", "password": PASSWORD})
+    )
+    per_route["POST /logintoken"] = login_count
+    tokens = res.get_json()
+    auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    refresh_count, res = counter.measure(
+        lambda: client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    )
+    per_route["POST /token/refresh"] = refresh_count
+    tokens = res.get_json()
+    auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    profile_cache.clear()
+    per_route["GET /profile (cold)"] = counter.measure(lambda: client.get("/profile", headers=auth))[0]
+    per_route["GET /profile (cached)"] = counter.measure(lambda: client.get("/profile", headers=auth))[0]
+    per_route["PUT /profile"] = counter.measure(
+        lambda: client.put("/profile", json={"full_name": "Bench"}, headers=auth)
+    )[0]
+
+    session = {}
+    for label, ttl in (("profile_cache_off", 0.0), ("profile_cache_on", 3600.0)):
+        profile_cache.ttl = ttl
+        profile_cache.clear()
+        total = 0
+        for i in range(args.requests):
+            if i and i % args.refresh_every == 0:
+                spent, res = counter.measure(
+                    lambda: client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+                )
+                total += spent
+                tokens = res.get_json()
+                auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+            total += counter.measure(lambda: client.get("/profile", headers=auth))[0]
+        session[label] = {"statements": total, "per_request": round(total / args.requests, 3)}
+
+    emit(
+        {
+            "requests": args.requests,
+            "refresh_every": args.refresh_every,
+            "statements_per_route": per_route,
+            "session": session,
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Hash and verify time per password-hash policy.
+
+Times HashPolicy hashing and verification in-process for each bcrypt cost in --rounds and, when
+argon2-cffi is installed, each argon2id time cost in --argon2-time-costs (at --argon2-memory KiB).
+Also reports what HASH_TARGET_MS=--target-ms would calibrate to on this machine.
+"""
+import argparse
+
+from common import emit, micro
+
+import utils.hashing as hashing_utils
+from utils.hashing import HashPolicy, _check_password, _hash_password
+
+
+def time_policy(policy, iterations):
+    hashed = _hash_password(b"Bench123!", policy.params)
+    return {
+        "hash": micro(lambda: _hash_password(b"Bench123!", policy.params), iterations, warmup=1),
+        "verify": micro(lambda: _check_password(b"Bench123!", hashed), iterations, warmup=1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--argon2-time-costs", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--argon2-memory", type=int, default=65536)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = {}
+    for rounds in args.rounds:
+        results[f"bcrypt_{rounds}"] = time_policy(HashPolicy(bcrypt_rounds=rounds), args.iterations)
+    if hashing_utils.argon2 is not None:
+        for time_cost in args.argon2_time_costs:
+            policy = HashPolicy("argon2id", time_cost=time_cost, memory_cost=args.argon2_memory)
+            results[f"argon2id_t{time_cost}_m{args.argon2_memory}"] = time_policy(policy, args.iterations)
+
+    calibrated = HashPolicy()
+    measured = calibrated.calibrate(args.target_ms)
+    emit(
+        {
+            "iterations": args.iterations,
+            "policies": results,
+            "calibration": {"target_ms": args.target_ms, "chosen": calibrated.describe(), "measured_ms": round(measured, 1)},
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
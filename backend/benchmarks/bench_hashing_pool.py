@@ -0,0 +1,80 @@
+"""
+/profile latency while /logintoken is saturated.
+
+Runs a /profile poller alone, then again next to N threads hammering /logintoken, and prints
+p50/p95/p99 for both phases plus the /logintoken status mix (200 vs 503 load shedding).
+Compare `--workers 0` (bcrypt inline on the request threads) with the default process pool.
+"""
+import argparse
+import collections
+import threading
+import time
+
+from common import configure_env, create_verified_user, emit, load_app, request, serve, summarize
+
+
+def poll_profile(base_url, token, stop, samples):
+    while not stop.is_set():
+        status, elapsed, _ = request("GET", f"{base_url}/profile", token=token)
+        if status == 200:
+            samples.append(elapsed)
+
+
+def hammer_login(base_url, credentials, stop, statuses):
+    while not stop.is_set():
+        status, _, _ = request("POST", f"{base_url}/logintoken", body=credentials)
+        statuses[status] += 1
+
+
+def run_phase(base_url, token, credentials, login_threads, duration):
+    stop = threading.Event()
+    samples = []
+    statuses = collections.Counter()
+    threads = [threading.Thread(target=poll_profile, args=(base_url, token, stop, samples))]
+    threads += [
+        threading.Thread(target=hammer_login, args=(base_url, credentials, stop, statuses))
+        for _ in range(login_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {"profile": summarize(samples), "logintoken_statuses": dict(statuses)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=None, help="HASH_POOL_WORKERS (0 = inline)")
+    parser.add_argument("--queue", type=int, default=8, help="HASH_POOL_MAX_QUEUE")
+    parser.add_argument("--login-threads", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    overrides = {"HASH_POOL_MAX_QUEUE": args.queue}
+    if args.workers is not None:
+        overrides["HASH_POOL_WORKERS"] = args.workers
+    configure_env(**overrides)
+    app = load_app()
+
+    credentials = {"email": "bench@example.com", "password": "Bench123!"}
+    create_verified_user(app, credentials["email"], credentials["password"])
+    base_url, server = serve(app)
+
+    with app.test_client() as client:
+        token = client.post("/logintoken", json=credentials).json["access_token"]
+
+    results = {
+        "hash_pool_workers": app.config["HASH_POOL_WORKERS"],
+        "hash_pool_max_queue": app.config["HASH_POOL_MAX_QUEUE"],
+        "idle": run_phase(base_url, token, credentials, 0, args.duration),
+        "login_saturated": run_phase(base_url, token, credentials, args.login_threads, args.duration),
+    }
+    server.shutdown()
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Sign/verify cost of an access token per JWT algorithm: HS256 (shared secret) against RS256, ES256 and
+EdDSA (the key-ring algorithms). Uses PyJWT directly with the same claims issue_access_token() sets,
+so the numbers are the raw crypto + encoding cost per token. Also reports the token size.
+"""
+import argparse
+import secrets
+import time
+import uuid
+
+import jwt
+
+from common import emit, micro
+from utils.jwt_keys import generate_private_key
+
+CLAIMS = {
+    "sub": str(uuid.uuid4()),
+    "type": "access",
+    "fresh": False,
+    "email": "bench@example.com",
+    "full_name": "Bench User",
+    "phone_number": "0541234567",
+    "address": "Tel Aviv",
+    "gen": 0,
+    "sid": str(uuid.uuid4()),
+}
+
+
+def keys_for(algorithm):
+    if algorithm == "HS256":
+        secret = secrets.token_hex(32)
+        return secret, secret
+    private_key = generate_private_key(algorithm)
+    return private_key, private_key.public_key()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--algorithms", nargs="+", default=["HS256", "RS256", "ES256", "EdDSA"])
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = {}
+    for algorithm in args.algorithms:
+        signing_key, verifying_key = keys_for(algorithm)
+        now = int(time.time())
+        claims = {**CLAIMS, "iat": now, "nbf": now, "exp": now + 3600, "jti": str(uuid.uuid4())}
+        headers = {} if algorithm == "HS256" else {"kid": "bench"}
+        token = jwt.encode(claims, signing_key, algorithm=algorithm, headers=headers)
+        results[algorithm] = {
+            "token_bytes": len(token),
+            "sign": micro(lambda: jwt.encode(claims, signing_key, algorithm=algorithm, headers=headers), args.iterations),
+            "verify": micro(lambda: jwt.decode(token, verifying_key, algorithms=[algorithm]), args.iterations),
+        }
+    emit({"iterations": args.iterations, "algorithms": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+GET /profile latency with the verified-token cache (JWT_VERIFY_CACHE_SIZE) on and off.
+
+One user polls GET /profile with the same access token, in-process, as the dashboard does; the profile
+cache is on, so token verification is a large share of each request. Modes alternate and each keeps
+its best of --rounds. Also times decode_token() alone and reports the cache's hit counters.
+--algorithm picks the signing algorithm (RS256/ES256/EdDSA use a throw-away key ring), where the
+signature check the cache skips costs more than HS256's HMAC.
+"""
+import argparse
+import os
+
+from common import configure_env, create_verified_user, disable_deliverability_check, emit, load_app, micro
+
+PASSWORD = "Bench123!"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--algorithm", default="HS256", choices=["HS256", "RS256", "ES256", "EdDSA"])
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    tmpdir = configure_env(OUTBOX_AUTOSTART="false", RATELIMIT_ENABLED="false", JWT_ALGORITHM=args.algorithm)
+    os.environ["JWT_KEYS_DIR"] = os.path.join(tmpdir, "jwt-keys")
+    app = load_app()
+    disable_deliverability_check()
+    from flask_jwt_extended import decode_token
+    from utils.jwt_cache import verified_tokens
+    from utils.metrics import metrics
+
+    create_verified_user(app, "bench@example.com", PASSWORD)
+    client = app.test_client()
+    token = client.post("/logintoken", json={"email": "bench@example.com", "password": PASSWORD}).json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    size = verified_tokens.max_entries
+
+    def profile():
+        client.get("/profile", headers=headers)
+
+    def decode():
+        with app.app_context():
+            decode_token(token)
+
+    results = {}
+    for _ in range(args.rounds):
+        for mode in ("off", "on"):
+            verified_tokens.max_entries = size if mode == "on" else 0
+            verified_tokens.clear()
+            runs = {"profile": micro(profile, args.iterations), "decode_token": micro(decode, args.iterations)}
+            for name, run in runs.items():
+                best = results.setdefault(mode, {}).get(name)
+                if best is None or run["ops_per_second"] > best["ops_per_second"]:
+                    results[mode][name] = run
+    verified_tokens.max_entries = size
+
+    emit(
+        {
+            "algorithm": args.algorithm,
+            "token_bytes": len(token),
+            "iterations": args.iterations,
+            "modes": results,
+            "profile_saved_us": round(
+                (1 / results["off"]["profile"]["ops_per_second"] - 1 / results["on"]["profile"]["ops_per_second"]) * 1e6, 1
+            ),
+            "cache_lookups": {
+                result: metrics.jwt_verify_cache.value(result=result) for result in ("hit", "miss", "expired", "key_changed")
+            },
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Request overhead of logging (utils/structured_logging.py).
+
+Runs the same in-process requests (GET /profile with a valid token, profile cache off so each one runs
+its SELECTs) with logging off (WARNING and up only, no access line) and with a JSON access line per
+request written synchronously by the handler vs. queued for the background writer, plus both again
+with every SQL statement logged (LOG_SQL). Output goes to a file in the benchmark's temp directory.
+Reports the per-request overhead over "off" in microseconds (best of --rounds each) and how long the
+writer then needed to drain what the queued modes left behind. --sink-delay-ms makes every write wait
+that long first, standing in for stderr piped to a log shipper that has fallen behind.
+"""
+import argparse
+import os
+import time
+
+from common import configure_env, create_verified_user, disable_deliverability_check, emit, load_app, micro
+
+PASSWORD = "Bench123!"
+
+MODES = {
+    "off": {"level": "WARNING", "access_log": False},
+    "sync": {"use_queue": False},
+    "queue": {},
+    "queue_sampled_10pct": {"sample_rates": "access=0.1"},
+    "sync_sql": {"use_queue": False, "sql": True},
+    "queue_sql": {"sql": True},
+    "queue_sql_sampled_1pct": {"sql": True, "sample_rates": "access=0.1,sqlalchemy.engine=0.01"},
+}
+
+
+class SlowStream:
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def overhead_us(mode, baseline):
+    return round((1 / mode["ops_per_second"] - 1 / baseline["ops_per_second"]) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--sink-delay-ms", type=float, default=0.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    tmpdir = configure_env(OUTBOX_AUTOSTART="false", RATELIMIT_ENABLED="false", PROFILE_CACHE_TTL=0)
+    app = load_app()
+    disable_deliverability_check()
+    from utils.structured_logging import structured_logging
+
+    create_verified_user(app, "bench@example.com", PASSWORD)
+    client = app.test_client()
+    token = client.post("/logintoken", json={"email": "bench@example.com", "password": PASSWORD}).json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    log_file = os.path.join(tmpdir, "bench.log")
+    sink = {"filename": log_file}
+    if args.sink_delay_ms:
+        sink = {"stream": SlowStream(open(log_file, "a", encoding="utf-8"), args.sink_delay_ms / 1000)}
+
+    def profile():
+        client.get("/profile", headers=headers)
+
+    # Alternate the modes and keep each one's best round, so drift (caches, CPU boost) hits them alike.
+    results, drains = {}, {}
+    for _ in range(args.rounds):
+        for mode, options in MODES.items():
+            structured_logging.configure(**{**sink, "sample_rates": "access=1", **options})
+            run = micro(profile, args.iterations)
+            start = time.perf_counter()
+            structured_logging.flush()
+            drain_ms = round((time.perf_counter() - start) * 1000, 1)
+            if mode not in results or run["ops_per_second"] > results[mode]["ops_per_second"]:
+                results[mode], drains[mode] = run, drain_ms
+    log_bytes = os.path.getsize(log_file)
+    structured_logging.configure(level="WARNING", access_log=False)
+
+    emit(
+        {
+            "iterations": args.iterations,
+            "sink_delay_ms": args.sink_delay_ms,
+            "modes": {
+                mode: {
+                    **run,
+                    "overhead_us": overhead_us(run, results["off"]),
+                    "drain_after_run_ms": drains[mode],
+                }
+                for mode, run in results.items()
+            },
+            "log_bytes_written": log_bytes,
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
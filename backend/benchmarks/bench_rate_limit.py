@@ -0,0 +1,72 @@
+"""
+Global rate-limit enforcement and per-check latency across worker processes.
+
+Starts --processes workers that all hit the same key (limit --limit per minute) --hits times,
+once with limits' in-process memory:// storage (what each gunicorn worker used to have) and once
+with the shared sql:// storage, and reports how many hits were admitted in total plus per-check
+latency. With memory:// the admitted total grows with the number of processes; with sql:// it
+stays at or below the limit.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from common import emit, summarize
+
+
+def run_worker(args):
+    kind, url, limit, hits, lease_fraction = args
+    from limits.storage import MemoryStorage
+    from utils.rate_limit import SQLRateLimitStorage
+
+    if kind == "memory":
+        storage = MemoryStorage()
+    else:
+        storage = SQLRateLimitStorage(url=url, lease_fraction=lease_fraction, create_table=True)
+    admitted = 0
+    samples = []
+    for _ in range(hits):
+        start = time.perf_counter()
+        admitted += storage.acquire_sliding_window_entry("bench:login", limit, 60)
+        samples.append(time.perf_counter() - start)
+    return admitted, samples, getattr(storage, "remote_hits", None)
+
+
+def run(kind, url, args):
+    jobs = [(kind, url, args.limit, args.hits, args.lease_fraction)] * args.processes
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(run_worker, jobs)
+    samples = [sample for _, worker_samples, _ in results for sample in worker_samples]
+    return {
+        "admitted": sum(admitted for admitted, _, _ in results),
+        "storage_round_trips": None if kind == "memory" else sum(remote for _, _, remote in results),
+        "check_latency": summarize(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--hits", type=int, default=500)
+    parser.add_argument("--lease-fraction", type=float, default=0.1)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='auth-bench-'), 'limits.db')}"
+    emit(
+        {
+            "processes": args.processes,
+            "limit_per_minute": args.limit,
+            "hits_per_process": args.hits,
+            "memory": run("memory", url, args),
+            "sql": run("sql", url, args),
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Primary database load under a read-heavy mix, without and with read replicas (DB_REPLICAS).
+
+--users verified accounts, then --requests in-process requests drawn from the mix: GET /profile
+(profile cache off, so every read reaches the database), PATCH /profile and POST /logintoken. The
+replicas are SQLite snapshots of the primary taken after seeding, so they serve reads but never catch
+up; the sticky-primary window is what keeps each user's reads after their own PATCH correct. Counts the
+SQL statements each database ran, split into reads and writes, per request.
+"""
+import argparse
+import collections
+import os
+import random
+import sqlite3
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from common import configure_env, create_verified_user, emit, load_app, summarize
+
+PASSWORD = "Bench123!"
+
+
+def snapshot(db, app, path):
+    with app.app_context():
+        source = db.engine.raw_connection()
+        try:
+            target = sqlite3.connect(path)
+            source.driver_connection.backup(target)
+            target.close()
+        finally:
+            source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--replicas", type=int, default=2)
+    parser.add_argument("--mix", default="profile=90,patch=5,login=5", help="weights per request kind")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    tmpdir = configure_env(
+        OUTBOX_AUTOSTART="false", RATELIMIT_ENABLED="false", EMAIL_CHECK_DELIVERABILITY="false",
+        LOGIN_LOCKOUT_ENABLED="false", HASH_BCRYPT_ROUNDS=4, HASH_POOL_WORKERS=0, PROFILE_CACHE_TTL=0,
+    )
+    app = load_app()
+    from extensions import db
+    from utils.metrics import metrics
+    from utils.replicas import read_replicas
+
+    client = app.test_client()
+    emails = [f"replica-bench-{i}@example.com" for i in range(args.users)]
+    tokens = {}
+    for email in emails:
+        create_verified_user(app, email, PASSWORD)
+        res = client.post("/logintoken", json={"email": email, "password": PASSWORD})
+        tokens[email] = {"Authorization": f"Bearer {res.json['access_token']}"}
+
+    replica_paths = [os.path.join(tmpdir, f"replica{i}.db") for i in range(args.replicas)]
+    for path in replica_paths:
+        snapshot(db, app, path)
+    with app.app_context():
+        primary_url = db.engine.url
+
+    counts = collections.Counter()
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        target = "primary" if conn.engine.url == primary_url else "replica"
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        counts[(target, "read" if verb == "SELECT" else "write")] += 1
+
+    kinds, weights = zip(*((k, int(w)) for k, w in (part.split("=") for part in args.mix.split(","))))
+    results = {}
+    for mode in ("primary_only", "replicas"):
+        read_replicas.configure(default=[f"sqlite:///{path}" for path in replica_paths] if mode == "replicas" else [])
+        read_replicas.check()
+        rng = random.Random(args.seed)
+        counts.clear()
+        statuses, samples = collections.Counter(), []
+        routed_before = {t: metrics.replica_routing.value(target=t) for t in ("primary", "replica")}
+        event.listen(Engine, "before_cursor_execute", count_statement)
+        start = time.perf_counter()
+        for n in range(args.requests):
+            kind = rng.choices(kinds, weights)[0]
+            email = rng.choice(emails)
+            begin = time.perf_counter()
+            if kind == "profile":
+                res = client.get("/profile", headers=tokens[email])
+            elif kind == "patch":
+                res = client.patch("/profile", json={"address": f"{mode} {n}"}, headers=tokens[email])
+                if res.status_code == 200:
+                    tokens[email] = {"Authorization": f"Bearer {res.json['access_token']}"}
+            else:
+                res = client.post("/logintoken", json={"email": email, "password": PASSWORD})
+            samples.append(time.perf_counter() - begin)
+            statuses[f"{kind}:{res.status_code}"] += 1
+        elapsed = time.perf_counter() - start
+        event.remove(Engine, "before_cursor_execute", count_statement)
+        results[mode] = {
+            "requests_per_second": round(args.requests / elapsed, 1),
+            "statuses": dict(statuses),
+            "statements": {f"{target}_{op}": n for (target, op), n in sorted(counts.items())},
+            "primary_statements_per_request": round(
+                (counts[("primary", "read")] + counts[("primary", "write")]) / args.requests, 2
+            ),
+            "replica_routed_reads": {
+                t: metrics.replica_routing.value(target=t) - routed_before[t] for t in ("primary", "replica")
+            },
+            **summarize(samples),
+        }
+    read_replicas.stop()
+    read_replicas.configure()
+
+    emit({"users": args.users, "requests": args.requests, "replicas": args.replicas, "mix": args.mix, "modes": results},
+         args.output)
+
+
+if __name__ == "__main__":
+    main()
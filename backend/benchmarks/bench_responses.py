@@ -0,0 +1,104 @@
+"""
+Bytes on the wire and serialization time per route.
+
+For the JSON/text API routes (GET /, /profile, /sessions with --sessions logins, /metrics and POST /logintoken)
+and the frontend (/app/ and its hashed script, stylesheet and image), in-process:
+- response size as sent without Accept-Encoding, with gzip and, if the brotli package is installed, with br,
+  plus what a revalidation (If-None-Match) costs for the routes that send an ETag;
+- for the JSON routes, the time to turn the view's payload into a response with Flask's own provider ("std")
+  and with orjson, and the request latency with each (best of --rounds).
+"""
+import argparse
+import re
+
+from common import configure_env, create_verified_user, disable_deliverability_check, emit, load_app, micro
+
+PASSWORD = "Bench123!"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=20, help="logins before GET /sessions, one session each")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(
+        OUTBOX_AUTOSTART="false", RATELIMIT_ENABLED="false", LOGIN_LOCKOUT_ENABLED="false", HASH_BCRYPT_ROUNDS=4,
+        HASH_POOL_WORKERS=0, LOG_LEVEL="WARNING", LOG_ACCESS="false", METRICS_TOKEN="bench-metrics",
+    )
+    app = load_app()
+    disable_deliverability_check()
+    from flask.json.provider import DefaultJSONProvider
+    from utils.compression import brotli
+    from utils.json_provider import OrjsonProvider
+
+    create_verified_user(app, "bench@example.com", PASSWORD)
+    client = app.test_client()
+    login = {"email": "bench@example.com", "password": PASSWORD}
+    for _ in range(args.sessions):
+        token = client.post("/logintoken", json=login).json["access_token"]
+    auth = {"Authorization": f"Bearer {token}"}
+    client.patch("/profile", json={"full_name": "ישראל ישראלי", "address": "תל אביב"}, headers=auth)
+    token = client.post("/logintoken", json=login).json["access_token"]
+    auth = {"Authorization": f"Bearer {token}"}
+
+    page = client.get("/app/").get_data(as_text=True)
+    asset_urls = {
+        name: re.search(rf'"(/app/assets/{name}\.[0-9a-f]{{10}}\.{ext})"', page).group(1)
+        for name, ext in (("script", "js"), ("styles", "css"), ("eye", "png"))
+    }
+    routes = {
+        "GET /": ("GET", "/", {}, None),
+        "GET /profile": ("GET", "/profile", auth, None),
+        "GET /sessions": ("GET", "/sessions", auth, None),
+        "GET /metrics": ("GET", "/metrics", {"Authorization": "Bearer bench-metrics"}, None),
+        "POST /logintoken": ("POST", "/logintoken", {}, login),
+        "GET /app/": ("GET", "/app/", {}, None),
+        **{f"GET {url}": ("GET", url, {}, None) for url in asset_urls.values()},
+    }
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+
+    def send(method, path, headers, body):
+        return client.open(path, method=method, headers=headers, json=body)
+
+    results = {}
+    for route, (method, path, headers, body) in routes.items():
+        sizes = {}
+        for encoding in encodings:
+            res = send(method, path, {**headers, "Accept-Encoding": encoding}, body)
+            sizes[encoding] = len(res.data)
+            etag = res.headers.get("ETag")
+        entry = {"status": res.status_code, "content_type": res.mimetype, "bytes": sizes}
+        if method == "GET" and etag:
+            revalidated = send(method, path, {**headers, "Accept-Encoding": encodings[-1], "If-None-Match": etag}, None)
+            entry["revalidation"] = {"status": revalidated.status_code, "bytes": len(revalidated.data)}
+        results[route] = entry
+
+    # Serialization: the payload each JSON route returned, encoded by each provider.
+    providers = {"std": DefaultJSONProvider(app), "orjson": OrjsonProvider(app)}
+    for route, (method, path, headers, body) in routes.items():
+        if results[route]["content_type"] != "application/json":
+            continue
+        payload = send(method, path, headers, body).json
+        timings = {}
+        with app.app_context():
+            for name, provider in providers.items():
+                timings[name] = 1e6 / micro(lambda: provider.response(payload), args.iterations * 5)["ops_per_second"]
+        latency = {}
+        for _ in range(args.rounds):
+            for name, provider in providers.items():
+                app.json = provider
+                run = micro(lambda: send(method, path, headers, body), args.iterations)
+                if name not in latency or run["p50_ms"] < latency[name]:
+                    latency[name] = run["p50_ms"]
+        results[route]["serialize_us"] = {name: round(us, 1) for name, us in timings.items()}
+        results[route]["request_p50_ms"] = latency
+    app.json = providers["orjson"]
+
+    emit({"encodings": encodings, "sessions": args.sessions, "routes": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Revocation-check cost with a large number of revoked tokens.
+
+Loads --count revoked jtis into the SQL backend, rebuilds the per-process Bloom filter and times
+is_revoked() for tokens that were never revoked (Bloom miss, no I/O), for revoked tokens
+(Bloom hit confirmed by the backend) and a plain backend lookup for comparison.
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime
+
+from common import configure_env, emit, load_app, summarize
+
+CHUNK = 50000
+
+
+def time_calls(fn, keys):
+    samples = []
+    for key in keys:
+        start = time.perf_counter()
+        fn(key)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=10_000_000)
+    parser.add_argument("--checks", type=int, default=20000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(REVOCATION_BLOOM_CAPACITY=args.count)
+    app = load_app()
+    from extensions import db
+    from models import RevokedToken
+    from utils.revocation import revocation_store
+
+    with app.app_context():
+        table = RevokedToken.__table__
+        expires_at = datetime.utcfromtimestamp(time.time() + 3600)
+        sample_revoked = []
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            for offset in range(0, args.count, CHUNK):
+                rows = []
+                for _ in range(min(CHUNK, args.count - offset)):
+                    jti = str(uuid.uuid4())
+                    rows.append({"jti": jti, "expires_at": expires_at, "revoked_at": datetime.utcnow()})
+                if len(sample_revoked) < args.checks:
+                    sample_revoked.extend(row["jti"] for row in rows[: args.checks - len(sample_revoked)])
+                conn.execute(table.insert(), rows)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        revocation_store.refresh(force=True)
+        rebuild_seconds = time.perf_counter() - start
+
+        unrevoked = [str(uuid.uuid4()) for _ in range(args.checks)]
+        results = {
+            "revoked_tokens": args.count,
+            "load_seconds": round(load_seconds, 2),
+            "bloom_rebuild_seconds": round(rebuild_seconds, 2),
+            "bloom_bytes": len(revocation_store.bloom.bits),
+            "bloom_hashes": revocation_store.bloom.hashes,
+            "check_not_revoked": time_calls(revocation_store.is_revoked, unrevoked),
+            "check_revoked": time_calls(revocation_store.is_revoked, sample_revoked),
+            "backend_lookup_only": time_calls(revocation_store.backend.is_revoked, unrevoked),
+            "bloom_false_positives": sum(jti in revocation_store.bloom for jti in unrevoked),
+        }
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Signup and login throughput against 1, 2, 4... user shards (USER_SHARDS), each a local SQLite file by
+default or any database from --url-template (e.g. "postgresql://localhost/auth_shard_{i}", one scratch
+database per shard). --threads clients hammer /signup, then /logintoken, in-process; bcrypt runs at
+--rounds so the database, not hashing, is what's measured. With one shard every signup serializes on
+one database's write lock; with more shards, signups whose emails hash to different shards commit in
+parallel.
+"""
+import argparse
+import collections
+import os
+import threading
+import time
+
+from common import configure_env, emit, load_app, summarize
+
+PASSWORD = "Bench123!"
+
+
+def run_clients(app, threads, requests_per_thread, make_request):
+    samples, statuses, lock = [], collections.Counter(), threading.Lock()
+
+    def worker(index):
+        client = app.test_client()
+        local, local_statuses = [], collections.Counter()
+        for n in range(requests_per_thread):
+            start = time.perf_counter()
+            status = make_request(client, index, n)
+            local.append(time.perf_counter() - start)
+            local_statuses[status] += 1
+        with lock:
+            samples.extend(local)
+            statuses.update(local_statuses)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "per_second": round(len(samples) / elapsed, 1),
+        "statuses": {str(k): v for k, v in statuses.items()},
+        **summarize(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="signups (and logins) per thread")
+    parser.add_argument("--rounds", type=int, default=4, help="bcrypt cost")
+    parser.add_argument("--url-template", help="shard database URL with {i}; default: SQLite files")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    tmpdir = configure_env(
+        OUTBOX_AUTOSTART="false", RATELIMIT_ENABLED="false", EMAIL_CHECK_DELIVERABILITY="false",
+        LOGIN_LOCKOUT_ENABLED="false", HASH_BCRYPT_ROUNDS=args.rounds, HASH_POOL_WORKERS=0,
+        USER_SHARD_POOL_SIZE=args.threads,
+    )
+    app = load_app()
+    from extensions import db
+    from utils.sharding import user_shards
+
+    results = {}
+    for count in args.shards:
+        template = args.url_template or f"sqlite:///{os.path.join(tmpdir, 'run%d-shard{i}.db' % count)}"
+        user_shards.configure([template.format(i=i) for i in range(count)], pool_size=args.threads)
+        for engine in user_shards.engines:
+            db.metadata.create_all(engine)
+
+        def email(index, n):
+            return f"s{count}-t{index}-{n}@example.com"
+
+        def signup(client, index, n):
+            return client.post("/signup", json={"email": email(index, n), "password": PASSWORD}).status_code
+
+        def login(client, index, n):
+            res = client.post("/logintoken", json={"email": email(index, n), "password": PASSWORD})
+            return res.status_code
+
+        signups = run_clients(app, args.threads, args.requests, signup)
+        # Mark everyone verified shard by shard so the logins below succeed.
+        for engine in user_shards.engines:
+            with engine.begin() as connection:
+                connection.execute(db.metadata.tables["users"].update().values(is_verified=True))
+        logins = run_clients(app, args.threads, args.requests, login)
+        results[str(count)] = {"signup": signups, "login": logins}
+
+    user_shards.configure([])
+    emit(
+        {
+            "threads": args.threads,
+            "requests_per_thread": args.requests,
+            "bcrypt_rounds": args.rounds,
+            "database": args.url_template or "sqlite files",
+            "shards": results,
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Signup throughput with a large users table.
+
+Bulk-loads --existing users, then times --signups new signups and --signups duplicate signups
+through the app (one INSERT per signup, duplicates rejected by the unique index). bcrypt is
+replaced by a constant hash unless --real-hash is given, and the email check skips the DNS
+deliverability lookup, so the numbers isolate the database path. Also prints SQLite's query
+plan for the email lookup to show it uses the index.
+"""
+import argparse
+import time
+import uuid
+
+from common import configure_env, disable_deliverability_check, emit, load_app, summarize
+
+CHUNK = 50000
+
+
+def timed_signups(client, emails, password):
+    samples = []
+    statuses = {}
+    start = time.perf_counter()
+    for email in emails:
+        t0 = time.perf_counter()
+        res = client.post("/signup", json={"email": email, "password": password})
+        samples.append(time.perf_counter() - t0)
+        statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+    elapsed = time.perf_counter() - start
+    return {"per_second": round(len(emails) / elapsed, 1), "latency": summarize(samples), "statuses": statuses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--existing", type=int, default=1_000_000)
+    parser.add_argument("--signups", type=int, default=2000)
+    parser.add_argument("--real-hash", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(OUTBOX_AUTOSTART="false", HASH_POOL_WORKERS=0)
+    app = load_app()
+    from extensions import db, hashing
+    from models import User
+    from sqlalchemy import text
+
+    disable_deliverability_check()
+    if not args.real_hash:
+        fixed = hashing.hash_password("Bench123!")
+        hashing.hash_password = lambda password: fixed
+
+    with app.app_context():
+        table = User.__table__
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            for offset in range(0, args.existing, CHUNK):
+                rows = [
+                    {"id": str(uuid.uuid4()), "email": f"existing{i}@example.com", "password": "x", "is_verified": True}
+                    for i in range(offset, min(offset + CHUNK, args.existing))
+                ]
+                conn.execute(table.insert(), rows)
+        load_seconds = time.perf_counter() - start
+        with db.engine.connect() as conn:
+            plan = conn.execute(
+                text("EXPLAIN QUERY PLAN SELECT * FROM users WHERE email = :email"), {"email": "x@example.com"}
+            ).all()
+
+    new_emails = [f"new{i}@example.com" for i in range(args.signups)]
+    duplicates = [f"Existing{i}@Example.com" for i in range(args.signups)]
+    with app.test_client() as client:
+        results = {
+            "existing_users": args.existing,
+            "load_seconds": round(load_seconds, 2),
+            "email_lookup_plan": [row[-1] for row in plan],
+            "new_signups": timed_signups(client, new_emails, "Bench123!"),
+            "duplicate_signups": timed_signups(client, duplicates, "Bench123!"),
+        }
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
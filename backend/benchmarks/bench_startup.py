@@ -0,0 +1,76 @@
+"""
+Worker boot cost: how long a fresh Python process takes to import the app, build it with create_app(),
+and answer its first request, versus the old boot path that also ran db.create_all() on start.
+
+Every run is a new interpreter (so imports are cold) against a throw-away SQLite database that already
+has the schema, as a worker would find it after `alembic upgrade head`. Prints the median of --runs for
+each stage as JSON; `python -X importtime -c "import app"` breaks the import time down per module.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from common import BACKEND_DIR, configure_env, emit, load_app
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+if {create_all}:
+    from extensions import db
+    with app.app_context():
+        db.create_all()
+ready = time.perf_counter()
+client = app.test_client()
+client.get("/")
+client.post("/logintoken", json={{"email": "nobody@example.com", "password": "x"}})
+first = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "boot_ms": (ready - start) * 1000,
+    "first_request_ms": (first - ready) * 1000,
+    "time_to_first_request_ms": (first - start) * 1000,
+}}))
+"""
+
+
+def run_child(create_all):
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(create_all=create_all)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(create_all, runs):
+    samples = [run_child(create_all) for _ in range(runs)]
+    return {key: round(statistics.median(s[key] for s in samples), 1) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(OUTBOX_AUTOSTART="false", RATELIMIT_ENABLED="false", EMAIL_CHECK_DELIVERABILITY="false")
+    load_app()  # creates the schema once, like a migrated database
+
+    emit(
+        {
+            "runs": args.runs,
+            "factory": measure(False, args.runs),
+            "factory_with_create_all": measure(True, args.runs),
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
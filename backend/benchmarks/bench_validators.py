@@ -0,0 +1,96 @@
+"""
+Validator micro-benchmarks: the previous implementation against utils/validators.py.
+
+"legacy_*" reproduces the old code paths (string patterns passed to re.search on each call, and an INFO
+log line per validated email, here written to /dev/null). The domain-cache cases run the MX check with
+a stub resolver that sleeps --resolver-ms to stand in for DNS, once with every email on a new domain
+(cache miss) and once spread over --domains domains (the signup-flood case).
+"""
+import argparse
+import logging
+import os
+import re
+import time
+
+from common import emit, micro
+
+from email_validator import validate_email
+from utils.validators import (
+    deliverability,
+    is_valid_email,
+    is_valid_israeli_phone,
+    is_valid_password,
+    validate_profile,
+    validate_signup,
+)
+
+legacy_logger = logging.getLogger("legacy_validators")
+
+
+def legacy_is_valid_password(password):
+    return not (
+        len(password) < 8
+        or not re.search(r"[0-9]", password)
+        or not re.search(r"[!@#$%^&*(),.?\":{}|<>]", password)
+        or not re.search(r"[a-zA-Z\u0590-\u05FF]", password)
+    )
+
+
+def legacy_is_valid_israeli_phone(number):
+    number = number.strip().replace(" ", "")
+    if number.startswith("+972"):
+        number = "0" + number[4:]
+    return bool(re.match(r"^05[012345689]\d{7}$", number))
+
+
+def legacy_is_valid_email(email):
+    validate_email(email, check_deliverability=False)
+    legacy_logger.info(f"✅ Email validated successfully: {email}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--resolver-ms", type=float, default=20.0)
+    parser.add_argument("--domains", type=int, default=10)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, "w")
+    legacy_logger.addHandler(logging.StreamHandler(devnull))
+    legacy_logger.setLevel(logging.INFO)
+    legacy_logger.propagate = False
+
+    deliverability.resolver = lambda domain: True
+    n = args.iterations
+    results = {
+        "legacy_is_valid_password": micro(lambda: legacy_is_valid_password("Bench123!"), n),
+        "is_valid_password": micro(lambda: is_valid_password("Bench123!"), n),
+        "legacy_is_valid_israeli_phone": micro(lambda: legacy_is_valid_israeli_phone("0541234567"), n),
+        "is_valid_israeli_phone": micro(lambda: is_valid_israeli_phone("0541234567"), n),
+        "legacy_is_valid_email_syntax_and_log": micro(lambda: legacy_is_valid_email("user@example.com"), n),
+        "is_valid_email_cached_domain": micro(lambda: is_valid_email("user@example.com"), n),
+        "validate_signup": micro(lambda: validate_signup("user@example.com", "Bench123!"), n),
+        "validate_profile": micro(lambda: validate_profile("Bench User", "0541234567", "Tel Aviv"), n),
+    }
+
+    def slow_resolver(domain):
+        time.sleep(args.resolver_ms / 1000)
+        return True
+
+    deliverability.resolver = slow_resolver
+    lookups = max(1, n // 100)
+    counter = iter(range(10**9))
+    deliverability.clear()
+    results["mx_check_every_domain_new"] = micro(lambda: is_valid_email(f"u@d{next(counter)}.example.com"), lookups, warmup=0)
+    deliverability.clear()
+    results[f"mx_check_{args.domains}_domains"] = micro(
+        lambda: is_valid_email(f"u@d{next(counter) % args.domains}.example.com"), lookups, warmup=0
+    )
+    results["domain_cache"] = deliverability.stats()
+    emit({"iterations": n, "resolver_ms": args.resolver_ms, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
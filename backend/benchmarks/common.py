@@ -0,0 +1,142 @@
+"""
+Shared helpers for the benchmark scripts.
+Run them from backend/, e.g. `python benchmarks/bench_hashing_pool.py`.
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def configure_env(database_url=None, **overrides):
+    """
+    Point the app at a throw-away SQLite database (or `database_url`, e.g. a scratch Postgres).
+    Must be called before importing `app`.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="auth-bench-")
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("JWT_SECRET_KEY", "bench-jwt-secret")
+    # JSON access logs on stderr would drown the results; bench_logging installs its own sink.
+    os.environ.setdefault("LOG_CONFIGURE", "false")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    for key, value in overrides.items():
+        os.environ[key] = str(value)
+    return tmpdir
+
+
+def load_app():
+    """Build the app on the throw-away database and create its schema."""
+    from app import create_app
+    from extensions import db, limiter
+
+    from utils.sharding import user_shards
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        for engine in user_shards.engines:
+            db.metadata.create_all(engine)
+    limiter.enabled = False
+    return app
+
+
+def disable_deliverability_check():
+    """Skip the MX lookup in email validation so results don't depend on the network."""
+    from utils.validators import deliverability
+
+    deliverability.enabled = False
+
+
+def create_verified_user(app, email, password):
+    from models import User
+    from extensions import db, hashing
+    from utils.sharding import new_user_id, user_shards
+
+    with app.app_context():
+        user_shards.use_email(email)
+        user = User(
+            id=new_user_id(email),
+            email=email.lower(),
+            password=hashing.hash_password(password),
+            is_verified=True,
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def serve(app):
+    """Start a threaded werkzeug server on a free port and return its base URL."""
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def request(method, url, body=None, token=None):
+    """Send one JSON request and return (status, elapsed seconds, response headers)."""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as res:
+            res.read()
+            status, headers = res.status, res.headers
+    except urllib.error.HTTPError as e:
+        e.read()
+        status, headers = e.code, e.headers
+    return status, time.perf_counter() - start, headers
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def micro(fn, iterations, warmup=None):
+    """Call `fn` `iterations` times after a short warm-up and return throughput plus a latency summary."""
+    for _ in range(warmup if warmup is not None else max(1, iterations // 10)):
+        fn()
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return {"ops_per_second": round(iterations / elapsed, 1), **summarize(samples)}
+
+
+def emit(results, output=None):
+    """Print results as JSON and, with `output`, also write them to a file for benchmarks/compare.py."""
+    text = json.dumps(results, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,54 @@
+"""
+Compare two saved benchmark results (any script run with --output).
+
+Walks both JSON documents, pairs every p50/p95/p99 latency, per-request cost (e.g. SQL statements) and
+throughput number by its path and prints the relative change. Exits with status 1 if any latency or cost
+grew, or any throughput fell, by more than --threshold percent, so it can gate CI.
+"""
+import argparse
+import json
+import sys
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+COST_KEYS = ("per_request",)
+THROUGHPUT_KEYS = ("ops_per_second", "per_second", "requests_per_second", "journeys_per_second")
+
+
+def flatten(doc, prefix=""):
+    if isinstance(doc, dict):
+        for key, value in doc.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(doc, (int, float)) and not isinstance(doc, bool):
+        yield prefix, doc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = dict(flatten(json.load(f)))
+    with open(args.candidate) as f:
+        candidate = dict(flatten(json.load(f)))
+
+    rows, regressions = [], []
+    for path, before in baseline.items():
+        metric = path.rsplit(".", 1)[-1]
+        if metric not in LATENCY_KEYS + COST_KEYS + THROUGHPUT_KEYS or path not in candidate or not before:
+            continue
+        after = candidate[path]
+        change = (after - before) / before * 100
+        worse = change < -args.threshold if metric in THROUGHPUT_KEYS else change > args.threshold
+        rows.append({"metric": path, "baseline": before, "candidate": after, "change_pct": round(change, 1)})
+        if worse:
+            regressions.append(path)
+
+    print(json.dumps({"threshold_pct": args.threshold, "metrics": rows, "regressions": regressions}, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
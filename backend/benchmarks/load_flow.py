@@ -0,0 +1,149 @@
+"""
+HTTP load test of the full user journey: signup -> verify -> login -> profile -> logout.
+
+Serves the app on a local port (throw-away SQLite, or --database-url for a scratch Postgres) and runs
+--users virtual users, --concurrency at a time. Each one signs up, follows the verification link from
+its outbox row (the outbox dispatcher is off, so nothing reaches SMTP), logs in, reads /profile
+--profile-reads times and logs out. Login rate limiting and DNS deliverability checks are disabled.
+Prints per-step status mix, throughput and p50/p95/p99 as JSON; use --output and benchmarks/compare.py
+to compare runs.
+"""
+import argparse
+import collections
+import json
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from common import configure_env, disable_deliverability_check, emit, load_app, request, serve, summarize
+
+PASSWORD = "Bench123!"
+STEPS = ("signup", "verify", "login", "profile", "logout")
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+
+    def record(self, step, status, elapsed):
+        with self.lock:
+            self.samples[step].append(elapsed)
+            self.statuses[step][status] += 1
+
+
+def post_json(url, body):
+    """Like common.request but also returns the decoded body (needed for the login response)."""
+    req = urllib.request.Request(url, data=json.dumps(body).encode(), method="POST")
+    req.add_header("Content-Type", "application/json")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as res:
+            payload, status = json.loads(res.read()), res.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        payload, status = None, e.code
+    return status, time.perf_counter() - start, payload
+
+
+def verification_token(app, email):
+    from models import EmailOutbox
+    from utils.sharding import user_shards
+
+    with app.app_context():
+        user_shards.use_email(email)
+        row = EmailOutbox.query.filter_by(to_email=email).order_by(EmailOutbox.id.desc()).first()
+    link = re.search(r"\S+/verify\?\S+", row.body) if row else None
+    if link is None:
+        return None
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(link.group(0)).query).get("token", [None])[0]
+
+
+def journey(app, base, index, profile_reads, recorder):
+    email = f"load{index}@example.com"
+    status, elapsed, _ = request("POST", f"{base}/signup", body={"email": email, "password": PASSWORD})
+    recorder.record("signup", status, elapsed)
+    if status != 200:
+        return False
+
+    token = verification_token(app, email)
+    status, elapsed, _ = request("GET", f"{base}/verify?token={token}")
+    recorder.record("verify", status, elapsed)
+    if status != 200:
+        return False
+
+    status, elapsed, tokens = post_json(f"{base}/logintoken", {"email": email, "password": PASSWORD})
+    recorder.record("login", status, elapsed)
+    if status != 200:
+        return False
+
+    for _ in range(profile_reads):
+        status, elapsed, _ = request("GET", f"{base}/profile", token=tokens["access_token"])
+        recorder.record("profile", status, elapsed)
+
+    status, elapsed, _ = request(
+        "POST", f"{base}/logout", body={"refresh_token": tokens["refresh_token"]}, token=tokens["access_token"]
+    )
+    recorder.record("logout", status, elapsed)
+    return status == 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--profile-reads", type=int, default=5)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--fast-hash", action="store_true", help="replace bcrypt with a constant hash")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(database_url=args.database_url, OUTBOX_AUTOSTART="false")
+    app = load_app()
+    disable_deliverability_check()
+    if args.fast_hash:
+        from extensions import hashing
+
+        fixed = hashing.hash_password(PASSWORD)
+        hashing.hash_password = lambda password: fixed
+        hashing.check_password = lambda password, hashed: password == PASSWORD
+
+    base, server = serve(app)
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        completed = sum(
+            pool.map(lambda i: journey(app, base, i, args.profile_reads, recorder), range(args.users))
+        )
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    total_requests = sum(len(samples) for samples in recorder.samples.values())
+    emit(
+        {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0],
+            "seconds": round(elapsed, 2),
+            "completed_journeys": completed,
+            "journeys_per_second": round(completed / elapsed, 2),
+            "requests_per_second": round(total_requests / elapsed, 1),
+            "steps": {
+                step: {
+                    "statuses": dict(recorder.statuses[step]),
+                    "per_second": round(len(recorder.samples[step]) / elapsed, 1),
+                    **summarize(recorder.samples[step]),
+                }
+                for step in STEPS
+            },
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Connection-pool behaviour under concurrent /logintoken and /profile traffic.
+
+Runs with a deliberately small pool (--pool-size, no overflow, short --pool-timeout) and the
+profile cache disabled so every request needs a connection. Prints per-route status mix and
+latency, the peak checked-out/overflow counts sampled while the load runs and the pool's
+wait-time and timeout counters. Requests that can't get a connection in time answer 503.
+"""
+import argparse
+import collections
+import threading
+import time
+
+from common import configure_env, create_verified_user, emit, load_app, request, serve, summarize
+
+
+def worker(method, url, body, token, stop, samples, statuses):
+    while not stop.is_set():
+        status, elapsed, _ = request(method, url, body=body, token=token)
+        statuses[status] += 1
+        samples.append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--max-overflow", type=int, default=0)
+    parser.add_argument("--pool-timeout", type=int, default=1)
+    parser.add_argument("--login-threads", type=int, default=8)
+    parser.add_argument("--profile-threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(
+        DB_POOL_SIZE=args.pool_size,
+        DB_MAX_OVERFLOW=args.max_overflow,
+        DB_POOL_TIMEOUT=args.pool_timeout,
+        PROFILE_CACHE_TTL=0,
+        HASH_POOL_MAX_QUEUE=1000,
+    )
+    app = load_app()
+    from extensions import db
+    from utils.db_pool import pool_stats
+
+    credentials = {"email": "pool@example.com", "password": "Bench123!"}
+    create_verified_user(app, credentials["email"], credentials["password"])
+    with app.test_client() as client:
+        token = client.post("/logintoken", json=credentials).json["access_token"]
+    base_url, server = serve(app)
+
+    stop = threading.Event()
+    routes = {
+        "logintoken": ("POST", f"{base_url}/logintoken", credentials, None, args.login_threads),
+        "profile": ("GET", f"{base_url}/profile", None, token, args.profile_threads),
+    }
+    samples = {name: [] for name in routes}
+    statuses = {name: collections.Counter() for name in routes}
+    threads = []
+    for name, (method, url, body, bearer, count) in routes.items():
+        for _ in range(count):
+            threads.append(
+                threading.Thread(target=worker, args=(method, url, body, bearer, stop, samples[name], statuses[name]))
+            )
+    for thread in threads:
+        thread.start()
+
+    peak = {"checked_out": 0, "overflow": 0}
+    deadline = time.monotonic() + args.duration
+    with app.app_context():
+        while time.monotonic() < deadline:
+            stats = pool_stats(db.engine)
+            for key in peak:
+                peak[key] = max(peak[key], stats.get(key, 0))
+            time.sleep(0.05)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        final = pool_stats(db.engine)
+    server.shutdown()
+
+    emit(
+        {
+            "pool_size": args.pool_size,
+            "max_overflow": args.max_overflow,
+            "pool_timeout": args.pool_timeout,
+            "routes": {
+                name: {"latency": summarize(samples[name]), "statuses": dict(statuses[name])} for name in routes
+            },
+            "peak": peak,
+            "pool": final,
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
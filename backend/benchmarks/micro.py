@@ -0,0 +1,48 @@
+"""
+Micro-benchmarks for the per-request building blocks: validators, password hashing and JWT encode/decode.
+
+Each case is called in a tight loop in-process (no HTTP, no database) and reported as ops/second plus
+p50/p95/p99. bcrypt is slow by design, so it gets --hash-iterations instead of --iterations.
+Use --output to save the JSON and benchmarks/compare.py to diff two runs.
+"""
+import argparse
+
+from common import configure_env, emit, load_app, micro
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--hash-iterations", type=int, default=20)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(OUTBOX_AUTOSTART="false", HASH_POOL_WORKERS=0)
+    app = load_app()
+    from email_validator import validate_email
+    from flask_jwt_extended import create_access_token, decode_token
+    from extensions import hashing
+    from utils.validators import is_valid_israeli_phone, is_valid_password, normalize_email
+
+    n = args.iterations
+    hashed = hashing.hash_password("Bench123!")
+    results = {
+        "normalize_email": micro(lambda: normalize_email("  Some.User@Example.COM "), n),
+        "validate_email_syntax": micro(lambda: validate_email("some.user@example.com", check_deliverability=False), n),
+        "is_valid_password": micro(lambda: is_valid_password("Bench123!"), n),
+        "is_valid_israeli_phone": micro(lambda: is_valid_israeli_phone("0541234567"), n),
+        "bcrypt_hash": micro(lambda: hashing.hash_password("Bench123!"), args.hash_iterations, warmup=1),
+        "bcrypt_check": micro(lambda: hashing.check_password("Bench123!", hashed), args.hash_iterations, warmup=1),
+    }
+
+    with app.app_context():
+        claims = {"email": "bench@example.com", "full_name": "Bench User", "phone_number": None, "address": None}
+        token = create_access_token(identity="bench-user", additional_claims=claims)
+        results["jwt_encode"] = micro(lambda: create_access_token(identity="bench-user", additional_claims=claims), n)
+        results["jwt_decode"] = micro(lambda: decode_token(token), n)
+
+    emit({"iterations": n, "hash_iterations": args.hash_iterations, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from datetime import timedelta
 from dotenv import load_dotenv
 import os
+from utils.db_pool import engine_options
 
 
 load_dotenv()
@@ -12,6 +13,223 @@ class Config:
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_ECHO = True
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=7)
-    CORS_SUPPORTS_CREDENTIALS = True
\ No newline at end of file
+    # SQLAlchemy's echo writes synchronously; statement logging goes through the logging queue instead (LOG_SQL)
+    SQLALCHEMY_ECHO = False
+    # DB_POOL_TIMEOUT is whole seconds: Flask-SQLAlchemy coerces pool_timeout to int
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI,
+        pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        statement_timeout_ms=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0)) or None,
+    )
+    DB_POOL_RETRY_AFTER = int(os.getenv("DB_POOL_RETRY_AFTER", 1))
+    # Comma-separated database URLs the users (and their tokens, sessions and outbox rows) are sharded over by
+    # email hash; unset keeps them in SQLALCHEMY_DATABASE_URI. Change it only together with `flask reshard-users`
+    USER_SHARDS = [url.strip() for url in os.getenv("USER_SHARDS", "").split(",") if url.strip()]
+    USER_SHARD_POOL_SIZE = int(os.getenv("USER_SHARD_POOL_SIZE", 5))
+    USER_SHARD_MAX_OVERFLOW = int(os.getenv("USER_SHARD_MAX_OVERFLOW", 10))
+    # Read replicas of SQLALCHEMY_DATABASE_URI (comma-separated) and of each user shard (";" between shards, in
+    # USER_SHARDS order). Only the user-table reads of /profile, /logintoken and /verify use them; a replica more
+    # than REPLICA_MAX_LAG seconds behind (checked every REPLICA_HEALTH_INTERVAL) is skipped. A replica read that
+    # is older than the client's own last write (see routes.get_profile and login) is repeated on the primary
+    DB_REPLICAS = [url.strip() for url in os.getenv("DB_REPLICAS", "").split(",") if url.strip()]
+    USER_SHARD_REPLICAS = [
+        [url.strip() for url in group.split(",") if url.strip()]
+        for group in os.getenv("USER_SHARD_REPLICAS", "").split(";")
+    ] if os.getenv("USER_SHARD_REPLICAS") else []
+    REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 2.0))
+    REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", 2.0))
+    # Users created before sharding have ids without a shard bucket; where they live is looked up once and cached
+    USER_SHARD_LEGACY_ID_CACHE_SIZE = int(os.getenv("USER_SHARD_LEGACY_ID_CACHE_SIZE", 10000))
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=int(os.getenv("JWT_ACCESS_TOKEN_MINUTES", 7)))
+    # HS256 signs with JWT_SECRET_KEY. RS256/ES256/EdDSA sign with rotating keys from JWT_KEYS_DIR (created on
+    # first start, rotated by `flask rotate-jwt-keys`) published at /.well-known/jwks.json for local verification
+    JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+    JWT_KEYS_DIR = os.getenv(
+        "JWT_KEYS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "jwt-keys")
+    )
+    JWT_KEY_ROTATION_DAYS = float(os.getenv("JWT_KEY_ROTATION_DAYS", 30))
+    # New keys are published this many seconds before they start signing, so cached JWKS copies already know them
+    JWT_KEY_PUBLISH_AHEAD = float(os.getenv("JWT_KEY_PUBLISH_AHEAD", 3600))
+    JWT_KEYS_RELOAD_INTERVAL = float(os.getenv("JWT_KEYS_RELOAD_INTERVAL", 60))
+    JWKS_MAX_AGE = int(os.getenv("JWKS_MAX_AGE", 300))
+    CORS_SUPPORTS_CREDENTIALS = True
+
+    # Rotating refresh tokens ("remember me" gets the long lifetime)
+    REFRESH_TOKEN_EXPIRES = timedelta(hours=int(os.getenv("REFRESH_TOKEN_HOURS", 12)))
+    REFRESH_TOKEN_EXPIRES_REMEMBER = timedelta(days=int(os.getenv("REFRESH_TOKEN_REMEMBER_DAYS", 30)))
+
+    # bcrypt worker pool (0 workers = hash inline on the request thread)
+    HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", os.cpu_count() or 1))
+    HASH_POOL_MAX_QUEUE = int(os.getenv("HASH_POOL_MAX_QUEUE", 32))
+    HASH_POOL_RETRY_AFTER = int(os.getenv("HASH_POOL_RETRY_AFTER", 1))
+    # Seconds a request waits for its hash before answering 503 like a full queue; 0 waits indefinitely
+    HASH_POOL_TIMEOUT = float(os.getenv("HASH_POOL_TIMEOUT", 10.0))
+
+    # Password hash policy: "bcrypt" or "argon2id" (needs argon2-cffi). Setting HASH_TARGET_MS calibrates
+    # the cost to that many milliseconds per hash at startup instead. Logins rehash outdated hashes.
+    HASH_SCHEME = os.getenv("HASH_SCHEME", "bcrypt")
+    HASH_BCRYPT_ROUNDS = int(os.getenv("HASH_BCRYPT_ROUNDS", 12))
+    HASH_BCRYPT_MIN_ROUNDS = int(os.getenv("HASH_BCRYPT_MIN_ROUNDS", 10))
+    HASH_ARGON2_TIME_COST = int(os.getenv("HASH_ARGON2_TIME_COST", 3))
+    HASH_ARGON2_MEMORY_COST = int(os.getenv("HASH_ARGON2_MEMORY_COST", 65536))  # KiB
+    HASH_ARGON2_PARALLELISM = int(os.getenv("HASH_ARGON2_PARALLELISM", 4))
+    HASH_TARGET_MS = float(os.getenv("HASH_TARGET_MS", 0)) or None
+
+    # Verification emails go through the email_outbox table and a background dispatcher
+    SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+    SMTP_PORT = int(os.getenv("SMTP_PORT", 465))
+    SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "true").lower() == "true"
+    SMTP_USERNAME = os.getenv("SMTP_USERNAME", EMAIL_ADDRESS)
+    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", EMAIL_PASSWORD)
+    SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 2))
+    MAIL_SENDER = os.getenv("MAIL_SENDER", EMAIL_ADDRESS)
+    OUTBOX_AUTOSTART = os.getenv("OUTBOX_AUTOSTART", "true").lower() == "true"
+    OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+    OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 1.0))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+    OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 5.0))
+
+    # Revoked JWTs: "sql" (revoked_tokens table) or "redis"; each process fronts it with a Bloom filter
+    REVOCATION_BACKEND = os.getenv("REVOCATION_BACKEND", "sql")
+    REVOCATION_REDIS_URL = os.getenv("REVOCATION_REDIS_URL", "redis://localhost:6379/0")
+    REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", 1.0))
+    REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", 100000))
+
+    # users.token_generation cache for the per-request revoke-all check (bumps reach other workers within the TTL)
+    TOKEN_GENERATION_CACHE_TTL = float(os.getenv("TOKEN_GENERATION_CACHE_TTL", 5.0))
+    TOKEN_GENERATION_CACHE_SIZE = int(os.getenv("TOKEN_GENERATION_CACHE_SIZE", 10000))
+
+    # Verified access tokens (by SHA-256) whose signature check is skipped when presented again, until their exp;
+    # the blocklist check above still runs every time. 0 disables
+    JWT_VERIFY_CACHE_SIZE = int(os.getenv("JWT_VERIFY_CACHE_SIZE", 10000))
+
+    # GET /profile payload cache (per process). Set the URL to broadcast invalidations between workers; without it
+    # a hit is served only if it is at least the version in the client's access token ("ver", re-issued by
+    # PUT/PATCH), so a client never reads back a profile older than its own last write. Hits cost no DB access
+    PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", 10000))
+    PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", 30.0))
+    PROFILE_CACHE_INVALIDATION_URL = os.getenv("PROFILE_CACHE_INVALIDATION_URL")
+
+    # Verification tokens and the sweeper that purges expired tokens / stale unverified accounts
+    VERIFICATION_TOKEN_TTL_MINUTES = int(os.getenv("VERIFICATION_TOKEN_TTL_MINUTES", 60))
+    UNVERIFIED_ACCOUNT_TTL_DAYS = int(os.getenv("UNVERIFIED_ACCOUNT_TTL_DAYS", 7))
+    OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+    SWEEPER_AUTOSTART = os.getenv("SWEEPER_AUTOSTART", "false").lower() == "true"
+    SWEEPER_INTERVAL = float(os.getenv("SWEEPER_INTERVAL", 300))
+    SWEEPER_BATCH_SIZE = int(os.getenv("SWEEPER_BATCH_SIZE", 500))
+    SWEEPER_BATCH_PAUSE = float(os.getenv("SWEEPER_BATCH_PAUSE", 0.05))
+
+    # Signup email deliverability (MX) check, cached per domain
+    EMAIL_CHECK_DELIVERABILITY = os.getenv("EMAIL_CHECK_DELIVERABILITY", "true").lower() == "true"
+    EMAIL_DELIVERABILITY_TIMEOUT = float(os.getenv("EMAIL_DELIVERABILITY_TIMEOUT", 2.0))
+    EMAIL_DOMAIN_CACHE_SIZE = int(os.getenv("EMAIL_DOMAIN_CACHE_SIZE", 10000))
+    EMAIL_DOMAIN_CACHE_TTL = float(os.getenv("EMAIL_DOMAIN_CACHE_TTL", 3600))
+
+    # Failed-login lockout per account and per IP (login_failures table): after the threshold a key is locked for
+    # LOGIN_LOCKOUT_BASE seconds, doubling per further failure up to LOGIN_LOCKOUT_MAX
+    LOGIN_LOCKOUT_ENABLED = os.getenv("LOGIN_LOCKOUT_ENABLED", "true").lower() == "true"
+    LOGIN_MAX_ACCOUNT_FAILURES = int(os.getenv("LOGIN_MAX_ACCOUNT_FAILURES", 5))
+    LOGIN_MAX_IP_FAILURES = int(os.getenv("LOGIN_MAX_IP_FAILURES", 100))
+    LOGIN_LOCKOUT_BASE = float(os.getenv("LOGIN_LOCKOUT_BASE", 30))
+    LOGIN_LOCKOUT_MAX = float(os.getenv("LOGIN_LOCKOUT_MAX", 900))
+    LOGIN_FAILURE_WINDOW = float(os.getenv("LOGIN_FAILURE_WINDOW", 900))
+
+    # Logging: one JSON line per record (LOG_FORMAT=text for humans), written by a background thread from a
+    # bounded queue that drops rather than blocks. LOG_SAMPLE_RATES keeps a fraction of the records below WARNING
+    # per logger category ("access" is the per-request line, "sqlalchemy.engine" the LOG_SQL statements).
+    # LOG_REDACT masks email addresses and blanks out JWTs, passwords and tokens. LOG_CONFIGURE=auto installs
+    # all this unless the app is TESTING or the root logger already has handlers (pytest, gunicorn --log-config);
+    # true / false force it on / off
+    LOG_CONFIGURE = os.getenv("LOG_CONFIGURE", "auto").lower()
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_FILE = os.getenv("LOG_FILE")  # unset writes to stderr
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "access=0.1")
+    LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() == "true"
+    LOG_ACCESS = os.getenv("LOG_ACCESS", "true").lower() == "true"
+    LOG_SQL = os.getenv("LOG_SQL", os.getenv("SQLALCHEMY_ECHO", "false")).lower() == "true"
+
+    # Responses: JSON_ENCODER "auto" uses orjson when it's installed ("orjson" requires it, "std" is Flask's json).
+    # Text/JSON bodies of at least COMPRESS_MIN_SIZE bytes go out in the first of COMPRESS_ENCODINGS the client
+    # accepts ("br,gzip" needs the brotli package; empty turns compression off)
+    JSON_ENCODER = os.getenv("JSON_ENCODER", "auto")
+    COMPRESS_ENCODINGS = os.getenv("COMPRESS_ENCODINGS", "gzip")
+    COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 500))
+    COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4))
+
+    # frontend/ served at FRONTEND_URL_PREFIX: pages revalidated on every load, scripts/styles/images under
+    # content-hashed names cached for STATIC_MAX_AGE seconds (an empty FRONTEND_DIR serves nothing)
+    FRONTEND_DIR = os.getenv(
+        "FRONTEND_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend")
+    )
+    FRONTEND_URL_PREFIX = os.getenv("FRONTEND_URL_PREFIX", "/app")
+    STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 31536000))
+
+    # Prometheus metrics at GET /metrics (per process); false makes the instrumentation a no-op
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # bearer token for /metrics and /metrics/db-pool; unset disables them
+
+    # Bulk user import/export (`flask import-users` / `export-users`, /admin/users/*)
+    ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")  # unset disables the /admin endpoints
+    BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", 1000))
+    BULK_IMPORT_WORKERS = int(os.getenv("BULK_IMPORT_WORKERS", os.cpu_count() or 1))
+
+    # Rate limits are shared by all workers: "sql://" (rate_limit_counters table), "redis://..." or "memory://".
+    # The table comes from the migrations; a separate RATELIMIT_DATABASE_URI isn't migrated, so there
+    # RATELIMIT_CREATE_TABLE=true lets the storage create it.
+    RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", "sql://")
+    RATELIMIT_STORAGE_OPTIONS = {
+        "url": os.getenv("RATELIMIT_DATABASE_URI", SQLALCHEMY_DATABASE_URI),
+        "lease_fraction": float(os.getenv("RATELIMIT_LEASE_FRACTION", 0.1)),
+        "create_table": bool(os.getenv("RATELIMIT_DATABASE_URI"))
+        and os.getenv("RATELIMIT_CREATE_TABLE", "false").lower() == "true",
+    } if RATELIMIT_STORAGE_URI.startswith("sql") else {}
+    RATELIMIT_STRATEGY = os.getenv("RATELIMIT_STRATEGY", "sliding-window-counter")
+    RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "true").lower() == "true"
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        Config.SQLALCHEMY_DATABASE_URI,
+        pool_size=int(os.getenv("DB_POOL_SIZE", 2)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 2)),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", 5)),
+    )
+
+
+class ProductionConfig(Config):
+    DEBUG = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        Config.SQLALCHEMY_DATABASE_URI,
+        pool_size=int(os.getenv("DB_POOL_SIZE", 10)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 20)),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", 5)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        statement_timeout_ms=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 5000)) or None,
+    )
+
+
+config_by_name = {
+    "development": DevelopmentConfig,
+    "testing": TestingConfig,
+    "production": ProductionConfig,
+}
+
+
+def get_config(name=None):
+    """Config class for `name`, or for the APP_ENV environment variable (default: development)."""
+    name = name or os.getenv("APP_ENV", "development")
+    try:
+        return config_by_name[name]
+    except KeyError:
+        raise ValueError(f"Unknown APP_ENV: {name}") from None
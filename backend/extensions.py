@@ -1,10 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from utils.hashing import HashingPool
+from utils.jwt_cache import CachingJWTManager
+from utils.metrics import metrics
+from utils.sharding import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession sends the user tables to the selected USER_SHARDS database (utils/sharding.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 bcrypt = Bcrypt()
-jwt = JWTManager()
-limiter = Limiter(key_func=get_remote_address, storage_uri="memory://")
+jwt = CachingJWTManager()
+# storage and strategy come from RATELIMIT_STORAGE_URI / RATELIMIT_STRATEGY in config.py
+limiter = Limiter(key_func=get_remote_address, on_breach=metrics.rate_limit_breached)
+hashing = HashingPool()
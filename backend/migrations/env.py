@@ -0,0 +1,52 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import create_app
+from extensions import db
+from utils.sharding import user_shards
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
+
+app = config.attributes.get("app") or create_app()
+target_metadata = db.metadata
+
+
+def run_migrations_offline():
+    """Emit SQL for `alembic upgrade head --sql` without connecting."""
+    context.configure(
+        url=app.config["SQLALCHEMY_DATABASE_URI"],
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_on(connection):
+    # Batch mode lets ALTER-style migrations work on SQLite too (copy-and-move).
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # Callers (e.g. tests) can hand in their own connection through Config.attributes.
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run_migrations_on(connection)
+        return
+    with app.app_context():
+        # Every USER_SHARDS database gets the full schema too (only its user tables are used).
+        for engine in (db.engine, *user_shards.engines):
+            with engine.connect() as connection:
+                run_migrations_on(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
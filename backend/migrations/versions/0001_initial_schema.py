@@ -0,0 +1,39 @@
+"""initial schema
+
+The users table exactly as the original app created it with db.create_all(); databases created that way are
+stamped at this revision (`alembic stamp 0001`) and upgraded from here.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 17:40:28.383246
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.String(length=40), nullable=False),
+    sa.Column('email', sa.String(length=150), nullable=False),
+    sa.Column('password', sa.String(length=150), nullable=False),
+    sa.Column('is_verified', sa.Boolean(), nullable=True),
+    sa.Column('verification_token', sa.String(length=150), nullable=True),
+    sa.Column('verification_token_expiry', sa.DateTime(), nullable=True),
+    sa.Column('full_name', sa.String(length=150), nullable=True),
+    sa.Column('phone_number', sa.String(length=20), nullable=True),
+    sa.Column('address', sa.String(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('id'),
+    sa.UniqueConstraint('verification_token')
+    )
+
+
+def downgrade():
+    op.drop_table('users')
@@ -0,0 +1,162 @@
+"""hashed tokens, outbox, revocation and rate limit tables
+
+Converts the original schema: verification tokens move out of users into verification_tokens (hashed),
+users gain created_at (backfilled with the migration time, so the sweeper gives existing unverified
+accounts a full UNVERIFIED_ACCOUNT_TTL_DAYS from the upgrade), and the outbox, refresh token, revocation
+and rate limit tables are created.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 19:10:41.118904
+"""
+from datetime import datetime
+import hashlib
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('email_outbox',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('to_email', sa.String(length=150), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.create_index('ix_email_outbox_status_next_attempt', ['status', 'next_attempt_at'], unique=False)
+
+    op.create_table('rate_limit_counters',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('rate_limit_counters', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_rate_limit_counters_expires_at'), ['expires_at'], unique=False)
+
+    op.create_table('revoked_tokens',
+    sa.Column('jti', sa.String(length=36), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('revoked_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    with op.batch_alter_table('revoked_tokens', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_revoked_tokens_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_revoked_tokens_revoked_at'), ['revoked_at'], unique=False)
+
+    op.create_table('refresh_tokens',
+    sa.Column('token_hash', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.String(length=40), nullable=False),
+    sa.Column('family_id', sa.String(length=36), nullable=False),
+    sa.Column('remember', sa.Boolean(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('used_at', sa.DateTime(), nullable=True),
+    sa.Column('revoked', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('token_hash')
+    )
+    with op.batch_alter_table('refresh_tokens', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_refresh_tokens_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_refresh_tokens_family_id'), ['family_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_refresh_tokens_user_id'), ['user_id'], unique=False)
+
+    op.create_table('verification_tokens',
+    sa.Column('token_hash', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.String(length=40), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('token_hash')
+    )
+    with op.batch_alter_table('verification_tokens', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_verification_tokens_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_verification_tokens_user_id'), ['user_id'], unique=False)
+
+    # created_at is NOT NULL: add it nullable, backfill, then tighten it.
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+    users = sa.table(
+        'users',
+        sa.column('id', sa.String),
+        sa.column('created_at', sa.DateTime),
+        sa.column('verification_token', sa.String),
+        sa.column('verification_token_expiry', sa.DateTime),
+    )
+    now = datetime.utcnow()
+    op.execute(users.update().values(created_at=now))
+    if not context.is_offline_mode():
+        _move_verification_tokens(users, now)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.drop_column('verification_token_expiry')
+        batch_op.drop_column('verification_token')
+        batch_op.create_index('ix_users_unverified_created_at', ['is_verified', 'created_at'], unique=False)
+
+
+def _move_verification_tokens(users, now):
+    """
+    Links already sent keep working until they expire: their hashes go to verification_tokens. Hashing needs
+    Python, so `alembic upgrade --sql` skips this and those users ask for a new link instead.
+    """
+    rows = op.get_bind().execute(
+        sa.select(users.c.id, users.c.verification_token, users.c.verification_token_expiry).where(
+            users.c.verification_token.is_not(None), users.c.verification_token_expiry > now
+        )
+    ).all()
+    if rows:
+        op.bulk_insert(
+            sa.table('verification_tokens', sa.column('token_hash'), sa.column('user_id'), sa.column('expires_at')),
+            [
+                {"token_hash": hashlib.sha256(token.encode()).hexdigest(), "user_id": user_id, "expires_at": expires_at}
+                for user_id, token, expires_at in rows
+            ],
+        )
+
+
+def downgrade():
+    # Pending verification tokens and the created_at dates are lost; unverified users ask for a new link.
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_unverified_created_at')
+        batch_op.add_column(sa.Column('verification_token', sa.String(length=150), nullable=True))
+        batch_op.add_column(sa.Column('verification_token_expiry', sa.DateTime(), nullable=True))
+        batch_op.create_unique_constraint('uq_users_verification_token', ['verification_token'])
+        batch_op.drop_column('created_at')
+
+    with op.batch_alter_table('verification_tokens', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_verification_tokens_user_id'))
+        batch_op.drop_index(batch_op.f('ix_verification_tokens_expires_at'))
+
+    op.drop_table('verification_tokens')
+    with op.batch_alter_table('refresh_tokens', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_refresh_tokens_user_id'))
+        batch_op.drop_index(batch_op.f('ix_refresh_tokens_family_id'))
+        batch_op.drop_index(batch_op.f('ix_refresh_tokens_expires_at'))
+
+    op.drop_table('refresh_tokens')
+    with op.batch_alter_table('revoked_tokens', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_revoked_tokens_revoked_at'))
+        batch_op.drop_index(batch_op.f('ix_revoked_tokens_expires_at'))
+
+    op.drop_table('revoked_tokens')
+    with op.batch_alter_table('rate_limit_counters', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_rate_limit_counters_expires_at'))
+
+    op.drop_table('rate_limit_counters')
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_email_outbox_status_next_attempt')
+
+    op.drop_table('email_outbox')
@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy # pip install Flask-SQLAlchemy
 from datetime import datetime 
 from extensions import db
+from sqlalchemy.orm import validates
+from utils.validators import normalize_email
+from utils.sharding import user_shards
 
 class User(db.Model):
     __tablename__ = "users"
@@ -8,14 +11,118 @@ class User(db.Model):
     email = db.Column(db.String(150), nullable=False, unique=True)
     password = db.Column(db.String(150), nullable=False)
 
-    # email verification
+    # email verification (tokens live hashed in verification_tokens)
     is_verified = db.Column(db.Boolean, default=False)
-    verification_token = db.Column(db.String(150), nullable=True, unique=True)
-    verification_token_expiry = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     
     # For profile information
     full_name = db.Column(db.String(150), nullable=True)
     phone_number = db.Column(db.String(20), nullable=True)
     address = db.Column(db.String(255), nullable=True)
+    # Bumped by every profile change; the /profile ETag and If-Match preconditions are built on it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
+    # Carried in every access token ("gen"); bumping it revokes all of the user's tokens at once
+    token_generation = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # lets the sweeper find long-unverified accounts without scanning the table
+    __table_args__ = (db.Index("ix_users_unverified_created_at", "is_verified", "created_at"),)
+
+    @validates("email")
+    def _normalize_email(self, key, email):
+        return normalize_email(email)
+
+    @classmethod
+    def find_by_email(cls, email):
+        """The single lookup path by email; selects the user's shard and uses the unique index on the normalized column."""
+        email = normalize_email(email)
+        user_shards.use_email(email)
+        return cls.query.filter_by(email=email).first()
+
+
+class VerificationToken(db.Model):
+    """Email verification / reset codes. Only the SHA-256 of the token is stored; expired rows are purged by the sweeper."""
+    __tablename__ = "verification_tokens"
+    token_hash = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.String(40), db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class RefreshToken(db.Model):
+    """
+    Opaque refresh tokens (stored as SHA-256). Every refresh rotates the token within its family;
+    presenting an already-used token revokes the whole family (reuse detection).
+    """
+    __tablename__ = "refresh_tokens"
+    token_hash = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.String(40), db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    family_id = db.Column(db.String(36), nullable=False, index=True)
+    remember = db.Column(db.Boolean, nullable=False, default=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    used_at = db.Column(db.DateTime, nullable=True)
+    revoked = db.Column(db.Boolean, nullable=False, default=False)
+
+
+class UserSession(db.Model):
+    """
+    One row per login (device), keyed by the id of its refresh token family; access tokens carry it as "sid".
+    expires_at follows the newest refresh token, so expired sessions can be listed out and purged.
+    """
+    __tablename__ = "sessions"
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.String(40), db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_agent = db.Column(db.String(255), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    remember = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
+
+class EmailOutbox(db.Model):
+    """Outgoing emails, written in the same transaction as the row that triggered them and sent by the outbox dispatcher."""
+    __tablename__ = "email_outbox"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    to_email = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    # delivery state: pending -> sent, or failed after OUTBOX_MAX_ATTEMPTS (either way the body is then cleared)
+    status = db.Column(db.String(10), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),)
+
+
+class RevokedToken(db.Model):
+    """Revoked JWT ids. Rows are only needed until the token itself expires and are purged after that."""
+    __tablename__ = "revoked_tokens"
+    jti = db.Column(db.String(36), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class RateLimitCounter(db.Model):
+    """Shared rate-limit window counters (see utils/rate_limit.py). expires_at is seconds since the epoch."""
+    __tablename__ = "rate_limit_counters"
+    key = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
+
+class LoginFailure(db.Model):
+    """
+    Recent failed logins per account ("account:<email>") and per client IP ("ip:<addr>"), see utils/login_guard.py.
+    Times are seconds since the epoch; rows of keys that stopped failing are purged by the sweeper.
+    """
+    __tablename__ = "login_failures"
+    key = db.Column(db.String(255), primary_key=True)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    last_failure_at = db.Column(db.Float, nullable=False, index=True)
+    locked_until = db.Column(db.Float, nullable=True)
@@ -1,9 +1,19 @@
-from flask import Blueprint, request, jsonify, render_template, current_app
+from flask import Blueprint, Response, request, jsonify, render_template, current_app, stream_with_context
 from models import User
-from utils.validators import is_valid_email, is_valid_password, is_valid_israeli_phone
-from utils.email_utils import send_verification_email, generate_verification_code
-from datetime import datetime, timedelta
-from extensions import db, bcrypt, limiter
+from utils.validators import normalize_email, validate_profile, validate_signup
+from utils.email_utils import queue_verification_email, outbox
+from utils.verification import issue_verification_token, consume_verification_token
+from utils.refresh_tokens import issue_refresh_token, rotate_refresh_token, revoke_refresh_token
+from utils.sessions import (
+    list_sessions,
+    revoke_all_sessions,
+    revoke_session,
+    start_session,
+    token_generations,
+    touch_session,
+)
+from datetime import timedelta
+from extensions import db, limiter, hashing
 from flask_limiter.util import get_remote_address
 from flask_jwt_extended import (
     create_access_token,
@@ -11,17 +21,160 @@ from flask_jwt_extended import (
     get_jwt_identity,
     jwt_required,
 )
-import uuid
-import bcrypt
+from utils.hashing import HashingPoolBusy
+from utils.revocation import revocation_store
+from utils.profile_cache import profile_cache
+from utils.profiles import (
+    PROFILE_FIELDS, apply_profile_changes, etag_versions, load_profile_row, profile_etag,
+)
+from utils.db_pool import pool_stats
+from utils.metrics import metrics
+from utils.login_guard import login_guard
+from utils.jwt_keys import key_ring
+from utils.sharding import new_user_id, user_shards
+from utils.replicas import read_replicas
+from utils.bulk_users import FORMATS, export_users, import_users, read_rows
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from functools import wraps
+import hmac
+import io
+import logging
+
+logger = logging.getLogger(__name__)
 
 app_routes = Blueprint("app_routes", __name__)
 
 
+@app_routes.after_request
+def default_cache_headers(response):
+    """
+    Views that set a caching policy (GET /profile, the JWKS) keep it. Other successful GETs may be per-user, so
+    they get private, no-cache and an ETag of their body, and a client polling them is answered with 304 while
+    nothing changed. Everything else (tokens in login/refresh responses, errors, exports) must not be stored.
+    """
+    if "Cache-Control" in response.headers:
+        return response
+    if request.method in ("GET", "HEAD") and response.status_code == 200 and not response.is_streamed:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
+    response.cache_control.no_store = True
+    return response
+
+
+def verification_token_ttl():
+    return timedelta(minutes=current_app.config["VERIFICATION_TOKEN_TTL_MINUTES"])
+
+
+def issue_access_token(user, session_id=None):
+    # Short-lived (JWT_ACCESS_TOKEN_EXPIRES); clients show the profile from the claims without a round trip.
+    # "gen" is checked against users.token_generation (revoke-all), "sid" names the session it belongs to,
+    # "ver" is the profile version the claims show (GET /profile won't serve an older cached one).
+    with metrics.jwt.time(op="encode"):
+        return create_access_token(
+            identity=user.id,
+            additional_claims={
+                "email": user.email,
+                "full_name": user.full_name,
+                "phone_number": user.phone_number,
+                "address": user.address,
+                "gen": user.token_generation or 0,
+                "sid": session_id,
+                "ver": user.version,
+            },
+        )
+
+
 @app_routes.route("/", methods=["GET"])
 def home():
     return "User Authentication System - Assignment", 200
 
 
+@app_routes.route("/.well-known/jwks.json", methods=["GET"])
+def jwks():
+    # Lets other services verify access tokens locally; they only come back when they see an unknown kid.
+    if not key_ring.asymmetric:
+        return jsonify({"error": "Tokens are signed with a shared secret (HS256); there is no public key set"}), 404
+    body, etag = key_ring.jwks()
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = key_ring.jwks_max_age
+    return response.make_conditional(request)
+
+
+def metrics_token_required(view):
+    """Guards the metrics endpoints with METRICS_TOKEN (Authorization: Bearer); unset means they answer 404."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = current_app.config.get("METRICS_TOKEN")
+        if not expected:
+            return jsonify({"error": "Not found"}), 404
+        provided = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(provided.encode(), expected.encode()):
+            return jsonify({"error": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app_routes.route("/metrics", methods=["GET"])
+@metrics_token_required
+def prometheus_metrics():
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app_routes.route("/metrics/db-pool", methods=["GET"])
+@metrics_token_required
+def db_pool_metrics():
+    stats = {name or "default": pool_stats(engine) for name, engine in db.engines.items()}
+    stats.update({f"user_shard_{i}": pool_stats(engine) for i, engine in enumerate(user_shards.engines)})
+    return jsonify(stats), 200
+
+
+def admin_required(view):
+    """Guards bulk/admin endpoints with the shared ADMIN_API_TOKEN (X-Admin-Token header); unset means disabled."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = current_app.config.get("ADMIN_API_TOKEN")
+        provided = request.headers.get("X-Admin-Token", "")
+        if not expected or not hmac.compare_digest(provided.encode(), expected.encode()):
+            return jsonify({"error": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def bulk_format():
+    fmt = request.args.get("format")
+    if fmt is None:
+        fmt = "ndjson" if "ndjson" in (request.mimetype or "") else "csv"
+    return fmt if fmt in FORMATS else None
+
+
+@app_routes.route("/admin/users/import", methods=["POST"])
+@admin_required
+def bulk_import_users():
+    fmt = bulk_format()
+    if fmt is None:
+        return jsonify({"error": f"Unsupported format, expected one of {', '.join(FORMATS)}"}), 400
+    verified = request.args.get("verified", "false").lower() == "true"
+    # Rows are parsed straight off the request body, never buffered whole.
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    return jsonify(import_users(read_rows(stream, fmt), verified=verified)), 200
+
+
+@app_routes.route("/admin/users/export", methods=["GET"])
+@admin_required
+def bulk_export_users():
+    fmt = bulk_format()
+    if fmt is None:
+        return jsonify({"error": f"Unsupported format, expected one of {', '.join(FORMATS)}"}), 400
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(export_users(fmt)), mimetype=mimetype)
+
+
 @app_routes.route("/signup", methods=["POST"])
 def signup():
     try:
@@ -30,41 +183,48 @@ def signup():
         if not email or not password:
             return jsonify({"error": "Missing credentials"}), 400
 
-        existing_user = User.query.filter_by(email=email.lower()).first()
-        if existing_user:
-            return jsonify({"error": "Email already exists"}), 400
-        if not is_valid_email(email):
-            return jsonify({"error": "Invalid email"}), 400
-        if not is_valid_password(password):
-            return jsonify({"error": "Invalid password"}), 400
+        email = normalize_email(email)
+        errors = validate_signup(email, password)
+        if errors:
+            return jsonify({"error": next(iter(errors.values())), "errors": errors}), 400
 
-        user_id = str(uuid.uuid4())
-        salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(password.encode(), salt).decode()
-        verification_token = str(uuid.uuid4())
-        send_verification_email(email, verification_token)
+        user_id = new_user_id(email)
+        hashed_password = hashing.hash_password(password)
+        user_shards.use_email(email)
 
         user = User(
             id=user_id,
-            email=email.lower(),
+            email=email,
             password=hashed_password,
-            verification_token=verification_token,
-            verification_token_expiry=datetime.utcnow() + timedelta(hours=1),
         )
 
+        # No pre-check query: the unique index on users.email rejects duplicates atomically.
         db.session.add(user)
-        db.session.commit()
+        verification_token = issue_verification_token(user_id, verification_token_ttl())
+        queue_verification_email(email, verification_token)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": "Email already exists"}), 400
+        outbox.notify()
         return jsonify({"message": "User registered"}), 200
-    except Exception as e:
-        print("Unexpected error:", e)
+    except (HashingPoolBusy, PoolTimeoutError):
+        raise
+    except Exception:
+        logger.exception("Signup failed")
         return jsonify({"error": "Internal server error"}), 500
 
 
+def login_rate_limit_key():
+    # Runs before the view validates the body, so it must not fail on a missing or non-JSON payload.
+    payload = request.get_json(silent=True)
+    email = payload.get("email") if isinstance(payload, dict) else None
+    return f"{get_remote_address()}:{normalize_email(email) if isinstance(email, str) else 'unknown'}"
+
+
 @app_routes.route("/logintoken", methods=["POST"])
-@limiter.limit(
-    "3 per minute",
-    key_func=lambda: f"{get_remote_address()}:{request.json.get('email', 'unknown')}",
-)
+@limiter.limit("3 per minute", key_func=login_rate_limit_key)
 def create_token():
     email = request.json.get("email", None)
     password = request.json.get("password", None)
@@ -73,73 +233,257 @@ def create_token():
     if email is None or password is None:
         return jsonify({"error": "Missing Credentials"}), 401
 
-    user = User.query.filter_by(email=email.lower()).first()
+    # Locked accounts/IPs are turned away before the user lookup and, above all, before bcrypt.
+    ip = get_remote_address()
+    status = login_guard.check(email, ip)
+    if status.retry_after:
+        response = jsonify({"error": "Too many failed login attempts, try again later"})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(status.retry_after)
+        return response
+
+    # A replica may not have the account, or its verification, yet: either falls back to the primary.
+    read_replicas.allow()
+    user = read_replicas.or_primary(lambda: User.find_by_email(email), found=lambda user: user and user.is_verified)
     if user is None:
+        login_guard.record_failure(email, ip, account=False)
+        db.session.commit()
         return jsonify({"error": "User not found"}), 404
     if not user.is_verified:
         return jsonify({"error": "Email not verified"}), 403
-    if not bcrypt.checkpw(password.encode(), user.password.encode()):
+    password_ok = hashing.check_password(password, user.password)
+    if read_replicas.reading_replica():
+        # A password reset may not have reached the replica: the primary's hash decides (bcrypt again only if it
+        # differs), so neither an old password nor a stale token generation outlives a reset.
+        replica_hash = user.password
+        read_replicas.use_primary()
+        user = User.find_by_email(email)
+        if user is None or user.password != replica_hash:
+            password_ok = user is not None and hashing.check_password(password, user.password)
+    if not password_ok:
+        login_guard.record_failure(email, ip)
+        db.session.commit()
         return jsonify({"error": "Invalid Credentials"}), 401
+    login_guard.record_success(email, status)
+
+    # Upgrade hashes made under an older HASH_* policy while we still have the plaintext.
+    if hashing.needs_rehash(user.password):
+        try:
+            user.password = hashing.hash_password(password)
+        except HashingPoolBusy:
+            pass  # the next login tries again
+
+    session_id = start_session(user.id, bool(remember), request.user_agent.string, ip)
+    refresh_token = issue_refresh_token(user.id, remember=bool(remember), family_id=session_id)
+    db.session.commit()
+
+    access_token = issue_access_token(user, session_id)
+    return jsonify({"email": email, "access_token": access_token, "refresh_token": refresh_token}), 200
+
+
+@app_routes.route("/token/refresh", methods=["POST"])
+def refresh_access_token():
+    payload = request.get_json(silent=True) or {}
+    token = payload.get("refresh_token")
+    if not isinstance(token, str) or not token:
+        return jsonify({"error": "Missing refresh token"}), 400
 
-    expires = timedelta(days=30) if remember else timedelta(minutes=7)
-    access_token = create_access_token(identity=user.id, expires_delta=expires)
+    rotated = rotate_refresh_token(token)
+    user = db.session.get(User, rotated.user_id) if rotated else None
+    if user is None:
+        # Commits the family revocation when the token was replayed.
+        db.session.commit()
+        return jsonify({"error": "Invalid refresh token"}), 401
 
-    return jsonify({"email": email, "access_token": access_token}), 200
+    touch_session(rotated.family_id, rotated.remember)
+    db.session.commit()
+    return jsonify({"access_token": issue_access_token(user, rotated.family_id), "refresh_token": rotated.token}), 200
 
 
 @app_routes.route("/logout", methods=["POST"])
 @jwt_required()
 def logout():
-    jti = get_jwt()["jti"]
-    current_app.jwt_blacklist.add(jti)
+    token = get_jwt()
+    revocation_store.revoke(token["jti"], token["exp"])
+    if token.get("sid"):
+        revoke_session(token["sub"], token["sid"])
+    payload = request.get_json(silent=True) or {}
+    if isinstance(payload.get("refresh_token"), str):
+        revoke_refresh_token(payload["refresh_token"])
+    db.session.commit()
     return jsonify({"message": "Successfully logged out"}), 200
 
 
+@app_routes.route("/sessions", methods=["GET"])
+@jwt_required()
+def get_sessions():
+    current = get_jwt().get("sid")
+    return jsonify([
+        {
+            "id": session.id,
+            "user_agent": session.user_agent,
+            "ip_address": session.ip_address,
+            "remember": session.remember,
+            "created_at": session.created_at.isoformat(),
+            "last_seen_at": session.last_seen_at.isoformat(),
+            "current": session.id == current,
+        }
+        for session in list_sessions(get_jwt_identity())
+    ]), 200
+
+
+@app_routes.route("/sessions/<session_id>", methods=["DELETE"])
+@jwt_required()
+def delete_session(session_id):
+    if not revoke_session(get_jwt_identity(), session_id):
+        db.session.rollback()
+        return jsonify({"error": "Session not found"}), 404
+    db.session.commit()
+    return jsonify({"message": "Session revoked"}), 200
+
+
+@app_routes.route("/sessions/revoke-all", methods=["POST"])
+@jwt_required()
+def revoke_all_user_sessions():
+    user_id = get_jwt_identity()
+    revoke_all_sessions(user_id)
+    db.session.commit()
+    token_generations.invalidate(user_id)
+    return jsonify({"message": "Logged out of all sessions"}), 200
+
+
 @app_routes.route("/profile", methods=["GET"])
 @jwt_required()
 def get_profile():
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user:
+    # The token names the newest version this client has seen (PUT/PATCH re-issue it): no DB round trip on a hit.
+    seen_version = get_jwt().get("ver") or 0
+
+    def is_current(profile):
+        return profile is not None and profile["version"] >= seen_version
+
+    def load(user_id):
+        # A replica that hasn't caught up with the client's own last write is skipped for the primary.
+        read_replicas.allow()
+        return read_replicas.or_primary(lambda: load_profile(user_id), found=is_current)
+
+    profile_data = profile_cache.get_or_load(user_id, load, is_current)
+    if not profile_data:
         return jsonify({"error": "User not found"}), 404
 
-    profile_data = {
-        "id": user.id,
-        "email": user.email,
-        "full_name": user.full_name,
-        "phone_number": user.phone_number,
-        "address": user.address,
+    # Polling clients send If-None-Match and get a body-less 304 while the version is unchanged.
+    response = profile_response(jsonify(profile_data), profile_data["version"])
+    return response.make_conditional(request)
+
+
+def load_profile(user_id):
+    row = load_profile_row(user_id)
+    if not row:
+        return None
+
+    return {
+        "id": row.id,
+        "email": row.email,
+        "full_name": row.full_name,
+        "phone_number": row.phone_number,
+        "address": row.address,
+        "version": row.version,
     }
-    return jsonify(profile_data), 200
+
+
+def profile_response(response, version):
+    response.set_etag(profile_etag(version))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def save_profile_changes(user_id, row, fields, expected_version=None):
+    """Applies the changes, then commits, invalidates the cached profile and issues a matching access token."""
+    result = apply_profile_changes(row, fields, expected_version)
+    if result.status != "updated":
+        return result, None
+    db.session.commit()
+    profile_cache.invalidate(user_id)
+    # The old access token carries stale profile claims; hand back one that matches.
+    return result, issue_access_token(result.user, get_jwt().get("sid"))
+
+
+PROFILE_ERROR_STATUS = {"full_name": 402, "address": 403, "phone_number": 404}
 
 
 @app_routes.route("/profile", methods=["PUT"])
 @jwt_required()
 def update_profile():
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user:
+    row = load_profile_row(user_id)
+    if not row:
         return jsonify({"error": "User not found"}), 405
 
-    full_name = request.json.get("full_name", user.full_name)
-    phone_number = request.json.get("phone_number", user.phone_number)
-    address = request.json.get("address", user.address)
+    full_name = request.json.get("full_name", row.full_name)
+    phone_number = request.json.get("phone_number", row.phone_number)
+    address = request.json.get("address", row.address)
 
-    if full_name and len(full_name) > 20:
-        return jsonify({"error": "Full name must be 20 characters or fewer"}), 402
+    errors = validate_profile(full_name, phone_number, address)
+    if errors:
+        # The status code still identifies the first failing field (the frontend maps it to a message).
+        field, message = next(iter(errors.items()))
+        return jsonify({"error": message, "errors": errors}), PROFILE_ERROR_STATUS[field]
 
-    if address and len(address) > 20:
-        return jsonify({"error": "Address must be 20 characters or fewer"}), 403
+    fields = {"full_name": full_name, "phone_number": phone_number, "address": address}
+    result, access_token = save_profile_changes(user_id, row, fields)
+    # A resubmitted form that changes nothing writes nothing, but the client still gets a token back.
+    access_token = access_token or issue_access_token(row, get_jwt().get("sid"))
+    response = jsonify({"message": "Profile updated successfully", "access_token": access_token})
+    return profile_response(response, result.user.version), 200
 
-    if phone_number and not is_valid_israeli_phone(phone_number):
-        return jsonify({"error": "Invalid Israeli phone number"}), 404
 
-    user.full_name = full_name
-    user.phone_number = phone_number
-    user.address = address
+@app_routes.route("/profile", methods=["PATCH"])
+@jwt_required()
+def patch_profile():
+    """
+    Partial update: only the fields present in the body are validated and compared, and only the ones that
+    differ are written. Send If-Match with the ETag from GET /profile to fail with 412 instead of overwriting
+    a change made elsewhere in the meantime.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not payload:
+        return jsonify({"error": "Body must be a JSON object with at least one profile field"}), 400
+    unknown = sorted(set(payload) - set(PROFILE_FIELDS))
+    if unknown:
+        return jsonify({"error": f"Unknown profile fields: {', '.join(unknown)}"}), 400
+    if any(value is not None and not isinstance(value, str) for value in payload.values()):
+        return jsonify({"error": "Profile fields must be strings or null"}), 400
+
+    errors = validate_profile(**payload)
+    if errors:
+        return jsonify({"error": next(iter(errors.values())), "errors": errors}), 400
 
-    db.session.commit()
-    return jsonify({"message": "Profile updated successfully"}), 200
+    user_id = get_jwt_identity()
+    row = load_profile_row(user_id)
+    if not row:
+        return jsonify({"error": "User not found"}), 404
+
+    expected_versions = etag_versions(request.if_match)
+    expected_version = None
+    if expected_versions is not None:
+        if row.version not in expected_versions:
+            return profile_response(jsonify({"error": "Profile was changed elsewhere"}), row.version), 412
+        expected_version = row.version
+
+    result, access_token = save_profile_changes(user_id, row, payload, expected_version)
+    if result.status == "conflict":
+        db.session.rollback()
+        return jsonify({"error": "Profile was changed elsewhere"}), 412
+    body = {"message": "No changes", "version": row.version}
+    if result.status == "updated":
+        body = {
+            "message": "Profile updated successfully",
+            "updated": sorted(result.changed),
+            "version": result.user.version,
+            "access_token": access_token,
+        }
+    return profile_response(jsonify(body), body["version"]), 200
 
 @app_routes.route("/verify", methods=["GET"])
 def verify_email():
@@ -147,14 +491,16 @@ def verify_email():
     if not token:
         return jsonify({"error": "Missing token"}), 400
 
-    user = User.query.filter_by(verification_token=token).first()
+    read_replicas.allow()
+    user_id = read_replicas.or_primary(lambda: consume_verification_token(token))
+    user = db.session.get(User, user_id) if user_id else None
     if not user:
+        db.session.rollback()
         return jsonify({"error": "Invalid token"}), 404
 
     user.is_verified = True
-    user.verification_token = None
-    user.verification_token_expiry = None
     db.session.commit()
+    profile_cache.invalidate(user.id)
 
     return render_template("verify_success.html", email=user.email)
 
@@ -168,18 +514,16 @@ def resend_verification():
     email = request.json.get("email")
     if email is None:
         return jsonify({"error": "Missing email"}), 400
-    user = User.query.filter_by(email=email).first()
+    user = User.find_by_email(email)
     if user is None:
         return jsonify({"error": "User not found"}), 404
     if user.is_verified:
         return jsonify({"message": "Email already verified"}), 200
 
-    verification_code = generate_verification_code()
-    send_verification_email(email, verification_code)
-
-    user.verification_token = verification_code
-    user.verification_token_expiry = datetime.utcnow() + timedelta(hours=1)
+    verification_code = issue_verification_token(user.id, verification_token_ttl(), replace_existing=True)
+    queue_verification_email(user.email, verification_code)
     db.session.commit()
+    outbox.notify()
 
     return jsonify({"message": "Verification email resent"}), 200
 
@@ -198,18 +542,20 @@ def reset_password():
     if email is None or new_password is None or code is None:
         return jsonify({"error": "Missing credentials"}), 400
 
-    user = User.query.filter_by(email=email).first()
+    user = User.find_by_email(email)
     if user is None:
         return jsonify({"error": "User not found"}), 404
-    if code != user.verification_token:
+    if consume_verification_token(code, user_id=user.id) is None:
+        db.session.rollback()
         return jsonify({"error": "Invalid verification code"}), 400
 
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(new_password.encode(), salt).decode()
+    hashed_password = hashing.hash_password(new_password)
 
     user.password = hashed_password
-    user.verification_token = None
-    user.verification_token_expiry = None
+    # Logs out every device, including access tokens that are still within their lifetime.
+    revoke_all_sessions(user.id)
     db.session.commit()
+    profile_cache.invalidate(user.id)
+    token_generations.invalidate(user.id)
 
     return jsonify({"message": "Password reset successfully"}), 200
\ No newline at end of file
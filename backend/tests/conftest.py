@@ -4,7 +4,20 @@ import pytest
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from app import app as flask_app
+# Sent messages lose their body (the verification link), and tests read links from the outbox: no background
+# dispatcher, the outbox tests call outbox.dispatch_batch() themselves.
+os.environ.setdefault("OUTBOX_AUTOSTART", "false")
+# Test output stays readable: the logging tests install their own sink (see log_output).
+os.environ.setdefault("LOG_CONFIGURE", "false")
+
+from app import create_app
+from extensions import db
+
+flask_app = create_app()
+
+# The real schema comes from Alembic migrations (see test_migrations_match_models); tests just need the tables.
+with flask_app.app_context():
+    db.create_all()
 
 @pytest.fixture
 def app():
@@ -1,8 +1,36 @@
+import json
+import os
+import re
+import socket
+import time
+import threading
+import bcrypt
 import pytest
-from models import User
-from extensions import db
-from app import app as flask_app
+from sqlalchemy import create_engine, event, select
+from models import User, EmailOutbox, LoginFailure, RefreshToken, RevokedToken, VerificationToken
+from extensions import db, hashing
+from conftest import flask_app
 from flask_jwt_extended import decode_token
+from utils.email_utils import SMTPConnectionPool, outbox
+from utils.verification import hash_token, sweeper
+from datetime import datetime, timedelta
+from utils.revocation import revocation_store
+from utils.profile_cache import profile_cache
+from utils.db_pool import TimedQueuePool, engine_options
+from config import get_config
+from utils.rate_limit import SQLRateLimitStorage
+from utils.hashing import HashPolicy
+from utils.validators import deliverability, validate_profile, validate_signup
+from routes import issue_access_token, login_rate_limit_key
+from utils.login_guard import LoginGuard, login_guard
+from utils.sessions import token_generations
+from utils.jwt_keys import jwt_decode_key, key_ring
+from utils.sharding import email_bucket, id_bucket, user_shards
+from utils.resharding import reshard_users
+from utils.replicas import read_replicas
+from utils.structured_logging import structured_logging
+from utils.jwt_cache import verified_tokens
+from utils.metrics import metrics
 
 
 @pytest.fixture
@@ -15,6 +43,13 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture(autouse=True)
+def offline_mx_lookups(monkeypatch):
+    """Every domain is deliverable unless a test says otherwise, so the suite never depends on DNS."""
+    monkeypatch.setattr(deliverability, "resolver", lambda domain: True)
+    deliverability.clear()
+
+
 def create_verified_user(client, email, password):
     """
     Helper function to register and manually verify a user in the database.
@@ -80,6 +115,27 @@ def test_signup_weak_password(client):
     assert res.json.get("error") == "Invalid password"
 
 
+
+def test_signup_existing_email_is_case_insensitive(client):
+    """
+    Test that the same address in a different case or with surrounding spaces is rejected as a duplicate.
+    """
+    client.post("/signup", json={"email": "case_dup@gmail.com", "password": "Test123!"})
+    res = client.post("/signup", json={"email": " Case_Dup@Gmail.com ", "password": "Test123!"})
+    assert res.status_code == 400
+    assert res.json.get("error") == "Email already exists"
+    assert User.query.filter_by(email="case_dup@gmail.com").count() == 1
+
+
+def test_resend_verification_matches_mixed_case_email(client):
+    """
+    Test that lookups by email normalize the address the same way signup stored it.
+    """
+    client.post("/signup", json={"email": "resend_case@gmail.com", "password": "Test123!"})
+    res = client.post("/resend_verification", json={"email": "Resend_Case@Gmail.com"})
+    assert res.status_code == 200
+    assert res.json.get("message") == "Verification email resent"
+
 # ---------- LOGIN ROUTES TESTS ----------
 
 
@@ -161,10 +217,12 @@ def test_logout_success(client):
     assert res.status_code == 200
     assert res.json.get("message") == "Successfully logged out"
 
-    # Check that the jti was added to the blacklist
+    # Check that the jti was revoked and the token no longer works
     decoded = decode_token(access_token)
     jti = decoded.get("jti")
-    assert jti in flask_app.jwt_blacklist
+    assert revocation_store.is_revoked(jti)
+    res = client.get("/profile", headers={"Authorization": f"Bearer {access_token}"})
+    assert res.status_code == 401
 
 
 def get_token_and_user_id(client, email, password):
@@ -231,11 +289,16 @@ def create_verified_user(client, email, password):
     user = User.query.filter_by(email=email.lower()).first()
     if user:
         user.is_verified = True
-        user.verification_token = None
-        user.verification_token_expiry = None
+        VerificationToken.query.filter_by(user_id=user.id).delete()
         db.session.commit()
 
 
+def sent_verification_token(email):
+    """Extracts the raw token from the latest verification email queued for `email`."""
+    message = EmailOutbox.query.filter_by(to_email=email).order_by(EmailOutbox.id.desc()).first()
+    return re.search(r"token=([\w.-]+)", message.body).group(1)
+
+
 def get_token_and_user_id(client, email, password):
     """Returns access token and user id."""
     create_verified_user(client, email, password)
@@ -256,11 +319,11 @@ def test_email_verification_success(client):
     # Register the user
     client.post("/signup", json={"email": email, "password": password})
 
-    # Retrieve user from DB
+    # Retrieve the token from the queued email (only its hash is stored)
     user = User.query.filter_by(email=email.lower()).first()
     assert user is not None
-    token = user.verification_token
-    assert token is not None  # Ensure token exists
+    token = sent_verification_token(email)
+    assert VerificationToken.query.filter_by(user_id=user.id).count() == 1
 
     # Call the /verify endpoint
     res = client.get(f"/verify?token={token}")
@@ -269,7 +332,7 @@ def test_email_verification_success(client):
     # Refresh and validate state
     user = User.query.filter_by(email=email.lower()).first()
     assert user.is_verified is True
-    assert user.verification_token is None
+    assert VerificationToken.query.filter_by(user_id=user.id).count() == 0
 
 
 def test_email_verification_invalid_token(client):
@@ -290,9 +353,45 @@ def test_email_verification_missing_token(client):
     assert res.json.get("error") == "Missing token"
 
 
+def test_email_verification_expired_token(client):
+    """
+    Tests that a token past its expiry is rejected and leaves the user unverified.
+    """
+    email = "verify_expired@example.com"
+    client.post("/signup", json={"email": email, "password": "Test123!"})
+    token = sent_verification_token(email)
+    db.session.get(VerificationToken, hash_token(token)).expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    res = client.get(f"/verify?token={token}")
+    assert res.status_code == 404
+    assert User.query.filter_by(email=email).first().is_verified is False
+
+
+def test_sweeper_purges_expired_tokens_and_stale_unverified_users(client):
+    """
+    Tests that one sweep removes expired tokens and long-unverified accounts and reports the counts.
+    """
+    client.post("/signup", json={"email": "sweep_token@example.com", "password": "Test123!"})
+    client.post("/signup", json={"email": "sweep_user@example.com", "password": "Test123!"})
+    stale_token = db.session.get(VerificationToken, hash_token(sent_verification_token("sweep_token@example.com")))
+    stale_token.expires_at = datetime.utcnow() - timedelta(minutes=1)
+    stale_user = User.query.filter_by(email="sweep_user@example.com").first()
+    stale_user.created_at = datetime.utcnow() - sweeper.unverified_ttl - timedelta(days=1)
+    db.session.commit()
+
+    with client.application.app_context():
+        removed = sweeper.sweep()
+
+    assert removed["expired_tokens"] >= 1
+    assert removed["unverified_users"] >= 1
+    assert User.query.filter_by(email="sweep_user@example.com").first() is None
+    assert User.query.filter_by(email="sweep_token@example.com").first() is not None
+
+
 def test_remember_me_extends_token_expiry(client):
     """
-    Tests that using 'remember' in login results in a long-expiry token.
+    Tests that using 'remember' in login keeps the access token short but issues a long-lived refresh token.
     """
     email = "rememberme@example.com"
     password = "Test123!"
@@ -301,9 +400,10 @@ def test_remember_me_extends_token_expiry(client):
         "/logintoken", json={"email": email, "password": password, "remember": True}
     )
     assert res.status_code == 200
-    token = res.json.get("access_token")
-    decoded = decode_token(token)
-    assert (decoded["exp"] - decoded["iat"]) > 3600  # More than 1 hour
+    decoded = decode_token(res.json.get("access_token"))
+    assert (decoded["exp"] - decoded["iat"]) <= 600  # Access tokens stay short
+    refresh = db.session.get(RefreshToken, hash_token(res.json.get("refresh_token")))
+    assert refresh.expires_at - datetime.utcnow() > timedelta(days=1)
 
 
 def test_login_rate_limiting(client):
@@ -317,3 +417,1432 @@ def test_login_rate_limiting(client):
         client.post("/logintoken", json={"email": email, "password": "Wrong!"})
     res = client.post("/logintoken", json={"email": email, "password": "Wrong!"})
     assert res.status_code == 429
+
+
+
+# ---------- LOGIN LOCKOUT TESTS ----------
+
+
+def test_locked_account_is_rejected_before_hashing(client, monkeypatch):
+    """
+    Tests that once an account reaches its failure threshold even the right password gets 429 without bcrypt running.
+    """
+    email = "lockout@example.com"
+    create_verified_user(client, email, "Test123!")
+    monkeypatch.setattr(login_guard, "max_account_failures", 2)
+    for _ in range(2):
+        assert client.post("/logintoken", json={"email": email, "password": "Wrong123!"}).status_code == 401
+
+    checks = []
+    monkeypatch.setattr(hashing, "check_password", lambda *args: checks.append(args) or True)
+    res = client.post("/logintoken", json={"email": email, "password": "Test123!"})
+    assert res.status_code == 429
+    assert res.json["error"] == "Too many failed login attempts, try again later"
+    assert 0 < int(res.headers["Retry-After"]) <= login_guard.lockout_base
+    assert checks == []
+
+
+def test_login_lockout_backs_off_exponentially_and_resets_on_success(app):
+    """
+    Tests that every failure past the threshold doubles the lock and a successful login clears the account's count.
+    """
+    guard = LoginGuard()
+    guard.init_app(app)
+    guard.max_account_failures = 1
+    email, ip = "backoff@example.com", "203.0.113.7"
+    durations = []
+    for _ in range(3):
+        guard.record_failure(email, ip)
+        db.session.commit()
+        row = db.session.get(LoginFailure, f"account:{email}")
+        durations.append(round(row.locked_until - row.last_failure_at))
+    assert durations == [guard.lockout_base, guard.lockout_base * 2, guard.lockout_base * 4]
+    assert guard.check(email, ip).retry_after > 0
+
+    db.session.get(LoginFailure, f"account:{email}").locked_until = None
+    db.session.commit()
+    guard.clear_cache()
+    status = guard.check(email, ip)
+    assert status == (0, 3)
+    guard.record_success(email, status)
+    db.session.commit()
+    assert db.session.get(LoginFailure, f"account:{email}") is None
+    assert db.session.get(LoginFailure, f"ip:{ip}").failures == 3
+
+
+# ---------- HASHING POOL TESTS ----------
+
+
+def test_login_sheds_load_when_hashing_pool_is_full(client, monkeypatch):
+    """
+    Tests that login answers 503 + Retry-After instead of queueing when the hashing pool is saturated.
+    """
+    email = "hashing_busy@example.com"
+    password = "Test123!"
+    create_verified_user(client, email, password)
+
+    full = threading.BoundedSemaphore(1)
+    full.acquire()
+    monkeypatch.setattr(hashing, "_slots", full)
+
+    res = client.post("/logintoken", json={"email": email, "password": password})
+    assert res.status_code == 503
+    assert res.headers.get("Retry-After") == str(hashing.retry_after)
+
+
+def test_hash_policy_detects_outdated_hashes():
+    """
+    Tests that the policy reads the cost back from stored hashes, and that upgrade_only ignores stronger ones.
+    """
+    policy = HashPolicy(bcrypt_rounds=5)
+    assert not policy.needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(rounds=5)).decode())
+    assert policy.needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(rounds=4)).decode())
+    assert policy.needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(rounds=6)).decode())
+    assert policy.needs_rehash("$argon2id$v=19$m=65536,t=3,p=4$c2FsdA$aGFzaA")
+
+    policy.upgrade_only = True
+    assert not policy.needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(rounds=6)).decode())
+
+
+def test_hash_policy_calibration_stays_within_bounds():
+    """
+    Tests that calibrating to a tiny target keeps the minimum cost and switches to upgrade-only rehashing.
+    """
+    policy = HashPolicy()
+    policy.calibrate(target_ms=0.001, min_bcrypt_rounds=4)
+    assert policy.bcrypt_rounds == 4
+    assert policy.upgrade_only
+
+
+def test_login_rehashes_password_with_outdated_cost(client, monkeypatch):
+    """
+    Tests that a successful login transparently rewrites a hash made under an older cost setting.
+    """
+    email = "rehash@example.com"
+    password = "Test123!"
+    create_verified_user(client, email, password)
+    user = User.find_by_email(email)
+    user.password = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=4)).decode()
+    db.session.commit()
+    monkeypatch.setattr(hashing, "policy", HashPolicy(bcrypt_rounds=5))
+
+    assert client.post("/logintoken", json={"email": email, "password": password}).status_code == 200
+    db.session.refresh(user)
+    assert user.password.startswith("$2b$05$")
+    assert client.post("/logintoken", json={"email": email, "password": password}).status_code == 200
+
+
+# ---------- EMAIL OUTBOX TESTS ----------
+
+
+def test_signup_queues_verification_email_in_outbox(client):
+    """
+    Tests that signup writes the verification email to the outbox instead of sending it inline.
+    """
+    email = "outbox_signup@example.com"
+    res = client.post("/signup", json={"email": email, "password": "Test123!"})
+    assert res.status_code == 200
+
+    user = User.query.filter_by(email=email).first()
+    message = EmailOutbox.query.filter_by(to_email=email).first()
+    assert message is not None
+    token_hash = hash_token(sent_verification_token(email))
+    assert db.session.get(VerificationToken, token_hash).user_id == user.id
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def local_smtp(monkeypatch):
+    """Runs an aiosmtpd server on localhost and points the outbox dispatcher at it."""
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    from aiosmtpd.handlers import Sink
+
+    class Recorder(Sink):
+        def __init__(self):
+            self.recipients = []
+
+        async def handle_DATA(self, server, session, envelope):
+            self.recipients.extend(envelope.rcpt_tos)
+            return "250 OK"
+
+    outbox.stop()
+    handler = Recorder()
+    controller = controller_module.Controller(handler, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    monkeypatch.setattr(outbox, "smtp", SMTPConnectionPool("127.0.0.1", controller.port, use_ssl=False))
+    yield handler
+    outbox.smtp.close()
+    controller.stop()
+
+
+def test_outbox_dispatcher_sends_batch_over_local_smtp(client, local_smtp):
+    """
+    Tests that the dispatcher delivers pending outbox messages and marks them sent.
+    """
+    emails = ["outbox_batch1@example.com", "outbox_batch2@example.com"]
+    for email in emails:
+        client.post("/signup", json={"email": email, "password": "Test123!"})
+
+    with client.application.app_context():
+        outbox.dispatch_batch()
+
+    assert set(emails) <= set(local_smtp.recipients)
+    for email in emails:
+        message = EmailOutbox.query.filter_by(to_email=email).first()
+        assert message.status == "sent"
+        assert message.body == ""
+
+
+def test_outbox_dispatcher_backs_off_when_smtp_is_down(client, monkeypatch):
+    """
+    Tests that a failed delivery is kept pending with an attempt recorded and a later retry time.
+    """
+    outbox.stop()
+    monkeypatch.setattr(outbox, "smtp", SMTPConnectionPool("127.0.0.1", _free_port(), use_ssl=False))
+    email = "outbox_down@example.com"
+    client.post("/signup", json={"email": email, "password": "Test123!"})
+
+    with client.application.app_context():
+        outbox.dispatch_batch()
+
+    message = EmailOutbox.query.filter_by(to_email=email).first()
+    assert message.status == "pending"
+    assert message.attempts == 1
+    assert message.next_attempt_at > message.created_at
+
+
+def test_outbox_clears_abandoned_body_and_sweeper_purges_finished_emails(client, monkeypatch):
+    """
+    Tests that a message given up on no longer holds its verification link, and that the sweeper deletes
+    finished messages once they are older than the retention period.
+    """
+    outbox.stop()
+    monkeypatch.setattr(outbox, "smtp", SMTPConnectionPool("127.0.0.1", _free_port(), use_ssl=False))
+    monkeypatch.setattr(outbox, "max_attempts", 1)
+    email = "outbox_abandoned@example.com"
+    client.post("/signup", json={"email": email, "password": "Test123!"})
+
+    with client.application.app_context():
+        outbox.dispatch_batch()
+
+    message = EmailOutbox.query.filter_by(to_email=email).first()
+    assert message.status == "failed"
+    assert message.body == ""
+
+    message.created_at = datetime.utcnow() - sweeper.outbox_retention - timedelta(days=1)
+    db.session.commit()
+    with client.application.app_context():
+        removed = sweeper.sweep()
+
+    assert removed["finished_emails"] >= 1
+    assert EmailOutbox.query.filter_by(to_email=email).first() is None
+
+
+def test_smtp_pool_checks_idle_connections_outside_the_lock():
+    """
+    Tests that the NOOP liveness check on a pooled connection doesn't hold the pool lock.
+    """
+    pool = SMTPConnectionPool("127.0.0.1", _free_port(), use_ssl=False)
+    locked_during_noop = []
+
+    class IdleConnection:
+        def noop(self):
+            locked_during_noop.append(pool._lock.locked())
+            return (250, b"OK")
+
+    idle = IdleConnection()
+    pool._idle.append(idle)
+    with pool.connection() as smtp:
+        assert smtp is idle
+
+    assert locked_during_noop == [False]
+    assert pool._idle == [idle]
+
+
+def test_outbox_dispatcher_starts_one_thread_under_concurrent_requests(monkeypatch):
+    """
+    Tests that concurrent first requests start a single dispatcher thread.
+    """
+    outbox.stop()
+    started = []
+
+    def run():
+        started.append(threading.current_thread())
+        outbox._stop.wait()
+
+    monkeypatch.setattr(outbox, "_run", run)
+    monkeypatch.setattr(outbox, "_thread", None)
+    barrier = threading.Barrier(8)
+
+    def first_request():
+        barrier.wait()
+        outbox.ensure_started()
+
+    callers = [threading.Thread(target=first_request) for _ in range(8)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    outbox.stop()
+
+    assert len(started) == 1
+
+
+# ---------- TOKEN REVOCATION TESTS ----------
+
+
+def test_revocation_check_skips_backend_for_unrevoked_tokens(app, monkeypatch):
+    """
+    Tests that a jti missing from the Bloom filter is answered without querying the backend.
+    """
+    with app.app_context():
+        revocation_store.refresh(force=True)
+
+        def fail(jti):
+            raise AssertionError("backend queried for a token that was never revoked")
+
+        monkeypatch.setattr(revocation_store.backend, "is_revoked", fail)
+        assert revocation_store.is_revoked("never-revoked-jti") is False
+
+
+def test_revoked_tokens_expire_with_the_token(app):
+    """
+    Tests that revocations stop counting, and are purged, once the token's exp has passed.
+    """
+    with app.app_context():
+        revocation_store.revoke("expired-jti", time.time() - 1)
+        revocation_store.revoke("live-jti", time.time() + 60)
+        assert revocation_store.is_revoked("expired-jti") is False
+        assert revocation_store.is_revoked("live-jti") is True
+
+        assert sweeper.sweep()["expired_revocations"] >= 1
+        assert db.session.get(RevokedToken, "expired-jti") is None
+
+
+def test_revocation_filter_is_rebuilt_off_the_request_thread(app, monkeypatch):
+    """
+    Tests that a due rebuild runs on a background thread while the request keeps the current filter.
+    """
+    with app.app_context():
+        revocation_store.refresh(force=True)
+        built_on = []
+        build = revocation_store._build
+
+        def record_build():
+            built_on.append(threading.current_thread().name)
+            return build()
+
+        monkeypatch.setattr(revocation_store, "_build", record_build)
+        monkeypatch.setattr(revocation_store, "_next_sync", 0.0)
+        monkeypatch.setattr(revocation_store, "_next_rebuild", 0.0)
+        bloom = revocation_store.bloom
+        revocation_store.revoke("rebuild-jti", time.time() + 60)
+        assert revocation_store.is_revoked("rebuild-jti") is True
+        revocation_store._rebuilder.join(5)
+        assert built_on == ["revocation-rebuild"]
+        assert revocation_store.bloom is not bloom
+        assert revocation_store.is_revoked("rebuild-jti") is True
+
+
+# ---------- PROFILE CACHE TESTS ----------
+
+
+def test_repeated_profile_reads_are_served_from_cache(client, app):
+    """
+    Tests that a second GET /profile is answered from the cache without a single database statement.
+    """
+    token, _ = get_token_and_user_id(client, "profile_cache@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/profile", headers=headers).status_code == 200
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    hits = profile_cache.stats()["hits"]
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        res = client.get("/profile", headers=headers)
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", record)
+    assert res.status_code == 200
+    assert res.json["email"] == "profile_cache@example.com"
+    assert profile_cache.stats()["hits"] == hits + 1
+    assert statements == []
+
+
+def test_profile_update_invalidates_cached_profile(client):
+    """
+    Tests that GET /profile never returns the cached payload after a successful PUT.
+    """
+    token, _ = get_token_and_user_id(client, "profile_cache_put@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/profile", headers=headers)
+
+    res = client.put("/profile", json={"full_name": "Cached"}, headers=headers)
+    assert res.status_code == 200
+    assert client.get("/profile", headers=headers).json["full_name"] == "Cached"
+
+
+def test_cached_profile_is_reloaded_after_write_by_another_worker(client, app):
+    """
+    Tests that a write this process never saw (another worker, no invalidation channel) isn't hidden by the
+    cache from the client that made it: the access token that write returned names the newer version.
+    """
+    token, user_id = get_token_and_user_id(client, "profile_cache_worker@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    etag = client.get("/profile", headers=headers).headers["ETag"]
+
+    # Stands in for a PUT handled by another worker: the row changes, this process's cache is never told,
+    # and the client gets the re-issued token.
+    db.session.execute(
+        User.__table__.update().where(User.id == user_id).values(full_name="Elsewhere", version=User.version + 1)
+    )
+    db.session.commit()
+    with app.app_context():
+        new_token = issue_access_token(db.session.get(User, user_id), decode_token(token)["sid"])
+
+    res = client.get("/profile", headers={"Authorization": f"Bearer {new_token}", "If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json["full_name"] == "Elsewhere"
+
+
+def test_profile_patch_writes_only_changed_fields(client, app):
+    """
+    Tests that PATCH /profile updates just the supplied, changed columns and skips the write for a no-op.
+    """
+    token, _ = get_token_and_user_id(client, "profile_patch@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        res = client.patch("/profile", json={"address": "Haifa"}, headers=headers)
+        assert res.status_code == 200
+        assert res.json["updated"] == ["address"]
+        updates = [s for s in statements if s.lstrip().upper().startswith("UPDATE")]
+        assert len(updates) == 1 and "address" in updates[0] and "full_name" not in updates[0]
+        assert not any("password" in s for s in statements)
+        assert decode_token(res.json["access_token"])["address"] == "Haifa"
+
+        statements.clear()
+        res = client.patch("/profile", json={"address": "Haifa"}, headers=headers)
+        assert res.status_code == 200 and res.json["message"] == "No changes"
+        assert not [s for s in statements if s.lstrip().upper().startswith("UPDATE")]
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", record)
+
+    assert client.patch("/profile", json={"email": "x@example.com"}, headers=headers).status_code == 400
+    res = client.patch("/profile", json={"phone_number": "123"}, headers=headers)
+    assert res.status_code == 400 and "phone_number" in res.json["errors"]
+
+
+def test_profile_etag_preconditions(client):
+    """
+    Tests that GET /profile answers If-None-Match with 304 and PATCH rejects a stale If-Match with 412.
+    """
+    token, _ = get_token_and_user_id(client, "profile_etag@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    res = client.get("/profile", headers=headers)
+    etag = res.headers["ETag"]
+    assert "no-cache" in res.headers["Cache-Control"]
+    assert client.get("/profile", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    res = client.patch("/profile", json={"full_name": "First"}, headers={**headers, "If-Match": etag})
+    assert res.status_code == 200
+    new_etag = res.headers["ETag"]
+    assert new_etag != etag
+
+    res = client.patch("/profile", json={"full_name": "Second"}, headers={**headers, "If-Match": etag})
+    assert res.status_code == 412
+    assert client.get("/profile", headers={**headers, "If-None-Match": etag}).json["full_name"] == "First"
+    assert client.get("/profile", headers={**headers, "If-None-Match": new_etag}).status_code == 304
+
+
+# ---------- CONFIG / DB POOL TESTS ----------
+
+
+def test_engine_options_per_database():
+    """
+    Tests that server databases get a tuned, instrumented pool with a statement timeout.
+    """
+    options = engine_options("postgresql://db/auth", pool_size=10, statement_timeout_ms=5000)
+    assert options["poolclass"] is TimedQueuePool
+    assert options["pool_size"] == 10
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+    assert engine_options("sqlite:///:memory:") == {}
+
+
+def test_unknown_config_profile_is_rejected():
+    """
+    Tests that a typo in APP_ENV fails loudly instead of silently using defaults.
+    """
+    with pytest.raises(ValueError):
+        get_config("prodution")
+
+
+def test_db_pool_metrics_endpoint(client, metrics_headers):
+    """
+    Tests that pool metrics are exposed for the default engine.
+    """
+    res = client.get("/metrics/db-pool", headers=metrics_headers)
+    assert res.status_code == 200
+    assert "status" in res.json["default"]
+
+
+# ---------- RATE LIMIT STORAGE TESTS ----------
+
+
+def test_sql_rate_limit_storage_enforces_one_global_limit(tmp_path):
+    """
+    Tests that two workers sharing the counter table admit no more hits than the limit in total.
+    """
+    url = f"sqlite:///{tmp_path / 'limits.db'}"
+    workers = [SQLRateLimitStorage(url=url, lease_fraction=0.2, create_table=True) for _ in range(2)]
+    admitted = sum(
+        workers[i % 2].acquire_sliding_window_entry("login:shared", 10, 60) for i in range(40)
+    )
+    assert admitted <= 10
+    assert admitted >= 8  # leases may strand a couple of hits in the other worker
+
+
+def test_sql_rate_limit_storage_fast_path_skips_round_trips(tmp_path):
+    """
+    Tests that leased and rejected hits are answered locally without querying the counter table.
+    """
+    storage = SQLRateLimitStorage(url=f"sqlite:///{tmp_path / 'limits.db'}", lease_fraction=0.5, create_table=True)
+    results = [storage.acquire_sliding_window_entry("login:fast", 10, 60) for _ in range(20)]
+    assert sum(results) == 10
+    assert storage.local_hits > storage.remote_hits
+
+
+def test_sql_rate_limit_storage_small_limits_need_one_statement_per_hit(tmp_path):
+    """
+    Tests that with a limit too small to lease ("3 per minute") an admitted hit is a single UPSERT once the
+    window is known, and that hits after the last slot are refused without a query.
+    """
+    storage = SQLRateLimitStorage(url=f"sqlite:///{tmp_path / 'limits.db'}", create_table=True)
+    storage.reset()  # creates the table before counting
+    statements = []
+    event.listen(storage.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    results = [storage.acquire_sliding_window_entry("login:small", 3, 60) for _ in range(10)]
+    assert results == [True] * 3 + [False] * 7
+    # One SELECT of both windows for the first hit, then one UPSERT per admitted hit.
+    assert len(statements) == 4
+    assert sum(s.lstrip().upper().startswith("SELECT") for s in statements) == 1
+
+
+def test_sql_rate_limit_storage_leaves_schema_to_migrations(tmp_path):
+    """
+    Tests that without create_table the storage never issues DDL: the table has to come from the migrations.
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.exc import SQLAlchemyError
+
+    storage = SQLRateLimitStorage(url=f"sqlite:///{tmp_path / 'limits.db'}")
+    with pytest.raises(SQLAlchemyError):
+        storage.acquire_sliding_window_entry("login:unmigrated", 10, 60)
+    assert not inspect(storage.engine).has_table("rate_limit_counters")
+
+
+def test_login_rate_limit_key_tolerates_bad_bodies(app):
+    """
+    Tests that the login rate limit key is computed without failing on non-JSON bodies and normalizes the email.
+    """
+    with app.test_request_context("/logintoken", method="POST", data="not json", content_type="text/plain"):
+        assert login_rate_limit_key().endswith(":unknown")
+    with app.test_request_context("/logintoken", method="POST", json={"email": " Mixed@Example.com"}):
+        assert login_rate_limit_key().endswith(":mixed@example.com")
+
+
+# ---------- REFRESH TOKEN TESTS ----------
+
+
+def login(client, email, password="Test123!"):
+    create_verified_user(client, email, password)
+    return client.post("/logintoken", json={"email": email, "password": password}).json
+
+
+def test_access_token_carries_profile_claims(client):
+    """
+    Tests that the access token embeds the profile fields and that PUT /profile returns a refreshed token.
+    """
+    tokens = login(client, "claims@example.com")
+    assert decode_token(tokens["access_token"])["email"] == "claims@example.com"
+
+    res = client.put(
+        "/profile",
+        json={"full_name": "Claims User"},
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+    )
+    assert res.status_code == 200
+    assert decode_token(res.json["access_token"])["full_name"] == "Claims User"
+
+
+def test_refresh_rotates_token(client):
+    """
+    Tests that a refresh returns a working access token and a new refresh token, and spends the old one.
+    """
+    tokens = login(client, "rotate@example.com")
+    res = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert res.status_code == 200
+    assert res.json["refresh_token"] != tokens["refresh_token"]
+    assert client.get("/profile", headers={"Authorization": f"Bearer {res.json['access_token']}"}).status_code == 200
+
+    old = db.session.get(RefreshToken, hash_token(tokens["refresh_token"]))
+    db.session.refresh(old)
+    assert old.used_at is not None
+
+
+def test_refresh_token_reuse_revokes_family(client):
+    """
+    Tests that replaying a spent refresh token is rejected and also invalidates its successor.
+    """
+    tokens = login(client, "reuse@example.com")
+    rotated = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]}).json
+
+    res = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert res.status_code == 401
+    res = client.post("/token/refresh", json={"refresh_token": rotated["refresh_token"]})
+    assert res.status_code == 401
+
+
+def test_logout_revokes_refresh_token(client):
+    """
+    Tests that logging out with the refresh token in the body makes it unusable.
+    """
+    tokens = login(client, "logout_refresh@example.com")
+    client.post(
+        "/logout",
+        json={"refresh_token": tokens["refresh_token"]},
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+    )
+    res = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert res.status_code == 401
+
+
+
+# ---------- SESSION TESTS ----------
+
+
+def test_sessions_are_listed_and_revoked_individually(client):
+    """
+    Tests that each login shows up as a session with its device and that revoking one kills its refresh token only.
+    """
+    email = "sessions@example.com"
+    create_verified_user(client, email, "Test123!")
+    credentials = {"email": email, "password": "Test123!"}
+    laptop = client.post("/logintoken", json=credentials, headers={"User-Agent": "laptop"}).json
+    phone = client.post("/logintoken", json=credentials, headers={"User-Agent": "phone"}).json
+
+    res = client.get("/sessions", headers={"Authorization": f"Bearer {laptop['access_token']}"})
+    assert res.status_code == 200
+    sessions = {s["user_agent"]: s for s in res.json}
+    assert set(sessions) == {"laptop", "phone"}
+    assert sessions["laptop"]["current"] and not sessions["phone"]["current"]
+
+    res = client.delete(
+        f"/sessions/{sessions['phone']['id']}", headers={"Authorization": f"Bearer {laptop['access_token']}"}
+    )
+    assert res.status_code == 200
+    assert client.post("/token/refresh", json={"refresh_token": phone["refresh_token"]}).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": laptop["refresh_token"]}).status_code == 200
+    res = client.get("/sessions", headers={"Authorization": f"Bearer {laptop['access_token']}"})
+    assert [s["user_agent"] for s in res.json] == ["laptop"]
+
+
+def test_revoke_all_invalidates_every_access_token_with_one_write(client):
+    """
+    Tests that revoke-all rejects every outstanding access token without blocklisting jtis, and that the generation
+    check is answered from the per-process cache.
+    """
+    email = "revoke_all@example.com"
+    create_verified_user(client, email, "Test123!")
+    credentials = {"email": email, "password": "Test123!"}
+    first = client.post("/logintoken", json=credentials).json
+    second = client.post("/logintoken", json=credentials).json
+    headers = {"Authorization": f"Bearer {second['access_token']}"}
+
+    client.get("/profile", headers=headers)
+    misses = token_generations.stats()["misses"]
+    for _ in range(3):
+        assert client.get("/profile", headers=headers).status_code == 200
+    assert token_generations.stats()["misses"] == misses
+
+    revoked_before = RevokedToken.query.count()
+    res = client.post("/sessions/revoke-all", headers={"Authorization": f"Bearer {first['access_token']}"})
+    assert res.status_code == 200
+    assert RevokedToken.query.count() == revoked_before
+    assert client.get("/profile", headers=headers).status_code == 401
+    assert client.get("/sessions", headers={"Authorization": f"Bearer {first['access_token']}"}).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": second["refresh_token"]}).status_code == 401
+
+
+# ---------- BULK IMPORT/EXPORT TESTS ----------
+
+
+@pytest.fixture
+def admin_headers(app, monkeypatch):
+    monkeypatch.setitem(app.config, "ADMIN_API_TOKEN", "admin-secret")
+    monkeypatch.setitem(app.config, "BULK_IMPORT_WORKERS", 2)
+    return {"X-Admin-Token": "admin-secret"}
+
+
+def test_bulk_endpoints_require_admin_token(client, admin_headers):
+    """
+    Tests that the bulk endpoints refuse requests without the admin token.
+    """
+    assert client.get("/admin/users/export").status_code == 403
+    res = client.post("/admin/users/import", data="email,password\n", headers={"X-Admin-Token": "wrong"})
+    assert res.status_code == 403
+
+
+def test_bulk_import_csv_reports_row_errors_and_queues_emails(client, admin_headers):
+    """
+    Tests that a CSV import creates valid users with verification emails and reports bad rows by row number.
+    """
+    create_verified_user(client, "bulk_existing@example.com", "Test123!")
+    body = (
+        "email,password,full_name\n"
+        "Bulk_One@Example.com,Test123!,Bulk One\n"
+        "bulk_two@example.com,Test123!,\n"
+        "not-an-email,Test123!,\n"
+        "bulk_weak@example.com,weak,\n"
+        "bulk_one@example.com,Test123!,\n"
+        "bulk_existing@example.com,Test123!,\n"
+    )
+    res = client.post("/admin/users/import", data=body, headers=admin_headers, content_type="text/csv")
+    assert res.status_code == 200
+    assert res.json["created"] == 2
+    assert {(e["row"], e["error"]) for e in res.json["errors"]} == {
+        (3, "Invalid email"),
+        (4, "Invalid password"),
+        (5, "Duplicate email in import"),
+        (6, "Email already exists"),
+    }
+
+    user = User.find_by_email("bulk_one@example.com")
+    assert user.full_name == "Bulk One" and user.is_verified is False
+    assert hashing.check_password("Test123!", user.password)
+    assert client.get(f"/verify?token={sent_verification_token('bulk_one@example.com')}").status_code == 200
+
+
+def test_bulk_import_ndjson_verified_and_export(client, admin_headers):
+    """
+    Tests an NDJSON import of pre-verified users and that the export streams them back without password hashes.
+    """
+    body = '{"email": "bulk_nd@example.com", "password": "Test123!"}\n{broken\n'
+    res = client.post(
+        "/admin/users/import?verified=true", data=body, headers=admin_headers, content_type="application/x-ndjson"
+    )
+    assert res.json["created"] == 1
+    assert res.json["errors"] == [{"row": 2, "email": None, "error": "Malformed row"}]
+    assert EmailOutbox.query.filter_by(to_email="bulk_nd@example.com").count() == 0
+
+    res = client.get("/admin/users/export?format=ndjson", headers=admin_headers)
+    records = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+    exported = next(r for r in records if r["email"] == "bulk_nd@example.com")
+    assert exported["is_verified"] is True
+    assert "password" not in exported
+    assert len(records) == User.query.count()
+
+
+# ---------- VALIDATOR TESTS ----------
+
+
+def test_signup_reports_all_validation_errors(client, monkeypatch):
+    """
+    Tests that signup returns every invalid field at once and still sets the legacy 'error' message.
+    """
+    monkeypatch.setattr(deliverability, "resolver", lambda domain: domain != "nomail.example.com")
+    res = client.post("/signup", json={"email": "someone@nomail.example.com", "password": "short"})
+    assert res.status_code == 400
+    assert res.json["errors"] == {"email": "Invalid email", "password": "Invalid password"}
+    assert res.json["error"] == "Invalid email"
+
+
+def test_validate_profile_collects_every_error():
+    """
+    Tests that validate_profile reports all bad fields in PUT /profile order.
+    """
+    errors = validate_profile(full_name="x" * 21, phone_number="123", address="y" * 21)
+    assert list(errors) == ["full_name", "address", "phone_number"]
+    assert validate_profile("Name", "0541234567", "Tel Aviv") == {}
+    assert validate_signup("ok@example.com", "Test123!") == {}
+
+
+def test_deliverability_is_cached_per_domain(monkeypatch):
+    """
+    Tests that repeated checks of one domain cost a single resolver call, and unknown answers aren't cached.
+    """
+    calls = []
+
+    def resolver(domain):
+        calls.append(domain)
+        return None if domain == "flaky.example.com" else True
+
+    monkeypatch.setattr(deliverability, "resolver", resolver)
+    for i in range(5):
+        assert validate_signup(f"user{i}@Cached.Example.com", "Test123!") == {}
+    assert calls == ["cached.example.com"]
+
+    deliverability.is_deliverable("flaky.example.com")
+    deliverability.is_deliverable("flaky.example.com")
+    assert calls.count("flaky.example.com") == 2
+
+
+def test_slow_deliverability_lookup_fails_open(monkeypatch):
+    """
+    Tests that a resolver slower than the timeout doesn't block signup validation, and its answer is cached later.
+    """
+    release = threading.Event()
+
+    def slow_resolver(domain):
+        release.wait(5)
+        return False
+
+    monkeypatch.setattr(deliverability, "resolver", slow_resolver)
+    monkeypatch.setattr(deliverability, "timeout", 0.05)
+    assert deliverability.is_deliverable("slow.example.com") is True
+
+    release.set()
+    deadline = time.time() + 5
+    while "slow.example.com" not in deliverability._entries and time.time() < deadline:
+        time.sleep(0.01)
+    assert deliverability.is_deliverable("slow.example.com") is False
+
+
+# ---------- STARTUP / MIGRATION TESTS ----------
+
+
+def test_migrations_match_models(app, tmp_path):
+    """
+    Tests that `alembic upgrade head` builds exactly the schema models.py describes (no pending autogenerate diff).
+    """
+    import os
+    from alembic import command
+    from alembic.autogenerate import compare_metadata
+    from alembic.config import Config
+    from alembic.migration import MigrationContext
+    from sqlalchemy import create_engine
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    alembic_cfg = Config(os.path.join(backend_dir, "alembic.ini"))
+    alembic_cfg.set_main_option("script_location", os.path.join(backend_dir, "migrations"))
+    with engine.begin() as connection:
+        alembic_cfg.attributes.update(app=app, connection=connection, configure_logger=False)
+        command.upgrade(alembic_cfg, "head")
+
+    with engine.connect() as connection:
+        assert compare_metadata(MigrationContext.configure(connection), db.metadata) == []
+    engine.dispose()
+
+
+def test_migrations_upgrade_database_created_by_original_app(app, tmp_path):
+    """
+    Tests that a database created by the original app's db.create_all(), stamped at 0001, upgrades to the
+    current schema with its users kept and their pending verification links moved over hashed.
+    """
+    import os
+    import sqlalchemy as sa
+    from alembic import command
+    from alembic.autogenerate import compare_metadata
+    from alembic.config import Config
+    from alembic.migration import MigrationContext
+
+    original = sa.MetaData()
+    users = sa.Table(
+        "users", original,
+        sa.Column("id", sa.String(40), primary_key=True, unique=True),
+        sa.Column("email", sa.String(150), nullable=False, unique=True),
+        sa.Column("password", sa.String(150), nullable=False),
+        sa.Column("is_verified", sa.Boolean, default=False),
+        sa.Column("verification_token", sa.String(150), nullable=True, unique=True),
+        sa.Column("verification_token_expiry", sa.DateTime, nullable=True),
+        sa.Column("full_name", sa.String(150), nullable=True),
+        sa.Column("phone_number", sa.String(20), nullable=True),
+        sa.Column("address", sa.String(255), nullable=True),
+    )
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'original.db'}")
+    original.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(users.insert().values(
+            id="legacy-1", email="legacy@example.com", password="hashed", is_verified=False,
+            verification_token="legacy-token", verification_token_expiry=datetime.utcnow() + timedelta(hours=1),
+        ))
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    alembic_cfg = Config(os.path.join(backend_dir, "alembic.ini"))
+    alembic_cfg.set_main_option("script_location", os.path.join(backend_dir, "migrations"))
+    with engine.begin() as connection:
+        alembic_cfg.attributes.update(app=app, connection=connection, configure_logger=False)
+        command.stamp(alembic_cfg, "0001")
+        command.upgrade(alembic_cfg, "head")
+
+    with engine.connect() as connection:
+        assert compare_metadata(MigrationContext.configure(connection), db.metadata) == []
+        user = connection.execute(sa.text("SELECT created_at, version, token_generation FROM users")).one()
+        assert user.created_at is not None and (user.version, user.token_generation) == (1, 0)
+        token = connection.execute(sa.text("SELECT token_hash, user_id FROM verification_tokens")).one()
+        assert tuple(token) == (hash_token("legacy-token"), "legacy-1")
+    engine.dispose()
+
+
+
+# ---------- METRICS TESTS ----------
+
+
+@pytest.fixture
+def metrics_headers(app, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "metrics-secret")
+    return {"Authorization": "Bearer metrics-secret"}
+
+
+def test_metrics_endpoints_require_metrics_token(client, app, monkeypatch):
+    """
+    Tests that /metrics and /metrics/db-pool are off without METRICS_TOKEN and refuse requests without it.
+    """
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", None)
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics/db-pool").status_code == 404
+
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "metrics-secret")
+    for path in ("/metrics", "/metrics/db-pool"):
+        assert client.get(path).status_code == 403
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 403
+        assert client.get(path, headers={"Authorization": "Bearer metrics-secret"}).status_code == 200
+
+
+def test_metrics_endpoint_reports_routes_timers_and_counters(client, app, metrics_headers):
+    """
+    Tests that /metrics exposes per-endpoint latency, the bcrypt/DB/JWT timers and revocation/rate-limit counters.
+    """
+    with app.app_context():
+        revocation_store.refresh(force=True)  # so the checks below go through the Bloom filter
+    email = "metrics_user@example.com"
+    create_verified_user(client, email, "Test123!")
+    token = client.post("/logintoken", json={"email": email, "password": "Test123!"}).json["access_token"]
+    client.get("/profile", headers={"Authorization": f"Bearer {token}"})
+    for _ in range(3):
+        client.get("/test-limit")
+
+    res = client.get("/metrics", headers=metrics_headers)
+    assert res.status_code == 200
+    assert res.mimetype == "text/plain"
+    text = res.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",endpoint="app_routes.get_profile",status="200"}' in text
+    assert 'password_hash_seconds_count{op="check"}' in text
+    assert 'db_query_seconds_count{statement="SELECT"}' in text
+    assert 'jwt_seconds_count{op="encode"}' in text and 'jwt_seconds_count{op="decode"}' in text
+    assert 'revocation_checks_total{result="bloom_miss"}' in text
+    assert 'rate_limit_rejections_total{endpoint="test_limit",limit="2 per 1 minute"}' in text
+
+
+def test_histogram_renders_cumulative_buckets():
+    """
+    Tests that histogram buckets are cumulative and end with +Inf, _sum and _count.
+    """
+    from utils.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram("work_seconds", "Work.", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, op="a")
+    lines = registry.render().splitlines()
+    assert 'work_seconds_bucket{op="a",le="0.1"} 1.0' in lines
+    assert 'work_seconds_bucket{op="a",le="1.0"} 2.0' in lines
+    assert 'work_seconds_bucket{op="a",le="+Inf"} 3.0' in lines
+    assert 'work_seconds_count{op="a"} 3.0' in lines
+
+    registry.enabled = False
+    histogram.observe(0.05, op="a")
+    assert histogram.count(op="a") == 3
+
+
+# ---------- JWT SIGNING KEY TESTS ----------
+
+
+@pytest.fixture
+def eddsa_signing(app, tmp_path, monkeypatch):
+    """Switches token signing to EdDSA with a throw-away key directory for one test."""
+    monkeypatch.setitem(app.config, "JWT_ALGORITHM", "EdDSA")
+    key_ring.configure("EdDSA", keys_dir=str(tmp_path / "keys"), publish_ahead=3600, jwks_max_age=300)
+    yield key_ring
+    key_ring.configure("HS256")
+
+
+def test_eddsa_tokens_verify_locally_from_cached_jwks(client, eddsa_signing):
+    """
+    Tests that access tokens carry a kid, verify against the public JWKS alone, and the JWKS is cacheable.
+    """
+    import jwt as pyjwt
+
+    email = "eddsa@example.com"
+    create_verified_user(client, email, "Test123!")
+    token = client.post("/logintoken", json={"email": email, "password": "Test123!"}).json["access_token"]
+    assert pyjwt.get_unverified_header(token)["kid"] == eddsa_signing.signing_key().kid
+
+    res = client.get("/.well-known/jwks.json")
+    assert res.status_code == 200
+    assert res.cache_control.public and res.cache_control.max_age == 300
+    assert client.get("/.well-known/jwks.json", headers={"If-None-Match": res.headers["ETag"]}).status_code == 304
+
+    jwks = pyjwt.PyJWKSet.from_dict(res.json)
+    key = next(k for k in jwks.keys if k.key_id == pyjwt.get_unverified_header(token)["kid"])
+    assert pyjwt.decode(token, key.key, algorithms=["EdDSA"])["email"] == email
+    assert client.get("/profile", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+
+def test_key_rotation_publishes_new_keys_ahead_and_retires_old_ones(app, eddsa_signing):
+    """
+    Tests that a rotated-in key is published before it signs, and retired keys are deleted once no token can use them.
+    """
+    first = eddsa_signing.signing_key().kid
+    added = eddsa_signing.rotate(force=True)["added"]
+    kids = [k["kid"] for k in json.loads(eddsa_signing.jwks()[0])["keys"]]
+    assert kids == [first, added]
+    assert eddsa_signing.signing_key().kid == first
+
+    # Pretend both activated long ago: the new key signs now and the old one is past its retention.
+    def backdate(kid, stamp):
+        renamed = f"{stamp}-{kid.split('-', 1)[1]}"
+        os.rename(os.path.join(eddsa_signing.keys_dir, f"{kid}.pem"), os.path.join(eddsa_signing.keys_dir, f"{renamed}.pem"))
+        return renamed
+
+    first, added = backdate(first, "19990101T000000Z"), backdate(added, "20000101T000000Z")
+    eddsa_signing.reload(force=True)
+    assert eddsa_signing.signing_key().kid == added
+    rotated = eddsa_signing.rotate()
+    assert rotated["removed"] == [first]
+    # `added` is itself past JWT_KEY_ROTATION_DAYS, so a successor was scheduled in the same pass.
+    assert [k["kid"] for k in json.loads(eddsa_signing.jwks()[0])["keys"]] == [added, rotated["added"]]
+
+
+# ---------- USER SHARDING TESTS ----------
+
+
+@pytest.fixture
+def two_user_shards(tmp_path):
+    """Shards the user tables over two throw-away SQLite databases for one test."""
+    user_shards.configure([f"sqlite:///{tmp_path / 'shard0.db'}", f"sqlite:///{tmp_path / 'shard1.db'}"])
+    for engine in user_shards.engines:
+        db.metadata.create_all(engine)
+    yield user_shards
+    user_shards.configure([])
+
+
+def emails_on_each_shard(router, prefix):
+    """One email per shard, in shard order."""
+    emails, i = {}, 0
+    while len(emails) < router.count:
+        email = f"{prefix}{i}@example.com"
+        emails.setdefault(router.shard_for_email(email), email)
+        i += 1
+    return [emails[shard] for shard in range(router.count)]
+
+
+def test_sharded_users_live_on_their_email_shard(client, two_user_shards):
+    """
+    Tests that signup, verification, login, refresh and profile updates all run against the user's own shard.
+    """
+    for shard, email in enumerate(emails_on_each_shard(two_user_shards, "sharded")):
+        assert client.post("/signup", json={"email": email, "password": "Test123!"}).status_code == 200
+        two_user_shards.use_email(email)
+        assert client.get(f"/verify?token={sent_verification_token(email)}").status_code == 200
+
+        res = client.post("/logintoken", json={"email": email, "password": "Test123!"})
+        assert res.status_code == 200
+        headers = {"Authorization": f"Bearer {res.json['access_token']}"}
+        assert id_bucket(decode_token(res.json["access_token"])["sub"]) == email_bucket(email)
+        assert client.patch("/profile", json={"address": f"Shard {shard}"}, headers=headers).status_code == 200
+        assert client.post("/token/refresh", json={"refresh_token": res.json["refresh_token"]}).status_code == 200
+        assert len(client.get("/sessions", headers=headers).json) == 1
+
+        for index, engine in enumerate(two_user_shards.engines):
+            with engine.connect() as connection:
+                address = connection.execute(select(User.address).where(User.email == email)).scalar()
+            assert address == (f"Shard {shard}" if index == shard else None)
+        with db.engine.connect() as connection:
+            assert connection.execute(select(User.id).where(User.email == email)).first() is None
+
+
+def test_reshard_users_copies_users_with_their_rows(client, tmp_path):
+    """
+    Tests that resharding the single database copies each user and their sessions to the shard of their
+    email bucket, and that a repeated run copies nothing.
+    """
+    email = "reshard@example.com"
+    _, user_id = get_token_and_user_id(client, email, "Test123!")
+    urls = [f"sqlite:///{tmp_path / 'new0.db'}", f"sqlite:///{tmp_path / 'new1.db'}"]
+    engines = [create_engine(url) for url in urls]
+    for engine in engines:
+        db.metadata.create_all(engine)
+
+    assert reshard_users(urls)["users_moved"] >= 1
+    target = engines[user_shards.shard_for_bucket(email_bucket(email), count=2)]
+    with target.connect() as connection:
+        assert connection.execute(select(User.id).where(User.email == email)).scalar() == user_id
+        sessions = db.metadata.tables["sessions"]
+        assert connection.execute(select(sessions.c.id).where(sessions.c.user_id == user_id)).first() is not None
+
+    assert reshard_users(urls)["rows_copied"] == 0
+    for engine in engines:
+        engine.dispose()
+
+
+# ---------- READ REPLICA TESTS ----------
+
+
+@pytest.fixture
+def snapshot_replica(app, tmp_path):
+    """A read replica that is a frozen copy of the test database, i.e. one that stopped replicating."""
+    import sqlite3
+
+    path = tmp_path / "replica.db"
+
+    def snapshot():
+        with app.app_context():
+            source = db.engine.raw_connection()
+            try:
+                target = sqlite3.connect(path)
+                source.driver_connection.backup(target)
+                target.close()
+            finally:
+                source.close()
+
+    snapshot()
+    read_replicas.configure(default=[f"sqlite:///{path}"])
+    read_replicas.check()
+    yield snapshot
+    read_replicas.stop()
+    read_replicas.configure()
+
+
+def test_profile_reads_use_replica_except_after_own_writes(client, snapshot_replica, monkeypatch):
+    """
+    Tests that GET /profile reads the replica, falls back to the primary when the replica is out of rotation,
+    and reads the primary right after the user's own PATCH.
+    """
+    token, user_id = get_token_and_user_id(client, "replica@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    snapshot_replica()
+    # Changed on the primary behind the replica's back (not by the user's own request).
+    User.query.filter_by(id=user_id).update({"address": "Primary only"})
+    db.session.commit()
+
+    assert client.get("/profile", headers=headers).json["address"] is None
+
+    # Any lag is too much: the health check takes the replica out of rotation.
+    monkeypatch.setattr(read_replicas, "max_lag", -1.0)
+    read_replicas.check()
+    profile_cache.invalidate(user_id)
+    assert client.get("/profile", headers=headers).json["address"] == "Primary only"
+    monkeypatch.setattr(read_replicas, "max_lag", 2.0)
+    read_replicas.check()
+
+    res = client.patch("/profile", json={"full_name": "Sticky"}, headers=headers)
+    assert res.status_code == 200
+    headers = {"Authorization": f"Bearer {res.json['access_token']}"}
+    assert client.get("/profile", headers=headers).json["full_name"] == "Sticky"
+
+
+def test_own_writes_are_read_back_on_a_worker_that_never_saw_them(client, snapshot_replica):
+    """
+    Tests that read-your-writes needs no state in the process: with the cache emptied after the PATCH (as on
+    another worker), the lagging replica is skipped for the primary because of the re-issued token's version,
+    and a login right after a password reset is checked against the primary's hash.
+    """
+    email = "replica_worker@example.com"
+    token, user_id = get_token_and_user_id(client, email, "Test123!")
+    snapshot_replica()
+
+    res = client.patch("/profile", json={"full_name": "Written"}, headers={"Authorization": f"Bearer {token}"})
+    assert res.status_code == 200
+    profile_cache.clear()
+    res = client.get("/profile", headers={"Authorization": f"Bearer {res.json['access_token']}"})
+    assert res.json["full_name"] == "Written"
+
+    # Stands in for a reset the replica hasn't received yet.
+    User.query.filter_by(id=user_id).update({"password": hashing.hash_password("Reset123!")})
+    db.session.commit()
+    assert client.post("/logintoken", json={"email": email, "password": "Reset123!"}).status_code == 200
+    assert client.post("/logintoken", json={"email": email, "password": "Test123!"}).status_code == 401
+
+
+def test_login_falls_back_to_primary_for_users_missing_on_replica(client, snapshot_replica):
+    """
+    Tests that a user verified after the replica's snapshot can still log in.
+    """
+    email = "replica_new@example.com"
+    create_verified_user(client, email, "Test123!")
+    res = client.post("/logintoken", json={"email": email, "password": "Test123!"})
+    assert res.status_code == 200
+
+
+# ---------- LOGGING TESTS ----------
+
+
+@pytest.fixture
+def log_output():
+    """Points the app's logging at a buffer (every access line kept) and restores the previous setup afterwards."""
+    import io
+    import logging
+
+    settings = dict(structured_logging.settings)
+    buffer = io.StringIO()
+    structured_logging.configure(
+        **{**settings, "stream": buffer, "filename": None, "fmt": "json", "sample_rates": "access=1,sampled=0"}
+    )
+
+    def records():
+        structured_logging.flush()
+        return [json.loads(line) for line in buffer.getvalue().splitlines()]
+
+    yield logging.getLogger, records
+    if settings:
+        structured_logging.configure(**settings)
+    else:
+        structured_logging.reset()
+
+
+def test_logs_are_json_with_request_ids_and_redacted(client, log_output):
+    """
+    Tests that the access log and the app's own records carry the request id, which is echoed back, and that
+    email addresses, passwords and tokens never reach the output.
+    """
+    get_logger, records = log_output
+    res = client.post("/signup", json={"email": "log_user@example.com", "password": "Test123!"},
+                      headers={"X-Request-ID": "req-42"})
+    assert res.headers["X-Request-ID"] == "req-42"
+    assert re.fullmatch(r"[0-9a-f]{32}", client.get("/").headers["X-Request-ID"])
+
+    get_logger("routes").warning("Lookup for log_user@example.com with token=abc123", extra={"password": "Test123!"})
+    output = records()
+    access = next(r for r in output if r["logger"] == "access" and r["request_id"] == "req-42")
+    assert access["method"] == "POST" and access["path"] == "/signup" and access["status"] == 200
+    warning = next(r for r in output if r["logger"] == "routes")
+    assert warning["message"] == "Lookup for l***@example.com with token=[redacted]"
+    assert warning["password"] == "[redacted]"
+    assert "log_user@example.com" not in json.dumps(output)
+
+
+def test_log_sampling_spares_warnings(log_output):
+    """
+    Tests that a category sampled at 0 loses its info records but keeps its warnings.
+    """
+    get_logger, records = log_output
+    get_logger("sampled.module").info("Dropped")
+    get_logger("sampled.module").warning("Kept")
+    get_logger("other").info("Unsampled")
+    messages = [r["message"] for r in records()]
+    assert "Dropped" not in messages
+    assert "Kept" in messages and "Unsampled" in messages
+
+
+def test_logging_setup_leaves_testing_and_configured_root_logger_alone(app, monkeypatch):
+    """
+    Tests that LOG_CONFIGURE=auto only takes over a root logger nobody configured, outside TESTING.
+    """
+    import logging
+
+    monkeypatch.setitem(app.config, "LOG_CONFIGURE", "auto")
+    monkeypatch.setattr(logging.getLogger(), "handlers", [logging.NullHandler()])
+    assert not structured_logging.should_configure(app)
+
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    assert structured_logging.should_configure(app)
+    monkeypatch.setattr(app, "testing", True)
+    assert not structured_logging.should_configure(app)
+
+    monkeypatch.setitem(app.config, "LOG_CONFIGURE", "true")
+    assert structured_logging.should_configure(app)
+
+
+# ---------- JWT VERIFY CACHE TESTS ----------
+
+
+def test_repeat_tokens_skip_verification_until_exp(client, monkeypatch):
+    """
+    Tests that a token presented again is answered from the verified-token cache without another signature check,
+    and that the cached entry stops being used at the token's exp.
+    """
+    import utils.jwt_cache as jwt_cache
+
+    token, _ = get_token_and_user_id(client, "jwt_cache@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/profile", headers=headers).status_code == 200
+    decodes, hits = metrics.jwt.count(op="decode"), verified_tokens.hits
+    for _ in range(3):
+        assert client.get("/profile", headers=headers).status_code == 200
+    assert metrics.jwt.count(op="decode") == decodes
+    assert verified_tokens.hits == hits + 3
+
+    exp = decode_token(token)["exp"]
+    key_for = flask_app.extensions["flask-jwt-extended"].decode_key_for
+
+    class Clock:
+        now = exp - 0.001
+
+        @classmethod
+        def time(cls):
+            return cls.now
+
+    monkeypatch.setattr(jwt_cache, "time", Clock)
+    with flask_app.app_context():
+        assert verified_tokens.get(token, key_for)["exp"] == exp
+        Clock.now = exp
+        expired = metrics.jwt_verify_cache.value(result="expired")
+        assert verified_tokens.get(token, key_for) is None
+    assert metrics.jwt_verify_cache.value(result="expired") == expired + 1
+
+
+def test_caching_jwt_manager_matches_flask_jwt_extended():
+    """
+    Tests that the private Flask-JWT-Extended method CachingJWTManager overrides still has the signature it
+    assumes and is still what decode_token() calls; an upgrade that changes either must revisit the override.
+    """
+    import inspect
+    from flask_jwt_extended import JWTManager, utils as jwt_utils
+
+    parameters = inspect.signature(JWTManager._decode_jwt_from_config).parameters
+    assert list(parameters) == ["self", "encoded_token", "csrf_value", "allow_expired"]
+    assert "._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)" in inspect.getsource(
+        jwt_utils.decode_token
+    )
+    # The key callback comes from the public decode_key_loader(), not the manager's private attribute.
+    assert flask_app.extensions["flask-jwt-extended"].decode_key_for is jwt_decode_key
+
+
+def test_verify_cache_drops_revoked_tokens_and_old_keys(client, monkeypatch):
+    """
+    Tests that cached tokens are rejected once logged out, and once the signing secret they were verified with changes.
+    """
+    token, _ = get_token_and_user_id(client, "jwt_cache_revoke@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/profile", headers=headers).status_code == 200
+    assert client.post("/logout", headers=headers).status_code == 200
+    assert client.get("/profile", headers=headers).status_code == 401
+    assert token_digest_cached(token) is False
+
+    other, _ = get_token_and_user_id(client, "jwt_cache_key@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {other}"}
+    assert client.get("/profile", headers=headers).status_code == 200
+    monkeypatch.setitem(flask_app.config, "JWT_SECRET_KEY", "rotated-secret")
+    assert client.get("/profile", headers=headers).status_code == 422
+    assert token_digest_cached(other) is False
+
+
+def token_digest_cached(token):
+    from utils.jwt_cache import token_digest
+
+    return token_digest(token) in verified_tokens._entries
+
+
+# ---------- RESPONSE ENCODING / CACHING TESTS ----------
+
+
+def test_frontend_assets_are_hashed_immutable_and_precompressed(client):
+    """
+    Tests that pages reference content-hashed asset URLs that are cached for a year, served gzipped when accepted,
+    and revalidated with a 304, while unknown or unhashed asset names are 404.
+    """
+    import gzip
+
+    page = client.get("/app/")
+    assert page.status_code == 200 and page.headers["Cache-Control"] == "public, no-cache"
+    script_url = re.search(r'src="(/app/assets/script\.[0-9a-f]{10}\.js)"', page.get_data(as_text=True)).group(1)
+
+    plain = client.get(script_url)
+    assert plain.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert re.search(r'"/app/assets/eye-off\.[0-9a-f]{10}\.png"', plain.get_data(as_text=True))
+    zipped = client.get(script_url, headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in zipped.headers["Vary"]
+    assert gzip.decompress(zipped.data) == plain.data and len(zipped.data) < len(plain.data)
+    assert client.get(script_url, headers={"Accept-Encoding": "gzip", "If-None-Match": zipped.headers["ETag"]}).status_code == 304
+
+    assert client.get("/app/assets/script.js").status_code == 404
+    assert client.get("/app/assets/script.0000000000.js").status_code == 404
+
+
+def test_api_cache_headers_and_compression(client, metrics_headers):
+    """
+    Tests that large API bodies are gzipped for clients that accept it, repeat GETs revalidate to a 304, and
+    token-bearing responses are marked no-store.
+    """
+    import gzip
+
+    res = client.get("/metrics", headers={**metrics_headers, "Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in res.headers["Vary"]
+    assert b"http_request_duration_seconds" in gzip.decompress(res.data)
+    assert "Content-Encoding" not in client.get("/metrics", headers=metrics_headers).headers
+
+    home = client.get("/")
+    assert home.headers["Cache-Control"] == "private, no-cache"
+    assert client.get("/", headers={"If-None-Match": home.headers["ETag"]}).status_code == 304
+
+    email = "encoding_user@example.com"
+    create_verified_user(client, email, "Test123!")
+    login = client.post("/logintoken", json={"email": email, "password": "Test123!"})
+    assert login.status_code == 200 and login.headers["Cache-Control"] == "no-store"
+
+
+def test_compressed_responses_get_their_own_etag(client, monkeypatch):
+    """
+    Tests that a gzipped body has an ETag distinct from the identity one, revalidates to a 304 with it, and
+    that the suffixed ETag still satisfies If-Match on PATCH /profile.
+    """
+    from utils.compression import compression
+
+    monkeypatch.setattr(compression, "min_size", 0)
+    token, _ = get_token_and_user_id(client, "etag_encoding@example.com", "Test123!")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    plain = client.get("/profile", headers=headers)
+    zipped = client.get("/profile", headers={**headers, "Accept-Encoding": "gzip"})
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert zipped.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+
+    revalidated = client.get("/profile", headers={**headers, "Accept-Encoding": "gzip", "If-None-Match": zipped.headers["ETag"]})
+    assert revalidated.status_code == 304 and revalidated.headers["ETag"] == zipped.headers["ETag"]
+    assert client.get("/profile", headers={**headers, "If-None-Match": zipped.headers["ETag"]}).status_code == 200
+
+    res = client.patch("/profile", json={"address": "Eilat"}, headers={**headers, "If-Match": zipped.headers["ETag"]})
+    assert res.status_code == 200
+
+
+def test_orjson_provider_matches_flask_json():
+    """
+    Tests that the orjson provider encodes dates, UUIDs, Decimals and key order like Flask's own provider.
+    """
+    import decimal
+    import uuid
+    from flask.json.provider import DefaultJSONProvider
+    from utils.json_provider import OrjsonProvider
+
+    value = {
+        "b": [1, 2.5, None, True],
+        "a": {"when": datetime(2026, 1, 2, 3, 4, 5), "id": uuid.UUID(int=1), "price": decimal.Decimal("1.10")},
+    }
+    fast, standard = OrjsonProvider(flask_app), DefaultJSONProvider(flask_app)
+    assert fast.dumps(value) == standard.dumps(value, separators=(",", ":"))
+    # Beyond orjson's 64-bit integers: handed to the standard encoder.
+    assert fast.dumps({"big": 2 ** 70}) == standard.dumps({"big": 2 ** 70}, separators=(",", ":"))
+    with flask_app.app_context():
+        assert json.loads(fast.response(value).data) == json.loads(standard.response(value).data)
+        assert json.loads(fast.response(name="שלום").data) == {"name": "שלום"}
+
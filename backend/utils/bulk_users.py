@@ -0,0 +1,211 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import csv
+import io
+import itertools
+import json
+import logging
+import uuid
+from flask import current_app
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from extensions import db, hashing
+from models import EmailOutbox, User, VerificationToken
+from utils.email_utils import VERIFICATION_SUBJECT, outbox, verification_email_body
+from utils.hashing import hash_passwords
+from utils.sharding import new_user_id, tag_token, user_shards
+from utils.validators import normalize_email, validate_profile, validate_signup
+from utils.verification import hash_token
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "ndjson")
+EXPORT_FIELDS = ("id", "email", "is_verified", "created_at", "full_name", "phone_number", "address")
+
+
+def read_rows(stream, fmt):
+    """
+    Yields (row_number, dict) from a text stream one row at a time. A malformed NDJSON line
+    yields (row_number, None) so the importer can report it without stopping.
+    """
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, row
+    elif fmt == "ndjson":
+        for number, line in enumerate((line for line in stream if line.strip()), start=1):
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unsupported format {fmt!r}, expected one of {FORMATS}")
+
+
+def validate_row(row):
+    """Returns (values, None) for a valid row or (None, error message), using the same rules as /signup and PUT /profile."""
+    if row is None:
+        return None, "Malformed row"
+    email, password = row.get("email"), row.get("password")
+    if not isinstance(email, str) or not email or not isinstance(password, str) or not password:
+        return None, "Missing credentials"
+    email = normalize_email(email)
+    profile = {field: (row.get(field) or None) for field in ("full_name", "phone_number", "address")}
+    errors = {**validate_signup(email, password), **validate_profile(**profile)}
+    if errors:
+        return None, "; ".join(errors.values())
+    return {"email": email, "password": password, **profile}, None
+
+
+class BulkImportReport:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def error(self, number, email, message):
+        self.errors.append({"row": number, "email": email, "error": message})
+
+    def as_dict(self):
+        return {"created": self.created, "failed": len(self.errors), "errors": self.errors}
+
+
+def import_users(rows, verified=False, batch_size=None, workers=None):
+    """
+    Creates users from (row_number, dict) pairs, e.g. read_rows(). Rows are validated one by one and
+    written in batches of BULK_IMPORT_BATCH_SIZE, per user shard: one duplicate lookup, passwords hashed
+    across `workers` processes (BULK_IMPORT_WORKERS), then a single executemany INSERT per table and one
+    commit. Unless `verified`, verification tokens and outbox emails are created in the same batch.
+    Returns a report with per-row errors.
+    """
+    config = current_app.config
+    batch_size = batch_size or config["BULK_IMPORT_BATCH_SIZE"]
+    workers = config["BULK_IMPORT_WORKERS"] if workers is None else workers
+    report = BulkImportReport()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers else None
+    try:
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            _import_batch(batch, verified, executor, report)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if not verified and report.created:
+        outbox.notify()
+    logger.info("Bulk import created %d users, %d rows failed", report.created, len(report.errors))
+    return report.as_dict()
+
+
+def _import_batch(batch, verified, executor, report):
+    valid = {}
+    for number, row in batch:
+        values, error = validate_row(row)
+        if error:
+            report.error(number, row.get("email") if isinstance(row, dict) else None, error)
+        elif values["email"] in valid:
+            report.error(number, values["email"], "Duplicate email in import")
+        else:
+            valid[values["email"]] = (number, values)
+
+    by_shard = {}
+    for email, entry in valid.items():
+        by_shard.setdefault(user_shards.shard_for_email(email), {})[email] = entry
+    for shard, entries in sorted(by_shard.items()):
+        user_shards.use(shard)
+        _import_shard_batch(entries, verified, executor, report)
+
+
+def _import_shard_batch(valid, verified, executor, report):
+    # One retry covers users created concurrently (e.g. via /signup) between the lookup and the insert.
+    for attempt in range(2):
+        existing = db.session.execute(select(User.email).where(User.email.in_(list(valid)))).scalars().all()
+        for email in existing:
+            number, _ = valid.pop(email)
+            report.error(number, email, "Email already exists")
+        if not valid:
+            return
+        try:
+            _insert_batch(list(valid.values()), verified, executor)
+            db.session.commit()
+            report.created += len(valid)
+            return
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                for number, values in valid.values():
+                    report.error(number, values["email"], "Email already exists")
+
+
+def _insert_batch(entries, verified, executor):
+    hashed = hash_passwords([values["password"] for _, values in entries], executor, hashing.policy)
+    now = datetime.utcnow()
+    users, tokens, emails = [], [], []
+    for (_, values), password_hash in zip(entries, hashed):
+        user_id = new_user_id(values["email"])
+        users.append({**values, "id": user_id, "password": password_hash, "is_verified": verified, "created_at": now})
+        if not verified:
+            token = tag_token(str(uuid.uuid4()), user_id)
+            tokens.append({"token_hash": hash_token(token), "user_id": user_id, "expires_at": now + _token_ttl()})
+            emails.append(
+                {
+                    "to_email": values["email"],
+                    "subject": VERIFICATION_SUBJECT,
+                    "body": verification_email_body(token),
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                    "created_at": now,
+                }
+            )
+    db.session.execute(insert(User), users)
+    if tokens:
+        db.session.execute(insert(VerificationToken), tokens)
+        db.session.execute(insert(EmailOutbox), emails)
+
+
+def _token_ttl():
+    return timedelta(minutes=current_app.config["VERIFICATION_TOKEN_TTL_MINUTES"])
+
+
+def export_users(fmt, batch_size=None):
+    """
+    Yields the users table as CSV or NDJSON text chunks, one chunk per batch, shard after shard. Pages by
+    primary key (keyset pagination), so memory stays flat however large the table is. Password hashes are
+    never exported.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format {fmt!r}, expected one of {FORMATS}")
+    batch_size = batch_size or current_app.config["BULK_IMPORT_BATCH_SIZE"]
+    columns = [getattr(User, field) for field in EXPORT_FIELDS]
+    if fmt == "csv":
+        yield ",".join(EXPORT_FIELDS) + "\r\n"
+
+    for shard in range(user_shards.count):
+        last_id = None
+        while True:
+            # Selected per page: the response streams, and the session may be used in between.
+            user_shards.use(shard)
+            query = select(*columns).order_by(User.id).limit(batch_size)
+            if last_id is not None:
+                query = query.where(User.id > last_id)
+            rows = db.session.execute(query).all()
+            db.session.rollback()  # don't hold a read transaction open between pages
+            if not rows:
+                break
+            last_id = rows[-1].id
+            yield _serialize(rows, fmt)
+
+
+def _serialize(rows, fmt):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record["created_at"] = record["created_at"].isoformat()
+        if writer is not None:
+            writer.writerow(record.values())
+        else:
+            buffer.write(json.dumps(record) + "\n")
+    return buffer.getvalue()
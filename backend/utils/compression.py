@@ -0,0 +1,110 @@
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # only needed for "br" in COMPRESS_ENCODINGS
+    brotli = None
+
+ENCODINGS = ("br", "gzip")
+
+# Images (PNG, JPEG, WebP) and archives are compressed already; gzipping them costs CPU for nothing.
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "image/svg+xml")
+
+
+def compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES)
+
+
+def compress(data, encoding, level):
+    """`level` is the gzip level (1-9) or the brotli quality (0-11)."""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    # mtime=0 keeps the output identical for identical input (stable precompressed assets).
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def negotiate(accept_encodings, available):
+    """The encoding from `available` (in preference order) the client accepts with the highest q, or None."""
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class Compression:
+    """
+    Compresses responses after the view: bodies of at least COMPRESS_MIN_SIZE bytes in a text, JSON or JS type,
+    with the first encoding of COMPRESS_ENCODINGS ("br,gzip"; br needs the brotli package) the client accepts.
+    Streamed responses (the bulk export) and ones that already have a Content-Encoding (the precompressed
+    frontend assets, see utils/frontend_assets.py) are left alone. A compressed body is a representation of its
+    own, so its ETag gets the encoding as a suffix ("v7" becomes "v7-gzip", as the frontend assets do);
+    etag_versions() in utils/profiles.py reads the version back for If-Match. A revalidation with such an ETag
+    is answered here with a 304, without compressing the body again.
+    """
+
+    def __init__(self, app=None):
+        self.encodings = ("gzip",)
+        self.min_size = 500
+        self.levels = {"gzip": 6, "br": 4}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.configure(
+            [name.strip() for name in config.get("COMPRESS_ENCODINGS", "gzip").split(",") if name.strip()],
+            min_size=config.get("COMPRESS_MIN_SIZE", 500),
+            gzip_level=config.get("COMPRESS_GZIP_LEVEL", 6),
+            brotli_quality=config.get("COMPRESS_BROTLI_QUALITY", 4),
+        )
+        app.after_request(self._compress)
+        app.extensions["compression"] = self
+
+    def configure(self, encodings, min_size=500, gzip_level=6, brotli_quality=4):
+        for encoding in encodings:
+            if encoding not in ENCODINGS:
+                raise ValueError(f"Unknown encoding in COMPRESS_ENCODINGS: {encoding}")
+            if encoding == "br" and brotli is None:
+                raise RuntimeError("COMPRESS_ENCODINGS=br requires the brotli package")
+        self.encodings = tuple(encodings)
+        self.min_size = min_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+
+    def _compress(self, response):
+        if (
+            not self.encodings
+            or request.method == "HEAD"
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.is_streamed
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or "no-transform" in response.headers.get("Cache-Control", "")
+            or not compressible(response.mimetype)
+        ):
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(request.accept_encodings, self.encodings)
+        if encoding is None:
+            return response
+        etag, weak = response.get_etag()
+        if etag and request.if_none_match.contains_weak(f"{etag}-{encoding}"):
+            # The view compared If-None-Match with the identity ETag; the client holds the compressed one.
+            response.set_etag(f"{etag}-{encoding}", weak)
+            return response.make_conditional(request)
+        body = compress(data, encoding, self.levels[encoding])
+        if len(body) < len(data):
+            response.set_data(body)
+            response.headers["Content-Encoding"] = encoding
+            if etag:
+                response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+
+compression = Compression()
@@ -0,0 +1,73 @@
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection and how often they time out."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_count += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def engine_options(uri, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800, statement_timeout_ms=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`. In-memory SQLite keeps Flask-SQLAlchemy's single shared connection."""
+    if not uri or uri in ("sqlite://", "sqlite:///:memory:"):
+        return {}
+
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": pool_recycle,
+        "pool_pre_ping": not uri.startswith("sqlite"),
+    }
+    if statement_timeout_ms:
+        if uri.startswith("postgresql"):
+            options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout_ms}"}
+        elif uri.startswith("mysql"):
+            options["connect_args"] = {"init_command": f"SET SESSION max_execution_time={statement_timeout_ms}"}
+    return options
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update(
+                wait_count=pool.wait_count,
+                wait_avg_ms=round(pool.wait_total / pool.wait_count * 1000, 3) if pool.wait_count else 0.0,
+                wait_max_ms=round(pool.wait_max * 1000, 3),
+                timeouts=pool.timeouts,
+            )
+    return stats
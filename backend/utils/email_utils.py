@@ -1,16 +1,24 @@
 import smtplib
 from email.message import EmailMessage
-import random
-from config import EMAIL_ADDRESS, EMAIL_PASSWORD
-import uuid
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import logging
+import os
+import threading
+from config import EMAIL_ADDRESS
+from extensions import db
+from models import EmailOutbox
+from utils.metrics import metrics
+from utils.sharding import user_shards
 
-def send_verification_email(to_email, token):
+logger = logging.getLogger(__name__)
+
+VERIFICATION_SUBJECT = "Home Task - Verify your email"
+
+
+def verification_email_body(token):
     link = f"http://localhost:5000/verify?token={token}"
-    msg = EmailMessage()
-    msg['Subject'] = "Home Task - Verify your email"
-    msg['From'] = EMAIL_ADDRESS
-    msg['To'] = to_email
-    msg.set_content(f"""
+    return f"""
 Hi,
 
 Thank you for registering!
@@ -19,12 +27,248 @@ Please verify your email by clicking the link below:
 {link}
 
 If you did not request this, you can safely ignore this email.
-""")
+"""
+
+
+def queue_verification_email(to_email, token):
+    """
+    Adds the verification email to the outbox in the caller's session.
+    It is only sent once the caller commits, so the email and the user row succeed or fail together.
+    """
+    message = EmailOutbox(
+        to_email=to_email,
+        subject=VERIFICATION_SUBJECT,
+        body=verification_email_body(token),
+    )
+    db.session.add(message)
+    return message
+
+
+class SMTPConnectionPool:
+    """Keeps up to `size` logged-in SMTP connections open so batches don't pay for a handshake and login each time."""
+
+    def __init__(self, host, port, use_ssl=True, username=None, password=None, size=2, timeout=10):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _is_alive(self, smtp):
+        try:
+            return smtp.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    @contextmanager
+    def connection(self):
+        smtp = None
+        while smtp is None:
+            with self._lock:
+                candidate = self._idle.pop() if self._idle else None
+            if candidate is None:
+                break
+            # NOOP is a network round trip, so the check runs outside the lock
+            if self._is_alive(candidate):
+                smtp = candidate
+            else:
+                self._discard(candidate)
+        if smtp is None:
+            smtp = self._connect()
+        try:
+            yield smtp
+        except Exception:
+            self._discard(smtp)
+            raise
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(smtp)
+                return
+        self._discard(smtp)
+
+    def _discard(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp in idle:
+            self._discard(smtp)
+
+
+class OutboxDispatcher:
+    """
+    Sends pending EmailOutbox rows in batches over pooled SMTP connections.
+    Failed sends are retried with exponential backoff until OUTBOX_MAX_ATTEMPTS, then marked failed.
+    With OUTBOX_AUTOSTART the dispatcher runs in a daemon thread started on the first request
+    of every worker process; otherwise call dispatch_batch() from a job runner.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.smtp = None
+        self.sender = None
+        self.batch_size = 50
+        self.poll_interval = 1.0
+        self.max_attempts = 8
+        self.backoff_base = 5.0
+        self.backoff_max = 600.0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.app = app
+        self.smtp = SMTPConnectionPool(
+            config.get("SMTP_HOST", "smtp.gmail.com"),
+            config.get("SMTP_PORT", 465),
+            use_ssl=config.get("SMTP_USE_SSL", True),
+            username=config.get("SMTP_USERNAME"),
+            password=config.get("SMTP_PASSWORD"),
+            size=config.get("SMTP_POOL_SIZE", 2),
+        )
+        self.sender = config.get("MAIL_SENDER", EMAIL_ADDRESS)
+        self.batch_size = config.get("OUTBOX_BATCH_SIZE", 50)
+        self.poll_interval = config.get("OUTBOX_POLL_INTERVAL", 1.0)
+        self.max_attempts = config.get("OUTBOX_MAX_ATTEMPTS", 8)
+        self.backoff_base = config.get("OUTBOX_BACKOFF_BASE", 5.0)
+        self.backoff_max = config.get("OUTBOX_BACKOFF_MAX", 600.0)
+        app.extensions["outbox"] = self
+        if config.get("OUTBOX_AUTOSTART", True):
+            app.before_request(self.ensure_started)
+
+    def _build_message(self, row):
+        msg = EmailMessage()
+        msg["Subject"] = row.subject
+        msg["From"] = self.sender
+        msg["To"] = row.to_email
+        msg.set_content(row.body)
+        return msg
+
+    def _finish(self, row, status):
+        # The body holds a live verification link (also usable as a password reset code); once the message
+        # is out or abandoned nothing needs it, so it doesn't stay readable in the table.
+        row.status = status
+        row.body = ""
+
+    def _record_failure(self, row, error):
+        row.attempts += 1
+        row.last_error = str(error)[:255]
+        if row.attempts >= self.max_attempts:
+            self._finish(row, "failed")
+            logger.error("Giving up on outbox message %s after %s attempts", row.id, row.attempts)
+            return
+        delay = min(self.backoff_base * 2 ** (row.attempts - 1), self.backoff_max)
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+    def dispatch_batch(self):
+        """
+        Sends up to OUTBOX_BATCH_SIZE due messages from each user shard. Must run inside an app context.
+        Returns the number sent.
+        """
+        sent = 0
+        for shard in user_shards.each():
+            sent += self._dispatch_shard()
+        return sent
+
+    def _dispatch_shard(self):
+        now = datetime.utcnow()
+        rows = (
+            EmailOutbox.query.filter(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not rows:
+            db.session.rollback()
+            return 0
+
+        sent = 0
+        pending = list(rows)
+        while pending:
+            connected = False
+            try:
+                with self.smtp.connection() as smtp:
+                    connected = True
+                    while pending:
+                        with metrics.smtp_sends.time():
+                            smtp.send_message(self._build_message(pending[0]))
+                        row = pending.pop(0)
+                        self._finish(row, "sent")
+                        row.sent_at = datetime.utcnow()
+                        sent += 1
+            except (smtplib.SMTPException, OSError) as e:
+                if connected:
+                    # Only the message in flight is charged; the rest go out over a fresh connection.
+                    self._record_failure(pending.pop(0), e)
+                else:
+                    # Server unreachable or login refused: back off the whole batch.
+                    for row in pending:
+                        self._record_failure(row, e)
+                    pending = []
+        db.session.commit()
+        return sent
+
+    def notify(self):
+        """Wakes the dispatcher thread so freshly committed messages go out without waiting for the next poll."""
+        self._wake.set()
+
+    def ensure_started(self):
+        if self._running():
+            return
+        # Two dispatchers in one process would double-send on SQLite, where SKIP LOCKED is a no-op
+        with self._start_lock:
+            if self._running():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.smtp.close()
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        smtp.send_message(msg)
+    def _run(self):
+        while not self._stop.is_set():
+            sent = 0
+            try:
+                with self.app.app_context():
+                    sent = self.dispatch_batch()
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+            if sent < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
 
 
-def generate_verification_code():
-    return str(uuid.uuid4())
\ No newline at end of file
+outbox = OutboxDispatcher()
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from flask import Response, abort, request
+from utils.compression import ENCODINGS, brotli, compress, compressible, negotiate
+
+logger = logging.getLogger(__name__)
+
+# Precompressed once at startup, so the slowest settings are affordable.
+STATIC_LEVELS = {"gzip": 9, "br": 11}
+
+# Assets are hashed (and their references rewritten) in this order: images before the styles and scripts that
+# mention them.
+TEXT_ORDER = (".css", ".js")
+
+
+class StaticFile:
+    __slots__ = ("name", "url", "mimetype", "body", "etag", "variants")
+
+    def __init__(self, name, url, mimetype, body):
+        self.name = name
+        self.url = url
+        self.mimetype = mimetype
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {}
+
+    def precompress(self):
+        if not compressible(self.mimetype):
+            return
+        for encoding in ENCODINGS:
+            if encoding == "br" and brotli is None:
+                continue
+            body = compress(self.body, encoding, STATIC_LEVELS[encoding])
+            if len(body) < len(self.body):
+                # Each encoding is its own representation, with its own ETag.
+                self.variants[encoding] = (body, f"{self.etag}-{encoding}")
+
+
+class FrontendAssets:
+    """
+    Serves frontend/ (FRONTEND_DIR) under FRONTEND_URL_PREFIX, by default /app. Every file is read once at
+    startup:
+    - scripts, styles and images are published under content-hashed names (/app/assets/script.3f2a1b9c0d.js) with
+      Cache-Control: public, max-age=STATIC_MAX_AGE, immutable; their references in the pages, styles and scripts
+      are rewritten to match, so a changed file gets a new URL and browsers never need to revalidate assets;
+    - pages keep their names (links and bookmarks point at them) and are revalidated on every load (no-cache plus
+      an ETag, so an unchanged page is a 304);
+    - text files are precompressed with gzip and, when the brotli package is installed, brotli at their
+      highest settings, and served in the best encoding the client accepts.
+    """
+
+    def __init__(self, app=None):
+        self.prefix = "/app"
+        self.max_age = 31536000
+        self.pages = {}
+        self.assets = {}
+        self.urls = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        directory = config.get("FRONTEND_DIR")
+        if not directory or not os.path.isdir(directory):
+            return
+        self.prefix = config.get("FRONTEND_URL_PREFIX", "/app").rstrip("/")
+        self.max_age = config.get("STATIC_MAX_AGE", 31536000)
+        self.load(directory)
+        app.add_url_rule(f"{self.prefix}/", "frontend_index", self.serve_page, defaults={"name": "index.html"})
+        app.add_url_rule(f"{self.prefix}/<name>", "frontend_page", self.serve_page)
+        app.add_url_rule(f"{self.prefix}/assets/<name>", "frontend_asset", self.serve_asset)
+        app.extensions["frontend_assets"] = self
+
+    def load(self, directory):
+        names = sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name)))
+        pages = [name for name in names if name.endswith(".html")]
+        assets = sorted(
+            (name for name in names if name not in pages),
+            key=lambda name: TEXT_ORDER.index(os.path.splitext(name)[1]) + 1 if name.endswith(TEXT_ORDER) else 0,
+        )
+        self.pages, self.assets, self.urls = {}, {}, {}
+        for name in assets + pages:
+            with open(os.path.join(directory, name), "rb") as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if compressible(mimetype):
+                body = self.rewrite(body)
+            if name in pages:
+                item = self.pages[name] = StaticFile(name, f"{self.prefix}/{name}", mimetype, body)
+            else:
+                stem, extension = os.path.splitext(name)
+                digest = hashlib.sha256(body).hexdigest()[:10]
+                hashed = f"{stem}.{digest}{extension}"
+                item = self.assets[hashed] = StaticFile(hashed, f"{self.prefix}/assets/{hashed}", mimetype, body)
+                self.urls[name] = item.url
+            item.precompress()
+        logger.info("Serving %d frontend pages and %d hashed assets under %s/", len(self.pages), len(self.assets), self.prefix)
+
+    def rewrite(self, body):
+        """Points quoted or url()-wrapped references to already hashed assets at their hashed URLs."""
+        text = body.decode("utf-8")
+        for name, url in self.urls.items():
+            text = re.sub(rf"""(["'(])(?:\./)?{re.escape(name)}(["')])""", rf"\g<1>{url}\g<2>", text)
+        return text.encode("utf-8")
+
+    def serve_page(self, name):
+        page = self.pages.get(name)
+        if page is None:
+            abort(404)
+        response = self.respond(page)
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def serve_asset(self, name):
+        asset = self.assets.get(name)
+        if asset is None:
+            abort(404)
+        response = self.respond(asset)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+
+    def respond(self, item):
+        encoding = negotiate(request.accept_encodings, [e for e in ENCODINGS if e in item.variants])
+        body, etag = item.variants[encoding] if encoding else (item.body, item.etag)
+        response = Response(body, mimetype=item.mimetype)
+        response.set_etag(etag)
+        if item.variants:
+            response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+
+frontend_assets = FrontendAssets()
@@ -0,0 +1,233 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from utils.metrics import metrics
+
+try:
+    import argon2
+except ImportError:  # only needed for HASH_SCHEME=argon2id
+    argon2 = None
+
+logger = logging.getLogger(__name__)
+
+
+class HashingPoolBusy(Exception):
+    """Raised when the hashing pool already holds as many jobs as it is allowed to queue."""
+
+    def __init__(self, retry_after):
+        super().__init__("Hashing pool is saturated")
+        self.retry_after = retry_after
+
+
+BCRYPT_COST = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+ARGON2_PARAMS = re.compile(r"^\$argon2id\$v=\d+\$m=(\d+),t=(\d+),p=(\d+)\$")
+
+
+def _hash_password(password: bytes, params=("bcrypt", 12)) -> bytes:
+    if params[0] == "argon2id":
+        _, time_cost, memory_cost, parallelism = params
+        hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        return hasher.hash(password).encode()
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=params[1]))
+
+
+def _check_password(password: bytes, hashed: bytes) -> bool:
+    if hashed.startswith(b"$argon2"):
+        if argon2 is None:
+            raise RuntimeError("argon2id password hashes require the argon2-cffi package")
+        try:
+            return argon2.PasswordHasher().verify(hashed, password)
+        except argon2.exceptions.VerificationError:
+            return False
+    return bcrypt.checkpw(password, hashed)
+
+
+class HashPolicy:
+    """
+    Which algorithm and cost new password hashes use. Both formats record their parameters in the
+    hash itself ($2b$<rounds>$... / $argon2id$v=19$m=..,t=..,p=..$...), so needs_rehash() can tell
+    whether a stored hash was made under an older policy.
+    With `upgrade_only`, only hashes weaker than the policy are reported; calibrated costs can differ
+    slightly between workers, and this keeps them from rewriting each other's hashes back and forth.
+    """
+
+    def __init__(self, scheme="bcrypt", bcrypt_rounds=12, time_cost=3, memory_cost=65536, parallelism=4,
+                 upgrade_only=False):
+        if scheme not in ("bcrypt", "argon2id"):
+            raise ValueError(f"Unknown HASH_SCHEME {scheme!r}, expected 'bcrypt' or 'argon2id'")
+        if scheme == "argon2id" and argon2 is None:
+            raise RuntimeError("HASH_SCHEME=argon2id requires the argon2-cffi package")
+        self.scheme = scheme
+        self.bcrypt_rounds = bcrypt_rounds
+        self.time_cost = time_cost
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+        self.upgrade_only = upgrade_only
+
+    @property
+    def params(self):
+        """Picklable form handed to the worker processes."""
+        if self.scheme == "argon2id":
+            return ("argon2id", self.time_cost, self.memory_cost, self.parallelism)
+        return ("bcrypt", self.bcrypt_rounds)
+
+    def describe(self):
+        if self.scheme == "argon2id":
+            return {"scheme": "argon2id", "time_cost": self.time_cost, "memory_cost": self.memory_cost,
+                    "parallelism": self.parallelism}
+        return {"scheme": "bcrypt", "rounds": self.bcrypt_rounds}
+
+    def needs_rehash(self, hashed: str) -> bool:
+        if self.scheme == "bcrypt":
+            match = BCRYPT_COST.match(hashed)
+            if match is None:
+                return True
+            rounds = int(match.group(1))
+            return rounds < self.bcrypt_rounds if self.upgrade_only else rounds != self.bcrypt_rounds
+
+        match = ARGON2_PARAMS.match(hashed)
+        if match is None:
+            return True
+        memory_cost, time_cost, parallelism = (int(value) for value in match.groups())
+        if self.upgrade_only:
+            return memory_cost < self.memory_cost or time_cost < self.time_cost
+        return (memory_cost, time_cost, parallelism) != (self.memory_cost, self.time_cost, self.parallelism)
+
+    def calibrate(self, target_ms, min_bcrypt_rounds=10, max_bcrypt_rounds=16):
+        """
+        Raises the cost until one hash takes about `target_ms` on this machine: the highest bcrypt
+        rounds (each round doubles the work) or argon2 time_cost (at the configured memory) under
+        the target, never below the minimum. Returns the measured milliseconds of the chosen setting.
+        """
+        self.upgrade_only = True
+        if self.scheme == "bcrypt":
+            self.bcrypt_rounds = min_bcrypt_rounds
+            elapsed = _time_hash(self.params)
+            while self.bcrypt_rounds < max_bcrypt_rounds and elapsed * 2 <= target_ms:
+                self.bcrypt_rounds += 1
+                elapsed *= 2
+            return elapsed
+
+        self.time_cost = 1
+        elapsed = _time_hash(self.params)
+        while self.time_cost < 20:
+            self.time_cost += 1
+            candidate = _time_hash(self.params)
+            if candidate > target_ms:
+                self.time_cost -= 1
+                break
+            elapsed = candidate
+        return elapsed
+
+
+def _time_hash(params):
+    start = time.perf_counter()
+    _hash_password(b"calibration-password", params)
+    return (time.perf_counter() - start) * 1000
+
+
+def hash_passwords(passwords, executor=None, policy=None, chunksize=8):
+    """
+    Hashes a batch of passwords (bulk imports), spread over `executor`'s processes when given.
+    Bulk callers bring their own executor so a large import doesn't queue ahead of interactive
+    logins in HashingPool.
+    """
+    params = (policy or HashPolicy()).params
+    encoded = [password.encode() for password in passwords]
+    if executor is None:
+        return [_hash_password(password, params).decode() for password in encoded]
+    hashed = executor.map(_hash_password, encoded, [params] * len(encoded), chunksize=chunksize)
+    return [value.decode() for value in hashed]
+
+
+class HashingPool:
+    """
+    Runs password hashing/verification in a dedicated process pool so a burst of logins
+    can't pin the Flask worker threads. New hashes follow `policy` (HASH_SCHEME and its cost
+    settings, or the cost calibrated to HASH_TARGET_MS at startup).
+    At most HASH_POOL_WORKERS jobs run at once and at most HASH_POOL_MAX_QUEUE more wait
+    for a free worker; anything beyond that, or a job not done within HASH_POOL_TIMEOUT seconds,
+    is rejected with HashingPoolBusy.
+    HASH_POOL_WORKERS = 0 hashes inline on the request thread (still bounded by the queue limit).
+    """
+
+    def __init__(self, app=None):
+        self.max_workers = 0
+        self.max_queue = 0
+        self.retry_after = 1
+        self.timeout = None
+        self.policy = HashPolicy()
+        self._slots = None
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_workers = app.config.get("HASH_POOL_WORKERS", os.cpu_count() or 1)
+        self.max_queue = app.config.get("HASH_POOL_MAX_QUEUE", 32)
+        self.retry_after = app.config.get("HASH_POOL_RETRY_AFTER", 1)
+        self.timeout = app.config.get("HASH_POOL_TIMEOUT") or None
+        self._slots = threading.BoundedSemaphore(max(self.max_workers, 1) + self.max_queue)
+        self.policy = HashPolicy(
+            scheme=app.config.get("HASH_SCHEME", "bcrypt"),
+            bcrypt_rounds=app.config.get("HASH_BCRYPT_ROUNDS", 12),
+            time_cost=app.config.get("HASH_ARGON2_TIME_COST", 3),
+            memory_cost=app.config.get("HASH_ARGON2_MEMORY_COST", 65536),
+            parallelism=app.config.get("HASH_ARGON2_PARALLELISM", 4),
+        )
+        target_ms = app.config.get("HASH_TARGET_MS")
+        if target_ms:
+            elapsed = self.policy.calibrate(target_ms, min_bcrypt_rounds=app.config.get("HASH_BCRYPT_MIN_ROUNDS", 10))
+            logger.info("Calibrated password hashing to %s (%.0f ms per hash)", self.policy.describe(), elapsed)
+        app.extensions["hashing"] = self
+
+    def hash_password(self, password: str) -> str:
+        with metrics.password_hashing.time(op="hash"):
+            return self._run(_hash_password, password.encode(), self.policy.params).decode()
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True if `hashed` was made with a different scheme or cost than the current policy (cheap, no hashing)."""
+        return self.policy.needs_rehash(hashed)
+
+    def check_password(self, password: str, hashed: str) -> bool:
+        with metrics.password_hashing.time(op="check"):
+            return self._run(_check_password, password.encode(), hashed.encode())
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self):
+        # Created lazily so every gunicorn worker gets its own pool after the fork.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolBusy(self.retry_after)
+        try:
+            if self.max_workers == 0:
+                return fn(*args)
+            try:
+                try:
+                    return self._get_executor().submit(fn, *args).result(self.timeout)
+                except BrokenProcessPool:
+                    # A worker died (OOM kill etc.); start a fresh pool and retry once.
+                    self.shutdown()
+                    return self._get_executor().submit(fn, *args).result(self.timeout)
+            except FutureTimeoutError:
+                raise HashingPoolBusy(self.retry_after)
+        finally:
+            self._slots.release()
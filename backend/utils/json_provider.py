@@ -0,0 +1,51 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # only needed for JSON_ENCODER=orjson ("auto" falls back to the standard library)
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with orjson doing the encoding: same keys order (sorted), same conversions (dates as
+    HTTP dates, UUIDs and Decimals as strings, via Flask's `default`), and responses built from bytes without a
+    str round trip. One visible difference: non-ASCII text (Hebrew names) is sent as UTF-8 instead of \\u escapes.
+    Anything orjson can't encode (integers beyond 64 bits, json.dumps-only options) goes through the parent.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {"indent", "separators", "sort_keys", "default"}:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj, kwargs.get("indent"), kwargs.get("sort_keys", self.sort_keys)).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = self._encode(obj, indent, self.sort_keys, orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def _encode(self, obj, indent, sort_keys, option=0):
+        option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            layout = {"indent": 2} if indent else {"separators": (",", ":")}
+            body = super().dumps(obj, sort_keys=sort_keys, **layout)
+            return (body + "\n" if option & orjson.OPT_APPEND_NEWLINE else body).encode()
+
+
+def json_provider(app):
+    """The provider for JSON_ENCODER: "orjson", "std" (Flask's json module) or "auto" (orjson when installed)."""
+    name = app.config.get("JSON_ENCODER", "auto")
+    if name == "std" or (name == "auto" and orjson is None):
+        return DefaultJSONProvider(app)
+    if name not in ("orjson", "auto"):
+        raise ValueError(f"Unknown JSON_ENCODER: {name}")
+    if orjson is None:
+        raise RuntimeError("JSON_ENCODER=orjson requires the orjson package")
+    return OrjsonProvider(app)
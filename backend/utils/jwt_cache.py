@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from datetime import timedelta
+import hashlib
+import threading
+import time
+import jwt as pyjwt
+from flask_jwt_extended import JWTManager
+from flask_jwt_extended.default_callbacks import default_decode_key_callback
+from utils.metrics import metrics
+
+
+def token_digest(encoded_token):
+    # Entries are keyed by a digest so the cache never holds usable bearer tokens.
+    return hashlib.sha256(encoded_token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """
+    Per-process LRU of access tokens whose signature and claims already verified, keyed by the token's
+    SHA-256, so a token presented again (the dashboard polls /profile with the same one) skips the
+    signature check and claim parsing. An entry is only used:
+    - until the token's exp (plus JWT_DECODE_LEEWAY), to the second, exactly when PyJWT would reject it;
+    - while the key that verified it is still the one the decode key callback returns, so a rotated
+      JWT_SECRET_KEY or a key dropped from the JWT key ring (utils/jwt_keys.py) ends it.
+    The blocklist check still runs on every request (it is what sees revocations made by other workers) and
+    discards the entry of a token it finds revoked or stale. JWT_VERIFY_CACHE_SIZE=0 disables the cache.
+    """
+
+    def __init__(self, app=None):
+        self.max_entries = 10000
+        self.leeway = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._by_jti = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.max_entries = config.get("JWT_VERIFY_CACHE_SIZE", 10000)
+        leeway = config.get("JWT_DECODE_LEEWAY", 0)
+        self.leeway = leeway.total_seconds() if isinstance(leeway, timedelta) else float(leeway)
+        self.clear()
+        app.extensions["jwt_verify_cache"] = self
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, encoded_token, key_for):
+        """The cached claims of `encoded_token`, or None; `key_for(header, claims)` is the decode key callback."""
+        digest = token_digest(encoded_token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+        if entry is None:
+            self._count("miss")
+            return None
+        header, claims, key, valid_until = entry
+        if time.time() >= valid_until:
+            self._remove(digest)
+            self._count("expired")
+            return None
+        try:
+            current_key = key_for(header, claims)
+        except pyjwt.InvalidTokenError:
+            current_key = None
+        if current_key != key:
+            self._remove(digest)
+            self._count("key_changed")
+            return None
+        self._count("hit")
+        # A copy: views get their own dict, as with a fresh decode.
+        return dict(claims)
+
+    def put(self, encoded_token, header, claims, key):
+        exp = claims.get("exp")
+        valid_until = exp + self.leeway if exp is not None else float("inf")
+        digest = token_digest(encoded_token)
+        with self._lock:
+            self._entries[digest] = (header, dict(claims), key, valid_until)
+            self._entries.move_to_end(digest)
+            if claims.get("jti") is not None:
+                self._by_jti[claims["jti"]] = digest
+            while len(self._entries) > self.max_entries:
+                _, (_, old, _, _) = self._entries.popitem(last=False)
+                self._by_jti.pop(old.get("jti"), None)
+
+    def discard(self, jti):
+        with self._lock:
+            digest = self._by_jti.pop(jti, None)
+            if digest is not None:
+                self._entries.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_jti.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, digest):
+        with self._lock:
+            entry = self._entries.pop(digest, None)
+            if entry is not None:
+                self._by_jti.pop(entry[1].get("jti"), None)
+
+    def _count(self, result):
+        # Expired and key_changed entries are misses too; the metric tells them apart.
+        if result == "hit":
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.jwt_verify_cache.inc(result=result)
+
+
+verified_tokens = VerifiedTokenCache()
+
+
+class CachingJWTManager(JWTManager):
+    """
+    JWTManager whose token decoding is answered from `verified_tokens` when it can be; full decodes are
+    timed in `metrics.jwt` (op="decode").
+    Flask-JWT-Extended has no public hook that can skip verification, so this overrides the private
+    _decode_jwt_from_config() that decode_token() and @jwt_required go through. requirements.txt pins the
+    library, and test_caching_jwt_manager_matches_flask_jwt_extended fails if an upgrade changes that method.
+    """
+
+    # The decode key callback, as set through the public decode_key_loader().
+    decode_key_for = staticmethod(default_decode_key_callback)
+
+    def decode_key_loader(self, callback):
+        self.decode_key_for = callback
+        return super().decode_key_loader(callback)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        # CSRF-checked (cookie) and allow_expired decodes always take the full path.
+        cacheable = verified_tokens.enabled and csrf_value is None and not allow_expired
+        if cacheable:
+            claims = verified_tokens.get(encoded_token, self.decode_key_for)
+            if claims is not None:
+                return claims
+        with metrics.jwt.time(op="decode"):
+            claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        if cacheable:
+            header = pyjwt.get_unverified_header(encoded_token)
+            verified_tokens.put(encoded_token, header, claims, self.decode_key_for(header, claims))
+        return claims
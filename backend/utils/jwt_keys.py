@@ -0,0 +1,252 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from flask import current_app, g
+import jwt
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+except ImportError:  # only needed for asymmetric JWT_ALGORITHM values
+    serialization = None
+
+logger = logging.getLogger(__name__)
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256", "EdDSA")
+KID_TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+
+# kid is "<activation time>-<random>", so the files themselves carry the rotation schedule.
+SigningKey = namedtuple("SigningKey", "kid activates_at private_key public_key")
+
+
+def generate_private_key(algorithm):
+    if algorithm == "RS256":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if algorithm == "ES256":
+        return ec.generate_private_key(ec.SECP256R1())
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported JWT_ALGORITHM for a key ring: {algorithm}")
+
+
+def key_matches_algorithm(private_key, algorithm):
+    expected = {"RS256": rsa.RSAPrivateKey, "ES256": ec.EllipticCurvePrivateKey, "EdDSA": ed25519.Ed25519PrivateKey}
+    return isinstance(private_key, expected[algorithm])
+
+
+def public_jwk(algorithm, public_key):
+    exporter = {"RS256": RSAAlgorithm, "ES256": ECAlgorithm, "EdDSA": OKPAlgorithm}[algorithm]
+    return exporter.to_jwk(public_key, as_dict=True)
+
+
+def parse_kid(kid):
+    return datetime.strptime(kid.split("-", 1)[0], KID_TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+class JWTKeyRing:
+    """
+    Asymmetric signing keys for access tokens (JWT_ALGORITHM = RS256, ES256 or EdDSA; HS256 keeps using
+    JWT_SECRET_KEY and bypasses all of this). Private keys are PEM files in JWT_KEYS_DIR named "<kid>.pem".
+    The kid starts with the key's activation time:
+    - tokens are signed with the newest key that is already active;
+    - every key, including ones not yet active, is published at /.well-known/jwks.json;
+    - a new key is therefore visible to verifiers for JWT_KEY_PUBLISH_AHEAD seconds before it signs anything.
+    `flask rotate-jwt-keys` (cron) adds a key once the current one is JWT_KEY_ROTATION_DAYS old. It deletes
+    keys that stopped signing long enough ago that no unexpired token or cached JWKS can still refer to them.
+    Each worker rereads the directory when it changes (checked every JWT_KEYS_RELOAD_INTERVAL seconds).
+    """
+
+    def __init__(self, app=None):
+        self.algorithm = "HS256"
+        self.keys_dir = None
+        self.rotation_interval = 30 * 86400.0
+        self.publish_ahead = 3600.0
+        self.retention = 3600.0
+        self.reload_interval = 60.0
+        self.jwks_max_age = 300
+        self._keys = []
+        self._jwks = None
+        self._dir_mtime = None
+        self._next_reload = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.configure(
+            config.get("JWT_ALGORITHM", "HS256"),
+            keys_dir=config.get("JWT_KEYS_DIR"),
+            rotation_days=config.get("JWT_KEY_ROTATION_DAYS", 30),
+            publish_ahead=config.get("JWT_KEY_PUBLISH_AHEAD", 3600.0),
+            reload_interval=config.get("JWT_KEYS_RELOAD_INTERVAL", 60.0),
+            jwks_max_age=config.get("JWKS_MAX_AGE", 300),
+            token_lifetime=config.get("JWT_ACCESS_TOKEN_EXPIRES", timedelta(minutes=15)),
+        )
+        app.extensions["jwt_keys"] = self
+
+    def configure(self, algorithm, keys_dir=None, rotation_days=30, publish_ahead=3600.0, reload_interval=60.0,
+                  jwks_max_age=300, token_lifetime=timedelta(minutes=15)):
+        self.algorithm = algorithm
+        self.keys_dir = keys_dir
+        self.rotation_interval = rotation_days * 86400.0
+        self.publish_ahead = publish_ahead
+        self.reload_interval = reload_interval
+        self.jwks_max_age = jwks_max_age
+        # A retired key stays published while tokens it signed may be alive and verifiers may hold an old JWKS.
+        self.retention = token_lifetime.total_seconds() + jwks_max_age
+        with self._lock:
+            self._keys, self._jwks, self._dir_mtime, self._next_reload = [], None, None, 0.0
+        if not self.asymmetric:
+            return
+        if serialization is None:
+            raise RuntimeError(f"JWT_ALGORITHM={algorithm} requires the cryptography package")
+        if not keys_dir:
+            raise RuntimeError(f"JWT_ALGORITHM={algorithm} requires JWT_KEYS_DIR")
+        os.makedirs(keys_dir, mode=0o700, exist_ok=True)
+        self.reload(force=True)
+        if not self._keys:
+            # First start: create a key that signs right away (nothing can have cached an older JWKS).
+            self.add_key(activates_at=time.time())
+
+    @property
+    def asymmetric(self):
+        return self.algorithm in ASYMMETRIC_ALGORITHMS
+
+    def signing_key(self):
+        """The newest key whose activation time has passed (falls back to the oldest key if none has yet)."""
+        keys = self._current_keys()
+        now = time.time()
+        active = [key for key in keys if key.activates_at <= now]
+        return active[-1] if active else keys[0]
+
+    def public_key(self, kid):
+        for key in self._current_keys():
+            if key.kid == kid:
+                return key.public_key
+        return None
+
+    def jwks(self):
+        """(body bytes, etag) for /.well-known/jwks.json; rebuilt only when the key set changes."""
+        self._current_keys()
+        return self._jwks
+
+    def add_key(self, activates_at=None):
+        """Writes a new private key that starts signing at `activates_at` (default: JWT_KEY_PUBLISH_AHEAD from now)."""
+        activates_at = time.time() + self.publish_ahead if activates_at is None else activates_at
+        stamp = datetime.fromtimestamp(activates_at, timezone.utc).strftime(KID_TIME_FORMAT)
+        kid = f"{stamp}-{secrets.token_hex(4)}"
+        pem = generate_private_key(self.algorithm).private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        path = os.path.join(self.keys_dir, f"{kid}.pem")
+        # Written under a temporary name and renamed, so a worker reloading meanwhile never reads half a key.
+        fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(pem)
+        os.replace(f"{path}.tmp", path)
+        self.reload(force=True)
+        logger.info("Added JWT signing key %s (active from %s)", kid, stamp)
+        return kid
+
+    def rotate(self, force=False):
+        """
+        Adds a key if the newest one is JWT_KEY_ROTATION_DAYS old (or `force`) and deletes keys that are no
+        longer needed. Returns {"added": kid or None, "removed": [kids]}.
+        """
+        now = time.time()
+        keys = self._current_keys()
+        added = None
+        if force or now - keys[-1].activates_at >= self.rotation_interval:
+            added = self.add_key()
+            keys = self._current_keys()
+
+        removed = []
+        signing = self.signing_key()
+        for older, newer in zip(keys, keys[1:]):
+            # `older` stopped signing when `newer` activated.
+            if older.activates_at < signing.activates_at and newer.activates_at + self.retention < now:
+                os.remove(os.path.join(self.keys_dir, f"{older.kid}.pem"))
+                removed.append(older.kid)
+        if removed:
+            self.reload(force=True)
+            logger.info("Removed retired JWT signing keys %s", removed)
+        return {"added": added, "removed": removed}
+
+    def reload(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now < self._next_reload:
+                return
+            self._next_reload = now + self.reload_interval
+            mtime = os.stat(self.keys_dir).st_mtime_ns
+            if not force and mtime == self._dir_mtime:
+                return
+            keys = []
+            for name in sorted(os.listdir(self.keys_dir)):
+                if not name.endswith(".pem"):
+                    continue
+                kid = name[:-4]
+                with open(os.path.join(self.keys_dir, name), "rb") as f:
+                    private_key = serialization.load_pem_private_key(f.read(), password=None)
+                if not key_matches_algorithm(private_key, self.algorithm):
+                    logger.warning("Ignoring JWT key %s: not a %s key", kid, self.algorithm)
+                    continue
+                try:
+                    activates_at = parse_kid(kid)
+                except ValueError:
+                    # A key dropped in by hand under another name counts from when the file appeared.
+                    activates_at = os.path.getmtime(os.path.join(self.keys_dir, name))
+                keys.append(SigningKey(kid, activates_at, private_key, private_key.public_key()))
+            keys.sort(key=lambda key: key.activates_at)
+            jwks = [
+                {**public_jwk(self.algorithm, key.public_key), "kid": key.kid, "alg": self.algorithm, "use": "sig"}
+                for key in keys
+            ]
+            body = json.dumps({"keys": jwks}, separators=(",", ":")).encode()
+            self._keys = keys
+            self._jwks = (body, hashlib.sha256(body).hexdigest()[:32])
+            self._dir_mtime = mtime
+
+    def _current_keys(self):
+        self.reload()
+        if not self._keys:
+            raise RuntimeError(f"No JWT signing keys in {self.keys_dir}")
+        return self._keys
+
+
+key_ring = JWTKeyRing()
+
+
+# Flask-JWT-Extended callbacks. The headers callback runs first in every encode and picks the key, so the
+# kid in the header and the key that signs always agree even if a rotation lands in between.
+
+def jwt_headers(identity):
+    if not key_ring.asymmetric:
+        return {}
+    key = g.jwt_signing_key = key_ring.signing_key()
+    return {"kid": key.kid}
+
+
+def jwt_encode_key(identity):
+    if not key_ring.asymmetric:
+        return current_app.config["JWT_SECRET_KEY"]
+    key = g.pop("jwt_signing_key", None) or key_ring.signing_key()
+    return key.private_key
+
+
+def jwt_decode_key(jwt_header, jwt_payload):
+    if not key_ring.asymmetric:
+        return current_app.config["JWT_SECRET_KEY"]
+    key = key_ring.public_key(jwt_header.get("kid"))
+    if key is None:
+        raise jwt.InvalidSignatureError(f"Unknown signing key {jwt_header.get('kid')!r}")
+    return key
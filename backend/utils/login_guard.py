@@ -0,0 +1,138 @@
+from collections import namedtuple
+import math
+import threading
+import time
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import LoginFailure
+from utils.metrics import metrics
+from utils.validators import normalize_email
+
+# retry_after: whole seconds until the caller may try again (0 = allowed).
+# account_failures: recent failures of the account, so a successful login only writes when there is something to clear.
+LoginStatus = namedtuple("LoginStatus", "retry_after account_failures")
+ALLOWED = LoginStatus(0, 0)
+
+
+def account_key(email):
+    return f"account:{normalize_email(email)}"
+
+
+def ip_key(ip):
+    return f"ip:{ip}"
+
+
+class LoginGuard:
+    """
+    Tracks failed logins per account and per client IP in the login_failures table, shared by all workers.
+    Once a key reaches its threshold (LOGIN_MAX_ACCOUNT_FAILURES / LOGIN_MAX_IP_FAILURES) it is locked for
+    LOGIN_LOCKOUT_BASE seconds, doubling with every further failure up to LOGIN_LOCKOUT_MAX. Failure counts
+    start over once a key has gone LOGIN_FAILURE_WINDOW seconds without failing and is not locked.
+    check() runs before the user lookup and password hashing, so a locked-out attacker costs no bcrypt work.
+    Each process also remembers the locks it has seen until they expire, which answers repeat attempts
+    against a locked key from memory without touching the database.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_account_failures = 5
+        self.max_ip_failures = 100
+        self.lockout_base = 30.0
+        self.lockout_max = 900.0
+        self.failure_window = 900.0
+        self.max_cached_locks = 10000
+        self._locks = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("LOGIN_LOCKOUT_ENABLED", True)
+        self.max_account_failures = app.config.get("LOGIN_MAX_ACCOUNT_FAILURES", 5)
+        self.max_ip_failures = app.config.get("LOGIN_MAX_IP_FAILURES", 100)
+        self.lockout_base = app.config.get("LOGIN_LOCKOUT_BASE", 30.0)
+        self.lockout_max = app.config.get("LOGIN_LOCKOUT_MAX", 900.0)
+        self.failure_window = app.config.get("LOGIN_FAILURE_WINDOW", 900.0)
+        self.clear_cache()
+        app.extensions["login_guard"] = self
+
+    def check(self, email, ip):
+        """Returns a LoginStatus; a non-zero retry_after means reject without checking the password."""
+        if not self.enabled:
+            return ALLOWED
+        now = time.time()
+        keys = (account_key(email), ip_key(ip))
+        locked_until = max(self._locks.get(key, 0.0) for key in keys)
+        if locked_until > now:
+            metrics.login_lockouts.inc(source="memory")
+            return LoginStatus(math.ceil(locked_until - now), None)
+
+        account_failures = 0
+        for row in db.session.execute(select(LoginFailure).where(LoginFailure.key.in_(keys))).scalars():
+            if row.key == keys[0]:
+                account_failures = row.failures
+            if row.locked_until is not None and row.locked_until > now:
+                self._remember_lock(row.key, row.locked_until, now)
+                locked_until = max(locked_until, row.locked_until)
+        if locked_until > now:
+            metrics.login_lockouts.inc(source="database")
+            return LoginStatus(math.ceil(locked_until - now), account_failures)
+        return LoginStatus(0, account_failures)
+
+    def record_failure(self, email, ip, account=True):
+        """
+        Counts a failed attempt against the IP and, with `account`, the account (unknown emails only count
+        against the IP so probing random addresses doesn't grow the table per address). The caller commits.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        self._bump(ip_key(ip), self.max_ip_failures, now)
+        if account:
+            self._bump(account_key(email), self.max_account_failures, now)
+
+    def record_success(self, email, status):
+        """Clears the account's failure count after a good password. The caller commits."""
+        if not self.enabled or not status.account_failures:
+            return
+        key = account_key(email)
+        db.session.execute(LoginFailure.__table__.delete().where(LoginFailure.key == key))
+        with self._lock:
+            self._locks.pop(key, None)
+
+    def clear_cache(self):
+        with self._lock:
+            self._locks.clear()
+
+    def _bump(self, key, threshold, now):
+        row = db.session.get(LoginFailure, key, with_for_update=True)
+        if row is None:
+            try:
+                # Savepoint: a concurrent first failure for the same key must not undo the caller's transaction.
+                with db.session.begin_nested():
+                    row = LoginFailure(key=key, failures=0, last_failure_at=now)
+                    db.session.add(row)
+            except IntegrityError:
+                row = db.session.get(LoginFailure, key, with_for_update=True, populate_existing=True)
+        locked = row.locked_until is not None and row.locked_until > now
+        if not locked and now - row.last_failure_at > self.failure_window:
+            row.failures = 0
+        row.failures += 1
+        row.last_failure_at = now
+        if row.failures >= threshold:
+            # 2**20 doublings are far past any sane LOGIN_LOCKOUT_MAX; the cap keeps the float finite.
+            duration = min(self.lockout_base * 2 ** min(row.failures - threshold, 20), self.lockout_max)
+            row.locked_until = now + duration
+            self._remember_lock(key, row.locked_until, now)
+
+    def _remember_lock(self, key, locked_until, now):
+        with self._lock:
+            if len(self._locks) >= self.max_cached_locks:
+                self._locks = {k: until for k, until in self._locks.items() if until > now}
+                if len(self._locks) >= self.max_cached_locks:
+                    return
+            self._locks[key] = locked_until
+
+
+login_guard = LoginGuard()
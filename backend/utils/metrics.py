@@ -0,0 +1,254 @@
+from bisect import bisect_left
+from collections import defaultdict
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Seconds. Finer at the low end than Prometheus' defaults: most queries and JWT operations are sub-millisecond.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0.0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}_total", tuple(zip(self.labelnames, key)), value
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (last one is +Inf, not cumulative), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        """`with histogram.time(op="hash"): ...` observes the block's wall time in seconds."""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        state = self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (("le", _format_value(bound)),), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """Per-process metric families rendered in the Prometheus text format (version 0.0.4)."""
+
+    def __init__(self):
+        self.enabled = True
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(self, name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Metrics:
+    """
+    Instrumentation behind GET /metrics: request latency per blueprint endpoint plus timers for
+    password hashing, SQL statements (SQLAlchemy cursor events), SMTP sends and JWT encode/decode,
+    and counters for rate-limit rejections, login lockouts, revocation checks, JWT verify cache lookups,
+    replica routing and dropped log records. Values live in this process only, so with several workers
+    each scrape sees the worker that answered it; scrape workers individually (or label them by instance)
+    when that matters. METRICS_ENABLED=false turns every hook into a no-op.
+    """
+
+    def __init__(self, app=None):
+        self.registry = MetricsRegistry()
+        registry = self.registry
+        self.http_requests = registry.histogram(
+            "http_request_duration_seconds", "Request latency by endpoint.", ("method", "endpoint", "status")
+        )
+        self.password_hashing = registry.histogram(
+            "password_hash_seconds", "Password hash/check time, including the wait for a hashing worker.", ("op",)
+        )
+        self.db_queries = registry.histogram("db_query_seconds", "SQL statement execution time.", ("statement",))
+        self.smtp_sends = registry.histogram(
+            "smtp_send_seconds", "Time to hand one email to the SMTP server (failed sends included)."
+        )
+        self.jwt = registry.histogram("jwt_seconds", "JWT encode/decode time.", ("op",))
+        self.rate_limit_rejections = registry.counter(
+            "rate_limit_rejections", "Requests rejected by a rate limit.", ("endpoint", "limit")
+        )
+        self.login_lockouts = registry.counter(
+            "login_lockout_rejections", "Logins rejected by the lockout tracker before any hashing.", ("source",)
+        )
+        self.revocation_checks = registry.counter(
+            "revocation_checks", "JWT revocation checks by how they were answered.", ("result",)
+        )
+        self.replica_routing = registry.counter(
+            "db_replica_routing", "Reads of replica-enabled requests by where they ran.", ("target",)
+        )
+        self.jwt_verify_cache = registry.counter(
+            "jwt_verify_cache", "Access token decodes by whether the verified-token cache answered.", ("result",)
+        )
+        self.log_records_dropped = registry.counter(
+            "log_records_dropped", "Log records dropped because the logging queue was full."
+        )
+        self._sql_events_installed = False
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def enabled(self):
+        return self.registry.enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self.registry.enabled = value
+
+    def init_app(self, app):
+        self.enabled = app.config.get("METRICS_ENABLED", True)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        if not self._sql_events_installed:
+            # Class-level listeners cover every engine, including the rate limiter's own.
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            event.listen(Engine, "handle_error", self._handle_sql_error)
+            self._sql_events_installed = True
+        app.extensions["metrics"] = self
+
+    def render(self):
+        return self.registry.render()
+
+    def _start_request(self):
+        if self.enabled:
+            g._metrics_start = time.perf_counter()
+
+    def _finish_request(self, response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            self.http_requests.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                # The endpoint, not the path, so ids in URLs can't blow up the label set.
+                endpoint=request.endpoint or "unmatched",
+                status=response.status_code,
+            )
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.enabled:
+            conn.info.setdefault("_metrics_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_metrics_query_start")
+        if starts:
+            verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+            verb = verb if verb in SQL_STATEMENTS else "OTHER"
+            self.db_queries.observe(time.perf_counter() - starts.pop(), statement=verb)
+
+    def _handle_sql_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its start time.
+        connection = exception_context.connection
+        starts = connection.info.get("_metrics_query_start") if connection is not None else None
+        if starts:
+            starts.pop()
+
+    def rate_limit_breached(self, request_limit):
+        """Flask-Limiter on_breach callback; returning None keeps the default 429 response."""
+        self.rate_limit_rejections.inc(endpoint=request.endpoint or "unmatched", limit=str(request_limit.limit))
+        return None
+
+
+metrics = Metrics()
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+import json
+import logging
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # only needed for PROFILE_CACHE_INVALIDATION_URL
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "profile-cache-invalidations"
+
+
+class ProfileCache:
+    """
+    Bounded LRU + TTL cache of serialized /profile payloads keyed by user id.
+    Writers call invalidate() after committing. A load that overlaps any invalidation is
+    returned but not cached, so a reader that fetched the row before a write can't put the
+    old payload back afterwards. Other workers learn about invalidations through the optional
+    Redis channel (PROFILE_CACHE_INVALIDATION_URL). Without it, a worker can't know that another one
+    committed a write, so a hit is only served if the caller's `is_current` check accepts it; /profile
+    compares the cached version with the one in the client's access token, which PUT/PATCH re-issue,
+    so the writer never reads its old profile back and a hit still costs no database access.
+    """
+
+    def __init__(self, app=None):
+        self.max_entries = 10000
+        self.ttl = 30.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._redis = None
+        self._listener = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get("PROFILE_CACHE_MAX_ENTRIES", 10000)
+        self.ttl = app.config.get("PROFILE_CACHE_TTL", 30.0)
+        url = app.config.get("PROFILE_CACHE_INVALIDATION_URL")
+        if url:
+            if redis is None:
+                raise RuntimeError("PROFILE_CACHE_INVALIDATION_URL requires the redis package")
+            self._redis = redis.Redis.from_url(url)
+            app.before_request(self._ensure_listener)
+        app.extensions["profile_cache"] = self
+
+    def get_or_load(self, user_id, loader, is_current=None):
+        """
+        Returns the cached payload for `user_id`, calling `loader(user_id)` on a miss. None results are not cached.
+        A cached payload is only returned if `is_current(payload)` is true; the check must not touch the database.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            epoch = self._epoch
+        if entry is not None and entry[0] > now:
+            if is_current is None or is_current(entry[1]):
+                with self._lock:
+                    if user_id in self._entries:
+                        self._entries.move_to_end(user_id)
+                    self.hits += 1
+                return entry[1]
+        with self._lock:
+            self.misses += 1
+
+        payload = loader(user_id)
+        if payload is None:
+            return None
+
+        with self._lock:
+            if self._epoch == epoch:
+                self._entries[user_id] = (now + self.ttl, payload)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return payload
+
+    def invalidate(self, user_id, broadcast=True):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._epoch += 1
+            self.invalidations += 1
+        if broadcast and self._redis is not None:
+            try:
+                self._redis.publish(INVALIDATION_CHANNEL, json.dumps({"user_id": user_id}))
+            except redis.RedisError:
+                logger.exception("Failed to broadcast profile cache invalidation")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+    def _ensure_listener(self):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        self._listener = threading.Thread(target=self._listen, name="profile-cache-listener", daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(INVALIDATION_CHANNEL)
+        for message in pubsub.listen():
+            try:
+                self.invalidate(json.loads(message["data"])["user_id"], broadcast=False)
+            except (ValueError, KeyError):
+                logger.warning("Ignoring malformed profile cache invalidation: %r", message)
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,70 @@
+from collections import namedtuple
+from types import SimpleNamespace
+from sqlalchemy import select, update
+from extensions import db
+from models import User
+from utils.sharding import user_shards
+
+PROFILE_FIELDS = ("full_name", "phone_number", "address")
+
+# Everything /profile and a refreshed access token need; the password hash is never read here.
+PROFILE_COLUMNS = (
+    User.id, User.email, User.full_name, User.phone_number, User.address, User.version, User.token_generation,
+)
+
+# status: "updated", "unchanged" or "conflict" (the row's version moved past the expected one).
+# user: the profile after the change (attributes as on User, enough for issue_access_token()).
+ProfileUpdate = namedtuple("ProfileUpdate", "status user changed")
+
+
+def profile_etag(version):
+    return f"v{version}"
+
+
+def etag_versions(etags):
+    """
+    The versions named by an If-Match header (werkzeug ETags), or None for "*" / no header. ETags of compressed
+    responses carry the encoding after the version ("v7-gzip", see utils/compression.py) and name the same version.
+    """
+    if not etags or etags.star_tag:
+        return None
+    versions = set()
+    for tag in etags.as_set():
+        version = tag.split("-", 1)[0]
+        if version.startswith("v") and version[1:].isdigit():
+            versions.add(int(version[1:]))
+    return versions
+
+
+def load_profile_row(user_id):
+    user_shards.use_user(user_id)
+    return db.session.execute(select(*PROFILE_COLUMNS).where(User.id == user_id)).one_or_none()
+
+
+def apply_profile_changes(row, fields, expected_version=None):
+    """
+    Writes the fields of `fields` that differ from `row` in a single UPDATE of just those columns and bumps
+    users.version; nothing is written if no field differs. With `expected_version` the UPDATE only applies
+    while the row is still at that version (If-Match), so a concurrent change yields "conflict" instead of
+    being overwritten. The caller commits and invalidates the profile cache.
+    """
+    if expected_version is not None and row.version != expected_version:
+        return ProfileUpdate("conflict", row, {})
+    changed = {field: value for field, value in fields.items() if getattr(row, field) != value}
+    if not changed:
+        return ProfileUpdate("unchanged", row, {})
+
+    statement = update(User).where(User.id == row.id)
+    if expected_version is not None:
+        statement = statement.where(User.version == expected_version)
+    result = db.session.execute(
+        statement.values(**changed, version=User.version + 1).execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        return ProfileUpdate("conflict", row, {})
+    # Without If-Match another writer may have bumped the version in between; the precise value costs a read.
+    version = expected_version + 1 if expected_version is not None else None
+    user = SimpleNamespace(**{**row._asdict(), **changed, "version": version})
+    if version is None:
+        user.version = db.session.execute(select(User.version).where(User.id == row.id)).scalar_one()
+    return ProfileUpdate("updated", user, changed)
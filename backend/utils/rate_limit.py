@@ -0,0 +1,251 @@
+from math import floor
+import importlib
+import threading
+import time
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport, TimestampedSlidingWindow
+from sqlalchemy import case, create_engine, delete, inspect, select, text, update
+from sqlalchemy.exc import SQLAlchemyError
+from models import RateLimitCounter
+
+
+class _LocalWindow:
+    __slots__ = ("tokens", "blocked", "until", "window_end", "previous_count")
+
+    def __init__(self, tokens, blocked, until, window_end, previous_count):
+        self.tokens = tokens
+        self.blocked = blocked
+        self.until = until
+        self.window_end = window_end
+        # The previous window's count can't change any more: known for the rest of this window.
+        self.previous_count = previous_count
+
+
+class SQLRateLimitStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """
+    Flask-Limiter storage (RATELIMIT_STORAGE_URI = "sql://") that keeps sliding-window counters in
+    the rate_limit_counters table, so every worker enforces one global limit.
+
+    Each process keeps a small local fast path in front of the table:
+    - an allowed hit leases `lease_fraction` of the limit from the shared counter in one round trip,
+      and later hits in the same window spend the lease without touching the database. Leases are
+      counted globally when taken, so the fast path can only make the limit stricter, never looser
+      (with a limit of 3 the lease is a single hit, i.e. no leasing).
+    - the previous window's count is read once per window and remembered; after that a hit that has
+      to go to the table is a single UPSERT (plus a decrement if it turned out to be over the limit).
+    - a key with no slot left, whether it was just rejected or just took the last slot, is refused
+      locally for the time one slot takes to free up (expiry / limit) before the shared counter is
+      asked again, so callers that are clearly over the limit cost no round trips.
+
+    Expired counters are deleted by the sweeper (utils/verification.py), not on the request path.
+
+    The table belongs to the Alembic-managed schema. Only with create_table (RATELIMIT_CREATE_TABLE, for a
+    separate RATELIMIT_DATABASE_URI that no migration touches) does the storage create it on first use.
+    """
+
+    STORAGE_SCHEME = ["sql"]
+
+    def __init__(
+        self, uri=None, wrap_exceptions=False, url=None, lease_fraction=0.1, create_table=False, **options
+    ):
+        if not url:
+            raise ValueError("sql:// rate limit storage needs a database url in RATELIMIT_STORAGE_OPTIONS")
+        self.engine = create_engine(url)
+        self.table = RateLimitCounter.__table__
+        self.lease_fraction = lease_fraction
+        self.local_hits = 0
+        self.remote_hits = 0
+        self._local = {}
+        self._local_lock = threading.Lock()
+        self._table_ready = not create_table
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return SQLAlchemyError
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            try:
+                self.table.create(self.engine, checkfirst=True)
+            except SQLAlchemyError:
+                # Another worker created it between the check and the CREATE.
+                if not inspect(self.engine).has_table(self.table.name):
+                    raise
+            self._table_ready = True
+
+    def _upsert(self, conn, key, expiry, amount, now):
+        expired = self.table.c.expires_at <= now
+        values = {
+            "count": case((expired, amount), else_=self.table.c.count + amount),
+            "expires_at": case((expired, now + expiry), else_=self.table.c.expires_at),
+        }
+        dialect = self.engine.dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            # Imported here rather than at module top: the dialect modules are slow to import and a
+            # worker only ever needs its own.
+            insert = importlib.import_module(f"sqlalchemy.dialects.{dialect}").insert
+            stmt = (
+                insert(self.table)
+                .values(key=key, count=amount, expires_at=now + expiry)
+                .on_conflict_do_update(index_elements=[self.table.c.key], set_=values)
+                .returning(self.table.c.count)
+            )
+            return conn.execute(stmt).scalar_one()
+        # Portable fallback: update first, insert if the key is new.
+        if conn.execute(update(self.table).where(self.table.c.key == key).values(**values)).rowcount == 0:
+            conn.execute(self.table.insert().values(key=key, count=amount, expires_at=now + expiry))
+            return amount
+        return conn.execute(select(self.table.c.count).where(self.table.c.key == key)).scalar_one()
+
+    def incr(self, key, expiry, amount=1):
+        self._ensure_table()
+        now = time.time()
+        with self.engine.begin() as conn:
+            return self._upsert(conn, key, expiry, amount, now)
+
+    def decr(self, key, amount=1):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(self.table)
+                .where(self.table.c.key == key)
+                .values(count=case((self.table.c.count > amount, self.table.c.count - amount), else_=0))
+            )
+
+    def _counts(self, keys, now):
+        self._ensure_table()
+        query = select(self.table.c.key, self.table.c.count).where(
+            self.table.c.key.in_(keys), self.table.c.expires_at > now
+        )
+        with self.engine.connect() as conn:
+            return dict(conn.execute(query).all())
+
+    def get(self, key):
+        return self._counts([key], time.time()).get(key, 0)
+
+    def get_expiry(self, key):
+        self._ensure_table()
+        now = time.time()
+        with self.engine.connect() as conn:
+            expires_at = conn.execute(
+                select(self.table.c.expires_at).where(self.table.c.key == key, self.table.c.expires_at > now)
+            ).scalar()
+        return expires_at or now
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True
+        except SQLAlchemyError:
+            return False
+
+    def reset(self):
+        self._ensure_table()
+        with self._local_lock:
+            self._local.clear()
+        with self.engine.begin() as conn:
+            return conn.execute(delete(self.table)).rowcount
+
+    def clear(self, key):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.key == key))
+
+    def purge_expired(self, batch_size=500, pause=0.0):
+        """Deletes expired counters `batch_size` rows per transaction, sleeping `pause` seconds in between."""
+        self._ensure_table()
+        removed = 0
+        expired = select(self.table.c.key).where(self.table.c.expires_at <= time.time()).limit(batch_size)
+        while True:
+            with self.engine.begin() as conn:
+                keys = conn.execute(expired).scalars().all()
+                if keys:
+                    conn.execute(delete(self.table).where(self.table.c.key.in_(keys)))
+            removed += len(keys)
+            if len(keys) < batch_size:
+                return removed
+            time.sleep(pause)
+
+    def _window_info(self, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        counts = self._counts([previous_key, current_key], now)
+        previous_count = counts.get(previous_key, 0)
+        current_count = counts.get(current_key, 0)
+        previous_ttl = self._previous_weight(expiry, now) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_key, current_key, previous_count, previous_ttl, current_count, current_ttl
+
+    def _previous_weight(self, expiry, now):
+        return 1 - (((now - expiry) / expiry) % 1)
+
+    def _acquire_remote(self, key, limit, expiry, amount, now, previous_count=None):
+        """
+        Takes `amount` hits from the shared counter. Returns (acquired, previous_count, used), `used` being the
+        weighted count of the window after the hit. With `previous_count` known the pre-check is skipped.
+        """
+        self.remote_hits += 1
+        current_key = self.sliding_window_keys(key, expiry, now)[1]
+        weight = self._previous_weight(expiry, now)
+        if previous_count is None:
+            _, current_key, previous_count, _, current_count, _ = self._window_info(key, expiry, now)
+            if floor(previous_count * weight + current_count) + amount > limit:
+                return False, previous_count, limit
+        current_count = self.incr(current_key, 2 * expiry, amount)
+        used = floor(previous_count * weight + current_count)
+        if used > limit:
+            # Over the limit: another worker won the race for the last slot(s), or the pre-check was skipped.
+            self.decr(current_key, amount)
+            return False, previous_count, limit
+        return True, previous_count, used
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        window_end = (int(now / expiry) + 1) * expiry
+        previous_count = None
+        with self._local_lock:
+            local = self._local.get(key)
+            if local is not None and local.until > now:
+                if local.blocked:
+                    self.local_hits += 1
+                    return False
+                if local.tokens >= amount:
+                    local.tokens -= amount
+                    self.local_hits += 1
+                    return True
+            if local is not None and local.window_end == window_end:
+                previous_count = local.previous_count
+
+        lease = max(amount, int(limit * self.lease_fraction))
+        blocked_until = min(now + expiry / limit, window_end)
+        for size in dict.fromkeys((lease, amount)):
+            acquired, previous_count, used = self._acquire_remote(key, limit, expiry, size, now, previous_count)
+            if acquired:
+                tokens = size - amount
+                # The last slot is gone: refuse locally instead of asking the table again.
+                blocked = used >= limit and tokens == 0
+                until = blocked_until if blocked else window_end
+                self._remember(key, _LocalWindow(tokens, blocked, until, window_end, previous_count), now)
+                return True
+        self._remember(key, _LocalWindow(0, True, blocked_until, window_end, previous_count), now)
+        return False
+
+    def _remember(self, key, window, now):
+        with self._local_lock:
+            if len(self._local) > 10000:
+                self._local = {k: v for k, v in self._local.items() if v.window_end > now}
+            self._local[key] = window
+
+    def get_sliding_window(self, key, expiry):
+        _, _, previous_count, previous_ttl, current_count, current_ttl = self._window_info(key, expiry, time.time())
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
+        with self._local_lock:
+            self._local.pop(key, None)
@@ -0,0 +1,83 @@
+from collections import namedtuple
+from datetime import datetime
+import logging
+import secrets
+import uuid
+from flask import current_app
+from extensions import db
+from models import RefreshToken
+from utils.sharding import tag_token, user_shards
+from utils.verification import hash_token
+
+logger = logging.getLogger(__name__)
+
+# family_id doubles as the session id (see utils/sessions.py)
+RotatedToken = namedtuple("RotatedToken", "user_id token family_id remember")
+
+
+def refresh_token_lifetime(remember):
+    key = "REFRESH_TOKEN_EXPIRES_REMEMBER" if remember else "REFRESH_TOKEN_EXPIRES"
+    return current_app.config[key]
+
+
+def issue_refresh_token(user_id, remember=False, family_id=None):
+    """Adds a new refresh token to the session (starting a new family unless one is given) and returns the raw token."""
+    token = tag_token(secrets.token_urlsafe(32), user_id)
+    db.session.add(
+        RefreshToken(
+            token_hash=hash_token(token),
+            user_id=user_id,
+            family_id=family_id or str(uuid.uuid4()),
+            remember=remember,
+            expires_at=datetime.utcnow() + refresh_token_lifetime(remember),
+        )
+    )
+    return token
+
+
+def rotate_refresh_token(token):
+    """
+    Spends `token` and adds its successor to the session. Returns a RotatedToken, or None if the
+    token is unknown, expired or revoked. Presenting a token that was already rotated means it leaked:
+    the whole family is revoked. The caller commits.
+    """
+    row = _find(token)
+    if row is None or row.revoked or row.expires_at <= datetime.utcnow():
+        return None
+
+    # Conditional update so two concurrent refreshes with the same token can't both win.
+    spent = (
+        RefreshToken.query.filter_by(token_hash=row.token_hash, used_at=None, revoked=False)
+        .update({"used_at": datetime.utcnow()}, synchronize_session=False)
+    )
+    if spent != 1:
+        logger.warning("Refresh token reuse detected for user %s; revoking family %s", row.user_id, row.family_id)
+        revoke_refresh_family(row.family_id)
+        return None
+
+    new_token = issue_refresh_token(row.user_id, row.remember, family_id=row.family_id)
+    return RotatedToken(row.user_id, new_token, row.family_id, row.remember)
+
+
+def _find(token):
+    """Selects the shard of the token's owner and loads the token row."""
+    token_hash = hash_token(token)
+    user_shards.use_token(token, lambda: db.session.get(RefreshToken, token_hash) is not None)
+    return db.session.get(RefreshToken, token_hash)
+
+
+def revoke_refresh_family(family_id):
+    RefreshToken.query.filter_by(family_id=family_id).update({"revoked": True}, synchronize_session=False)
+
+
+def revoke_refresh_token(token):
+    """Revokes the family of `token` (logout). Unknown tokens are ignored. The caller commits."""
+    row = _find(token)
+    if row is not None:
+        revoke_refresh_family(row.family_id)
+
+
+def revoke_user_refresh_tokens(user_id):
+    """Revokes every refresh token of the user (password reset). The caller commits."""
+    user_shards.use_user(user_id)
+    RefreshToken.query.filter_by(user_id=user_id).update({"revoked": True}, synchronize_session=False)
@@ -0,0 +1,195 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from flask import current_app
+import sqlalchemy as sa
+from utils.db_pool import engine_options
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind its primary. 0 on a primary (or a Postgres replica that has replayed
+# everything it received: the replay timestamp alone grows on an idle primary).
+POSTGRES_LAG = sa.text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def replication_lag(connection):
+    """The replica's lag in seconds, or None if replication is broken."""
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        lag = connection.execute(POSTGRES_LAG).scalar()
+        return float(lag) if lag is not None else None
+    if dialect in ("mysql", "mariadb"):
+        status = connection.execute(sa.text("SHOW REPLICA STATUS")).mappings().first()
+        if status is None:
+            return 0.0
+        lag = status.get("Seconds_Behind_Source")
+        return float(lag) if lag is not None else None
+    # SQLite and others have no replication to ask about; reachable counts as current.
+    connection.execute(sa.text("SELECT 1"))
+    return 0.0
+
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+
+
+class ReadReplicaRouter:
+    """
+    Read replicas of the user database(s): DB_REPLICAS for SQLALCHEMY_DATABASE_URI, USER_SHARD_REPLICAS for
+    each of USER_SHARDS. Views opt in with allow(); from then on read-only statements on the user tables
+    (see utils/sharding.py) run on a healthy replica until the request writes anything, after which it
+    reads its own writes from the primary. Everything else (writes, locking reads, the lockout, rate-limit
+    and revocation tables) always uses the primary.
+    - Reading one's own writes is up to the caller and needs no server-side state, so it holds across workers:
+      or_primary() retries on the primary when the replica's row is older than what the client has already
+      seen (e.g. the profile version in its access token, or a login whose user isn't verified there yet).
+    - A background thread checks every replica each REPLICA_HEALTH_INTERVAL seconds; a replica that is
+      unreachable or more than REPLICA_MAX_LAG seconds behind is skipped until it catches up, and with no
+      healthy replica reads fall back to the primary.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.groups = {}
+        self.max_lag = 2.0
+        self.health_interval = 2.0
+        self._round_robin = itertools.count()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.app = app
+        self.max_lag = config.get("REPLICA_MAX_LAG", 2.0)
+        self.health_interval = config.get("REPLICA_HEALTH_INTERVAL", 2.0)
+        self.configure(
+            default=config.get("DB_REPLICAS", []),
+            shards=config.get("USER_SHARD_REPLICAS", []),
+            pool_size=config.get("USER_SHARD_POOL_SIZE", 5),
+            max_overflow=config.get("USER_SHARD_MAX_OVERFLOW", 10),
+        )
+        app.extensions["read_replicas"] = self
+        app.before_request(self.ensure_started)
+
+    def configure(self, default=(), shards=(), **pool):
+        """`default`: replica URLs of the default database; `shards`: one list of replica URLs per user shard."""
+        old = [replica for replicas in self.groups.values() for replica in replicas]
+        groups = {"default": list(default)}
+        groups.update({index: list(urls) for index, urls in enumerate(shards)})
+        # Replicas start out unhealthy: nothing connects before the first health check.
+        self.groups = {
+            group: [Replica(sa.create_engine(url, **engine_options(url, **pool))) for url in urls]
+            for group, urls in groups.items()
+            if urls
+        }
+        for replica in old:
+            replica.engine.dispose()
+
+    @property
+    def configured(self):
+        return bool(self.groups)
+
+    def allow(self):
+        """Lets this request read the user tables from a replica."""
+        if self.configured:
+            _session().info["replica_reads"] = True
+
+    def use_primary(self):
+        """Sends the rest of the request's reads to the primary; rows already read from a replica are reloaded."""
+        session = _session()
+        if session.info.get("replica_reads"):
+            session.info["replica_reads"] = False
+            session.expire_all()
+
+    def reading_replica(self):
+        return bool(_session().info.get("replica_reads"))
+
+    def or_primary(self, load, found=lambda result: result is not None):
+        """
+        Runs `load()`; if the result doesn't satisfy `found` and came from a replica (e.g. a row too new to have
+        arrived), runs it again on the primary.
+        """
+        result = load()
+        if not found(result) and self.reading_replica():
+            self.use_primary()
+            result = load()
+        return result
+
+    def pick(self, group):
+        """A healthy replica engine of `group` ("default" or a shard index), or None to use the primary."""
+        healthy = [replica for replica in self.groups.get(group, ()) if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._round_robin) % len(healthy)].engine
+
+    def check(self):
+        """Measures every replica's lag once and updates which replicas reads may use."""
+        for group, replicas in self.groups.items():
+            for replica in replicas:
+                try:
+                    with replica.engine.connect() as connection:
+                        lag = replication_lag(connection)
+                except sa.exc.SQLAlchemyError as e:
+                    lag = None
+                    logger.warning("Read replica %s of %s is unreachable: %s", replica.engine.url, group, e)
+                healthy = lag is not None and lag <= self.max_lag
+                if healthy != replica.healthy:
+                    logger.log(
+                        logging.INFO if healthy else logging.WARNING,
+                        "Read replica %s of %s is %s (lag %s s)",
+                        replica.engine.url, group, "in rotation" if healthy else "out of rotation", lag,
+                    )
+                replica.healthy, replica.lag, replica.checked_at = healthy, lag, time.time()
+
+    def status(self):
+        return {
+            str(group): [
+                {"url": replica.engine.url.render_as_string(), "healthy": replica.healthy, "lag": replica.lag}
+                for replica in replicas
+            ]
+            for group, replicas in self.groups.items()
+        }
+
+    def ensure_started(self):
+        if not self.configured:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Read replica health check failed")
+            if self._stop.wait(self.health_interval):
+                return
+
+
+read_replicas = ReadReplicaRouter()
+
+
+def _session():
+    return current_app.extensions["sqlalchemy"].session()
@@ -0,0 +1,122 @@
+import logging
+import sqlalchemy as sa
+from flask import current_app
+from extensions import db
+from utils.db_pool import engine_options
+from utils.sharding import email_bucket, user_shards
+
+logger = logging.getLogger(__name__)
+
+# Rows that follow their user, keyed by user_id (pending outbox emails follow by address, see _copy_outbox).
+CHILD_TABLES = ("verification_tokens", "refresh_tokens", "sessions")
+
+
+def same_database(a, b):
+    return a.url.render_as_string(hide_password=False) == b.url.render_as_string(hide_password=False)
+
+
+def reshard_users(target_urls, batch_size=1000, prune=False):
+    """
+    Copies every user, with their verification/refresh tokens, sessions and pending outbox emails, from
+    the current layout (USER_SHARDS, or the default database) to the shard the user's email bucket maps to
+    in the `target_urls` layout. Targets must already have the schema (`USER_SHARDS=<targets> alembic
+    upgrade head`). Rows already present on the target are skipped, so an interrupted run can simply be
+    repeated. With `prune`, copied users are deleted from their old shard afterwards. Run it while signups
+    and logins are paused, then switch USER_SHARDS to `target_urls`. Returns per-shard counts.
+    """
+    sources = user_shards.engines or [db.engine]
+    pool = {
+        "pool_size": current_app.config.get("USER_SHARD_POOL_SIZE", 5),
+        "max_overflow": current_app.config.get("USER_SHARD_MAX_OVERFLOW", 10),
+    }
+    targets = []
+    for url in target_urls:
+        engine = sa.create_engine(url, **engine_options(url, **pool))
+        reused = next((source for source in sources if same_database(source, engine)), None)
+        if reused is not None:
+            engine.dispose()
+        targets.append(reused or engine)
+
+    report = {"users_moved": 0, "users_kept": 0, "rows_copied": 0, "users_pruned": 0}
+    try:
+        for index, source in enumerate(sources):
+            _reshard_source(index, source, targets, batch_size, prune, report)
+    finally:
+        for engine in targets:
+            if engine not in sources:
+                engine.dispose()
+    logger.info("Resharded users onto %d shards: %s", len(targets), report)
+    return report
+
+
+def _reshard_source(index, source, targets, batch_size, prune, report):
+    users = db.metadata.tables["users"]
+    last_id = None
+    while True:
+        query = sa.select(users.c.id, users.c.email).order_by(users.c.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(users.c.id > last_id)
+        with source.connect() as connection:
+            batch = connection.execute(query).all()
+        if not batch:
+            return
+        last_id = batch[-1].id
+
+        moves = {}
+        for user_id, email in batch:
+            target = targets[user_shards.shard_for_bucket(email_bucket(email), count=len(targets))]
+            if same_database(source, target):
+                report["users_kept"] += 1
+            else:
+                moves.setdefault(target, []).append((user_id, email))
+        for target, moved in moves.items():
+            ids = [user_id for user_id, _ in moved]
+            emails = [email for _, email in moved]
+            with source.connect() as read, target.begin() as write:
+                report["rows_copied"] += _copy_rows(read, write, users, users.c.id.in_(ids))
+                for name in CHILD_TABLES:
+                    table = db.metadata.tables[name]
+                    report["rows_copied"] += _copy_rows(read, write, table, table.c.user_id.in_(ids))
+                report["rows_copied"] += _copy_outbox(read, write, emails)
+            report["users_moved"] += len(moved)
+            if prune:
+                with source.begin() as connection:
+                    _delete_users(connection, ids, emails)
+                report["users_pruned"] += len(moved)
+        logger.info("Shard %d: resharded users up to %s", index, last_id)
+
+
+def _copy_rows(read, write, table, condition):
+    rows = [row._asdict() for row in read.execute(sa.select(table).where(condition))]
+    if not rows:
+        return 0
+    (key,) = table.primary_key.columns
+    existing = set(write.execute(sa.select(key).where(key.in_([row[key.name] for row in rows]))).scalars())
+    rows = [row for row in rows if row[key.name] not in existing]
+    if rows:
+        write.execute(sa.insert(table), rows)
+    return len(rows)
+
+
+def _copy_outbox(read, write, emails):
+    # Sent and failed emails are history and stay behind; ids are per database, so pending ones get new ids.
+    outbox = db.metadata.tables["email_outbox"]
+    pending = (outbox.c.to_email.in_(emails)) & (outbox.c.status == "pending")
+    rows = [row._asdict() for row in read.execute(sa.select(outbox).where(pending))]
+    existing = {
+        (row.to_email, row.body) for row in write.execute(sa.select(outbox.c.to_email, outbox.c.body).where(pending))
+    }
+    rows = [{k: v for k, v in row.items() if k != "id"} for row in rows if (row["to_email"], row["body"]) not in existing]
+    if rows:
+        write.execute(sa.insert(outbox), rows)
+    return len(rows)
+
+
+def _delete_users(connection, ids, emails):
+    for name in CHILD_TABLES:
+        table = db.metadata.tables[name]
+        connection.execute(sa.delete(table).where(table.c.user_id.in_(ids)))
+    outbox = db.metadata.tables["email_outbox"]
+    connection.execute(sa.delete(outbox).where(outbox.c.to_email.in_(emails), outbox.c.status == "pending"))
+    users = db.metadata.tables["users"]
+    connection.execute(sa.delete(users).where(users.c.id.in_(ids)))
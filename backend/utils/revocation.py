@@ -0,0 +1,309 @@
+from datetime import datetime
+import hashlib
+import logging
+import math
+import threading
+import time
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import RevokedToken
+from utils.metrics import metrics
+
+try:
+    import redis
+except ImportError:  # only needed for REVOCATION_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on a single blake2b digest)."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def _to_datetime(epoch):
+    return datetime.utcfromtimestamp(epoch)
+
+
+class SQLRevocationBackend:
+    """Revocations in the revoked_tokens table. Uses its own connections so it never touches the request session."""
+
+    log_retention = None  # revoked_at is kept for the row's whole life, so any sync window works
+
+    def __init__(self):
+        self.table = RevokedToken.__table__
+
+    def revoke(self, jti, expires_at):
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    insert(self.table).values(
+                        jti=jti, expires_at=_to_datetime(expires_at), revoked_at=datetime.utcnow()
+                    )
+                )
+        except IntegrityError:
+            pass  # already revoked
+
+    def is_revoked(self, jti):
+        query = select(self.table.c.jti).where(
+            self.table.c.jti == jti, self.table.c.expires_at > datetime.utcnow()
+        )
+        with db.engine.connect() as conn:
+            return conn.execute(query).first() is not None
+
+    def revoked_since(self, since):
+        query = select(self.table.c.jti).where(
+            self.table.c.revoked_at >= _to_datetime(since), self.table.c.expires_at > datetime.utcnow()
+        )
+        with db.engine.connect() as conn:
+            return conn.execute(query).scalars().all()
+
+    def count_active(self):
+        query = select(func.count()).select_from(self.table).where(self.table.c.expires_at > datetime.utcnow())
+        with db.engine.connect() as conn:
+            return conn.execute(query).scalar()
+
+    def iter_active(self, chunk_size=10000):
+        query = select(self.table.c.jti).where(self.table.c.expires_at > datetime.utcnow())
+        with db.engine.connect() as conn:
+            result = conn.execution_options(yield_per=chunk_size).execute(query)
+            for jti in result.scalars():
+                yield jti
+
+    def purge_expired(self, batch_size=500, pause=0.0):
+        """Deletes expired revocations `batch_size` rows per transaction, sleeping `pause` seconds in between."""
+        removed = 0
+        expired = select(self.table.c.jti).where(self.table.c.expires_at <= datetime.utcnow()).limit(batch_size)
+        while True:
+            with db.engine.begin() as conn:
+                jtis = conn.execute(expired).scalars().all()
+                if jtis:
+                    conn.execute(delete(self.table).where(self.table.c.jti.in_(jtis)))
+            removed += len(jtis)
+            if len(jtis) < batch_size:
+                return removed
+            time.sleep(pause)
+
+
+class RedisRevocationBackend:
+    """
+    Revocations as Redis keys that expire together with the token (SET ... EXAT exp).
+    Two sorted sets support the per-process caches: one scored by exp (full reloads)
+    and one scored by revocation time (incremental syncs, trimmed after `log_retention` seconds).
+    Works with any client exposing the redis-py API.
+    """
+
+    EXP_KEY = "revoked:exp"
+    LOG_KEY = "revoked:log"
+
+    def __init__(self, client, log_retention=3600):
+        self.client = client
+        self.log_retention = log_retention
+
+    def revoke(self, jti, expires_at):
+        pipe = self.client.pipeline()
+        pipe.set(f"revoked:{jti}", 1, exat=int(expires_at))
+        pipe.zadd(self.EXP_KEY, {jti: expires_at})
+        pipe.zadd(self.LOG_KEY, {jti: time.time()})
+        pipe.execute()
+
+    def is_revoked(self, jti):
+        return self.client.exists(f"revoked:{jti}") == 1
+
+    def revoked_since(self, since):
+        return [_decode(jti) for jti in self.client.zrangebyscore(self.LOG_KEY, since, "+inf")]
+
+    def count_active(self):
+        return self.client.zcount(self.EXP_KEY, time.time(), "+inf")
+
+    def iter_active(self, chunk_size=10000):
+        for jti, _ in self.client.zscan_iter(self.EXP_KEY, count=chunk_size):
+            yield _decode(jti)
+
+    def purge_expired(self, batch_size=None, pause=0.0):
+        # ZREMRANGEBYSCORE is cheap per removed member; no batching needed.
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.EXP_KEY, "-inf", now)
+        pipe.zremrangebyscore(self.LOG_KEY, "-inf", now - self.log_retention)
+        return pipe.execute()[0]
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RevocationStore:
+    """
+    Answers "is this jti revoked?" for the JWT blocklist loader.
+    Every process keeps a Bloom filter of revoked jtis that is refreshed from the backend at most
+    every REVOCATION_SYNC_INTERVAL seconds, so the common not-revoked case is answered without I/O;
+    only Bloom hits are confirmed against the backend. Revocations made by another worker become
+    visible here after at most one sync interval.
+    Requests only ever run the incremental sync. Full (re)builds of the filter happen on a background
+    thread; until the first one finishes, or while the filter can no longer be synced, every check
+    asks the backend. Expired revocations are purged by the sweeper (utils/verification.py).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.bloom = None
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self.sync_interval = 1.0
+        self.sync_overlap = 2.0
+        self.rebuild_interval = 3600.0
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        self._next_sync = 0.0
+        self._next_rebuild = 0.0
+        self._rebuilder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        kind = config.get("REVOCATION_BACKEND", "sql")
+        if kind == "sql":
+            self.backend = SQLRevocationBackend()
+        elif kind == "redis":
+            if redis is None:
+                raise RuntimeError("REVOCATION_BACKEND=redis requires the redis package")
+            client = redis.Redis.from_url(config["REVOCATION_REDIS_URL"])
+            self.backend = RedisRevocationBackend(client, config.get("REVOCATION_LOG_RETENTION", 3600))
+        else:
+            raise ValueError(f"Unknown REVOCATION_BACKEND: {kind}")
+        self.app = app
+        self.capacity = config.get("REVOCATION_BLOOM_CAPACITY", 100000)
+        self.error_rate = config.get("REVOCATION_BLOOM_ERROR_RATE", 0.001)
+        self.sync_interval = config.get("REVOCATION_SYNC_INTERVAL", 1.0)
+        self.rebuild_interval = config.get("REVOCATION_REBUILD_INTERVAL", 3600.0)
+        self.bloom = None
+        app.extensions["revocation"] = self
+
+    def revoke(self, jti, expires_at):
+        """Revokes `jti` until `expires_at` (the token's exp, seconds since the epoch)."""
+        self.backend.revoke(jti, expires_at)
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def is_revoked(self, jti):
+        self.refresh()
+        bloom = self.bloom
+        if bloom is None:
+            revoked = self.backend.is_revoked(jti)
+            metrics.revocation_checks.inc(result="revoked" if revoked else "no_filter")
+            return revoked
+        if jti not in bloom:
+            metrics.revocation_checks.inc(result="bloom_miss")
+            return False
+        revoked = self.backend.is_revoked(jti)
+        # "false_positive" is the Bloom filter costing a backend lookup for a live token.
+        metrics.revocation_checks.inc(result="revoked" if revoked else "false_positive")
+        return revoked
+
+    __contains__ = is_revoked
+
+    def refresh(self, force=False):
+        """
+        Adds revocations made since the last sync to the filter and starts a background rebuild when one is due.
+        `force` rebuilds the filter right here instead (for tools and tests, not for requests).
+        """
+        if force:
+            with self._lock:
+                wall_now = time.time()
+                self.bloom = self._build()
+                self._last_sync = wall_now
+                now = time.monotonic()
+                self._next_rebuild = now + self.rebuild_interval
+                self._next_sync = now + self.sync_interval
+            return
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        # Only one thread syncs; the others keep answering from the current filter.
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if now < self._next_sync:
+                return
+            wall_now = time.time()
+            retention = self.backend.log_retention
+            if self.bloom is not None and retention is not None and wall_now - self._last_sync > retention:
+                # The revocation log no longer reaches back to the last sync: the filter may miss entries.
+                self.bloom = None
+            if self.bloom is None or now >= self._next_rebuild or self.bloom.count > self.bloom.capacity:
+                self._start_rebuild()
+                self._next_rebuild = now + self.rebuild_interval
+            if self.bloom is not None:
+                for jti in self.backend.revoked_since(self._last_sync - self.sync_overlap):
+                    self.bloom.add(jti)
+                self._last_sync = wall_now
+            self._next_sync = now + self.sync_interval
+        finally:
+            self._lock.release()
+
+    def purge_expired(self, batch_size=500, pause=0.0):
+        """Deletes revocations whose token has expired; run by the sweeper, not on the request path."""
+        return self.backend.purge_expired(batch_size, pause)
+
+    def _start_rebuild(self):
+        if self._rebuilder is not None and self._rebuilder.is_alive():
+            return
+        self._rebuilder = threading.Thread(target=self._rebuild, name="revocation-rebuild", daemon=True)
+        self._rebuilder.start()
+
+    def _rebuild(self):
+        started = time.time()
+        try:
+            with self.app.app_context():
+                bloom = self._build()
+                # Catches what was revoked while the filter was being built.
+                synced_at = time.time()
+                for jti in self.backend.revoked_since(started - self.sync_overlap):
+                    bloom.add(jti)
+        except Exception:
+            logger.exception("Rebuilding the revocation filter failed")
+            with self._lock:
+                self._next_rebuild = time.monotonic()
+            return
+        with self._lock:
+            # The next incremental sync starts no later than the catch-up above left off.
+            self._last_sync = synced_at if self.bloom is None else min(self._last_sync, synced_at)
+            self.bloom = bloom
+
+    def _build(self):
+        active = self.backend.count_active()
+        bloom = BloomFilter(max(self.capacity, active * 2), self.error_rate)
+        for jti in self.backend.iter_active():
+            bloom.add(jti)
+        return bloom
+
+
+revocation_store = RevocationStore()
@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import time
+import uuid
+from extensions import db
+from models import User, UserSession
+from utils.sharding import user_shards
+from utils.refresh_tokens import refresh_token_lifetime, revoke_refresh_family, revoke_user_refresh_tokens
+
+
+def start_session(user_id, remember=False, user_agent=None, ip_address=None):
+    """Adds a session row for a new login and returns its id (also the refresh token family id). The caller commits."""
+    session_id = str(uuid.uuid4())
+    user_shards.use_user(user_id)
+    db.session.add(
+        UserSession(
+            id=session_id,
+            user_id=user_id,
+            user_agent=(user_agent or "")[:255] or None,
+            ip_address=ip_address,
+            remember=remember,
+            expires_at=datetime.utcnow() + refresh_token_lifetime(remember),
+        )
+    )
+    return session_id
+
+
+def touch_session(session_id, remember):
+    """Records a refresh on the session and extends it to the new refresh token's expiry. The caller commits."""
+    now = datetime.utcnow()
+    UserSession.query.filter_by(id=session_id, revoked_at=None).update(
+        {"last_seen_at": now, "expires_at": now + refresh_token_lifetime(remember)}, synchronize_session=False
+    )
+
+
+def list_sessions(user_id):
+    now = datetime.utcnow()
+    user_shards.use_user(user_id)
+    return (
+        UserSession.query.filter(
+            UserSession.user_id == user_id, UserSession.revoked_at.is_(None), UserSession.expires_at > now
+        )
+        .order_by(UserSession.last_seen_at.desc())
+        .all()
+    )
+
+
+def revoke_session(user_id, session_id):
+    """
+    Ends one of the user's sessions: its refresh tokens stop working at once, its current access token
+    at the latest when it expires (JWT_ACCESS_TOKEN_EXPIRES). Returns False if the user has no such session.
+    The caller commits.
+    """
+    user_shards.use_user(user_id)
+    revoked = UserSession.query.filter_by(id=session_id, user_id=user_id, revoked_at=None).update(
+        {"revoked_at": datetime.utcnow()}, synchronize_session=False
+    )
+    if revoked:
+        revoke_refresh_family(session_id)
+    return bool(revoked)
+
+
+def revoke_all_sessions(user_id):
+    """
+    Logs the user out everywhere: bumps users.token_generation, which invalidates every access token
+    issued so far in one write, and revokes all refresh tokens and sessions. The caller commits and then
+    calls token_generations.invalidate(user_id).
+    """
+    user_shards.use_user(user_id)
+    User.query.filter_by(id=user_id).update(
+        {"token_generation": User.token_generation + 1}, synchronize_session=False
+    )
+    revoke_user_refresh_tokens(user_id)
+    UserSession.query.filter_by(user_id=user_id, revoked_at=None).update(
+        {"revoked_at": datetime.utcnow()}, synchronize_session=False
+    )
+
+
+class TokenGenerationCache:
+    """
+    Per-process LRU + TTL cache of users.token_generation for the JWT blocklist check, so verifying an
+    access token's "gen" claim costs a database read at most once per user every TOKEN_GENERATION_CACHE_TTL
+    seconds. The worker that bumps a generation invalidates its own entry right after committing; other
+    workers see the bump within one TTL. A load that overlaps an invalidation is used but not cached.
+    """
+
+    def __init__(self, app=None):
+        self.max_entries = 10000
+        self.ttl = 5.0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get("TOKEN_GENERATION_CACHE_SIZE", 10000)
+        self.ttl = app.config.get("TOKEN_GENERATION_CACHE_TTL", 5.0)
+        app.extensions["token_generations"] = self
+
+    def current(self, user_id):
+        """The user's current generation, or None if the user no longer exists."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            epoch = self._epoch
+
+        user_shards.use_user(user_id)
+        generation = db.session.execute(
+            db.select(User.token_generation).where(User.id == user_id)
+        ).scalar_one_or_none()
+
+        with self._lock:
+            if self._epoch == epoch:
+                self._entries[user_id] = (now + self.ttl, generation)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return generation
+
+    def is_stale(self, claims):
+        """True if the token predates the user's last revoke-all (tokens without "gen" count as generation 0)."""
+        return claims.get("gen", 0) != self.current(claims["sub"])
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._epoch += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+token_generations = TokenGenerationCache()
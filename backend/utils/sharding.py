@@ -0,0 +1,222 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import uuid
+from flask import current_app
+from flask_sqlalchemy.session import Session
+import sqlalchemy as sa
+from sqlalchemy.sql.util import find_tables
+from utils.db_pool import engine_options
+from utils.metrics import metrics
+from utils.replicas import read_replicas
+from utils.validators import normalize_email
+
+# Emails hash into a fixed number of buckets; shards own contiguous bucket ranges, so resharding moves
+# whole buckets and a user's bucket (embedded in new user ids and tokens) never changes.
+BUCKETS = 4096
+
+# A user's rows in these tables live on the user's shard; everything else (revoked tokens, login failures,
+# rate-limit counters) stays on SQLALCHEMY_DATABASE_URI.
+SHARDED_TABLES = frozenset({"users", "verification_tokens", "refresh_tokens", "sessions", "email_outbox"})
+
+_users = sa.table("users", sa.column("id"))
+
+
+def email_bucket(email):
+    digest = hashlib.sha256(normalize_email(email).encode()).digest()
+    return int.from_bytes(digest[:4], "big") % BUCKETS
+
+
+def new_user_id(email):
+    """A UUIDv8 whose first three hex digits are the email's bucket, so id lookups need no directory."""
+    value = (email_bucket(email) << 116) | (uuid.uuid4().int & ((1 << 116) - 1))
+    value = (value & ~(0xF << 76)) | (0x8 << 76)  # version 8
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+    return str(uuid.UUID(int=value))
+
+
+def id_bucket(user_id):
+    """The bucket embedded in a user id, or None for ids created before sharding (plain UUIDv4)."""
+    if isinstance(user_id, str) and len(user_id) == 36 and user_id[14] == "8":
+        return int(user_id[:3], 16)
+    return None
+
+
+def tag_token(token, user_id):
+    """Appends the owner's bucket to an opaque token so its lookup goes straight to the right shard."""
+    bucket = id_bucket(user_id)
+    return token if bucket is None else f"{token}.{bucket:03x}"
+
+
+def token_bucket(token):
+    # Raw tokens are UUIDs or urlsafe base64, neither of which contains a ".".
+    prefix, dot, suffix = token.rpartition(".")
+    if dot and prefix and len(suffix) == 3:
+        try:
+            return int(suffix, 16)
+        except ValueError:
+            return None
+    return None
+
+
+class UserShardRouter:
+    """
+    Routes the user tables (SHARDED_TABLES) to one of the USER_SHARDS databases. A request selects the
+    shard of the user it works on (use_email / use_user / use_token) and every ORM or Core statement on
+    those tables in the request's session then runs there; statements on the other tables keep using
+    the default engine. Without USER_SHARDS there is a single shard, the default database, and routing
+    is a no-op. Shard i owns buckets [i * BUCKETS / n, (i + 1) * BUCKETS / n), see `flask reshard-users`.
+    """
+
+    def __init__(self, app=None):
+        self.urls = []
+        self.engines = []
+        self.max_legacy_ids = 10000
+        self._legacy_ids = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.max_legacy_ids = config.get("USER_SHARD_LEGACY_ID_CACHE_SIZE", 10000)
+        self.configure(
+            config.get("USER_SHARDS", []),
+            pool_size=config.get("USER_SHARD_POOL_SIZE", 5),
+            max_overflow=config.get("USER_SHARD_MAX_OVERFLOW", 10),
+        )
+        app.extensions["user_shards"] = self
+
+    def configure(self, urls, **pool):
+        for engine in self.engines:
+            engine.dispose()
+        self.urls = list(urls)
+        # Engines connect lazily, so configuring shards costs nothing at startup.
+        self.engines = [sa.create_engine(url, **engine_options(url, **pool)) for url in self.urls]
+        with self._lock:
+            self._legacy_ids.clear()
+
+    @property
+    def sharded(self):
+        return bool(self.engines)
+
+    @property
+    def count(self):
+        return len(self.engines) or 1
+
+    def shard_for_bucket(self, bucket, count=None):
+        return bucket * (count or self.count) // BUCKETS
+
+    def shard_for_email(self, email):
+        return self.shard_for_bucket(email_bucket(email))
+
+    def engine(self, shard):
+        if shard is None:
+            raise RuntimeError("Query on a user table before a user shard was selected")
+        return self.engines[shard]
+
+    def current(self):
+        return _session().info.get("user_shard")
+
+    def use(self, shard):
+        """Selects `shard` for the user tables in this request's session; pending changes are flushed first."""
+        if not self.sharded:
+            return
+        session = _session()
+        if session.info.get("user_shard") not in (None, shard) and (session.new or session.dirty or session.deleted):
+            session.flush()
+        session.info["user_shard"] = shard
+
+    def use_email(self, email):
+        self.use(self.shard_for_email(email))
+
+    def use_user(self, user_id):
+        if not self.sharded:
+            return
+        bucket = id_bucket(user_id)
+        self.use(self.shard_for_bucket(bucket) if bucket is not None else self._locate_legacy_id(user_id))
+
+    def use_token(self, token, probe):
+        """
+        Selects the shard holding `token`. Untagged tokens (issued before sharding) are searched for:
+        `probe()` runs once per shard until it returns True.
+        """
+        if not self.sharded:
+            return
+        bucket = token_bucket(token)
+        if bucket is not None:
+            self.use(self.shard_for_bucket(bucket))
+            return
+        for shard in self.each():
+            if probe():
+                return
+        self.use(0)
+
+    def each(self):
+        """Selects every shard in turn (sweeps, the outbox, exports); commit or roll back before moving on."""
+        for shard in range(self.count):
+            self.use(shard)
+            yield shard
+
+    def _locate_legacy_id(self, user_id):
+        with self._lock:
+            if user_id in self._legacy_ids:
+                self._legacy_ids.move_to_end(user_id)
+                return self._legacy_ids[user_id]
+        shard = 0
+        for index, engine in enumerate(self.engines):
+            with engine.connect() as connection:
+                if connection.execute(sa.select(_users.c.id).where(_users.c.id == user_id)).first():
+                    shard = index
+                    break
+        with self._lock:
+            self._legacy_ids[user_id] = shard
+            while len(self._legacy_ids) > self.max_legacy_ids:
+                self._legacy_ids.popitem(last=False)
+        return shard
+
+
+user_shards = UserShardRouter()
+
+
+def _session():
+    return current_app.extensions["sqlalchemy"].session()
+
+
+def _user_tables(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name in SHARDED_TABLES
+    if clause is not None:
+        return any(getattr(table, "name", None) in SHARDED_TABLES for table in find_tables(clause, include_crud=True))
+    return False
+
+
+def _read_only(clause):
+    return clause is not None and getattr(clause, "is_select", False) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+    """
+    db.session class: statements on the user tables go to the selected shard (see UserShardRouter), and
+    their read-only ones to a replica of it in requests that allowed replica reads (see ReadReplicaRouter).
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None or not (user_shards.sharded or read_replicas.configured):
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if not _user_tables(mapper, clause):
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+        shard = self.info.get("user_shard") if user_shards.sharded else "default"
+        if self.info.get("replica_reads"):
+            if _read_only(clause):
+                replica = read_replicas.pick(shard)
+                metrics.replica_routing.inc(target="primary" if replica is None else "replica")
+                if replica is not None:
+                    return replica
+            else:
+                # The request wrote: it reads its own writes from the primary from here on.
+                self.info["replica_reads"] = False
+        if user_shards.sharded:
+            return user_shards.engine(shard)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
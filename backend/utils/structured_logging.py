@@ -0,0 +1,307 @@
+import atexit
+import copy
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from flask import g, has_request_context, request
+from utils.metrics import metrics
+
+access_logger = logging.getLogger("access")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Client-supplied ids are echoed into logs and headers, so only short, plain ones are accepted.
+REQUEST_ID = re.compile(r"^[\w.-]{1,64}$")
+
+EMAIL = re.compile(r"\b([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)\b")
+JWT = re.compile(r"\beyJ[\w-]+\.[\w-]+\.[\w-]+")
+SECRET_PARAM = re.compile(r"(?i)\b(password|token|secret|authorization)([=:]\s*)(?:Bearer\s+)?[^\s&,;'\")]+")
+SECRET_KEYS = frozenset({"password", "token", "access_token", "refresh_token", "secret", "authorization"})
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` and goes into the JSON.
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "taskName"}
+
+
+def redact(text):
+    """Masks email addresses (j***@example.com) and blanks out JWTs and password/token values."""
+    # Substring checks first: most messages contain none of these, and `in` is far cheaper than a regex scan.
+    if "eyJ" in text:
+        text = JWT.sub("[jwt]", text)
+    if "=" in text or ":" in text:
+        text = SECRET_PARAM.sub(r"\1\2[redacted]", text)
+    if "@" in text:
+        text = EMAIL.sub(r"\1***@\2", text)
+    return text
+
+
+def parse_sample_rates(value):
+    """"access=0.1,sqlalchemy.engine=0.01" -> {"access": 0.1, "sqlalchemy.engine": 0.01}"""
+    if isinstance(value, dict):
+        return {name: float(rate) for name, rate in value.items()}
+    rates = {}
+    for part in (value or "").split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """
+    Runs on the logging thread, before a record is queued: samples records below WARNING by logger
+    category, stamps the request id and redacts the message, so the queue only carries finished strings.
+    """
+
+    def __init__(self, sample_rates=None, redact=True):
+        super().__init__()
+        self.sample_rates = parse_sample_rates(sample_rates)
+        self.redact = redact
+        self._rates = {}
+
+    def rate(self, name):
+        """The sample rate of the longest configured category that `name` falls under (1.0 without one)."""
+        rate = self._rates.get(name)
+        if rate is None:
+            rate, matched = 1.0, -1
+            for category, value in self.sample_rates.items():
+                if (name == category or name.startswith(category + ".")) and len(category) > matched:
+                    rate, matched = value, len(category)
+            self._rates[name] = rate
+        return rate
+
+    def sampled(self, name, level):
+        # Warnings and errors are never sampled away.
+        if level >= logging.WARNING:
+            return True
+        rate = self.rate(name)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+    def filter(self, record):
+        if not getattr(record, "_sampled", False) and not self.sampled(record.name, record.levelno):
+            return False
+        record.request_id = g.get("request_id") if has_request_context() else None
+        message = record.getMessage()
+        if self.redact:
+            message = redact(message)
+            for key, value in vars(record).items():
+                if key in RECORD_ATTRIBUTES or key.startswith("_"):
+                    continue
+                if key.lower() in SECRET_KEYS:
+                    setattr(record, key, "[redacted]")
+                elif isinstance(value, str):
+                    setattr(record, key, redact(value))
+        record.msg, record.args = message, None
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = None
+        return super().format(record)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Never waits on the writer: when the queue is full the record is dropped and counted."""
+
+    def __init__(self, log_queue, redact=True):
+        super().__init__(log_queue)
+        self.redact = redact
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The message is already merged and redacted (ContextFilter). Tracebacks become text here, on the
+        # logging thread, because traceback objects can't outlive it; the copy keeps them for other handlers.
+        if record.exc_info:
+            record = copy.copy(record)
+            text = logging.Formatter().formatException(record.exc_info)
+            record.exc_text = redact(text) if self.redact else text
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.log_records_dropped.inc()
+
+
+class StructuredLogging:
+    """
+    Process-wide log setup: every record (the app's, SQLAlchemy's, the libraries') goes through a
+    bounded queue to a background writer thread, so handlers never do I/O on the request path.
+    - LOG_FORMAT=json writes one JSON object per line: ts, level, logger, message, request_id, any
+      `extra=` fields and the traceback. Each request gets an id (a valid incoming X-Request-ID header
+      or a new one) that is stamped on its records and echoed in the response's X-Request-ID header.
+    - LOG_SAMPLE_RATES keeps a fraction of the records below WARNING per logger category ("access" is
+      the one-line-per-request log, "sqlalchemy.engine" the statements logged with LOG_SQL).
+    - With LOG_REDACT, email addresses are masked and JWTs, passwords and tokens blanked out.
+    - A full queue (LOG_QUEUE_SIZE) drops records instead of blocking; see log_records_dropped in /metrics.
+    Request ids are always assigned; the handlers and the access log are only installed when
+    should_configure() says so, so tests, benchmarks and hosts with their own logging are left alone.
+    """
+
+    def __init__(self, app=None):
+        self.settings = {}
+        self.handler = None
+        self._target = None
+        self.listener = None
+        self.filter = None
+        self.access_log = True
+        self._pid = None
+        self._atexit_registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.extensions["structured_logging"] = self
+        if not self.should_configure(app):
+            return
+        self.configure(
+            level=config.get("LOG_LEVEL", "INFO"),
+            fmt=config.get("LOG_FORMAT", "json"),
+            filename=config.get("LOG_FILE"),
+            queue_size=config.get("LOG_QUEUE_SIZE", 10000),
+            sample_rates=config.get("LOG_SAMPLE_RATES", ""),
+            redact=config.get("LOG_REDACT", True),
+            sql=config.get("LOG_SQL", False),
+            access_log=config.get("LOG_ACCESS", True),
+        )
+
+    @staticmethod
+    def should_configure(app):
+        """
+        LOG_CONFIGURE "true" / "false" forces it; "auto" takes over the root logger only outside TESTING and
+        only if nothing (pytest, gunicorn --log-config, a host application) has given it handlers yet.
+        """
+        mode = str(app.config.get("LOG_CONFIGURE", "auto")).lower()
+        if mode != "auto":
+            return mode == "true"
+        return not app.testing and not logging.getLogger().handlers
+
+    def configure(self, level="INFO", fmt="json", stream=None, filename=None, queue_size=10000, sample_rates="",
+                  redact=True, sql=False, access_log=True, use_queue=True):
+        """(Re)installs the root handler; `use_queue=False` writes synchronously (for comparison only)."""
+        self.reset()
+        self.settings = {
+            "level": level, "fmt": fmt, "stream": stream, "filename": filename, "queue_size": queue_size,
+            "sample_rates": sample_rates, "redact": redact, "sql": sql, "access_log": access_log,
+            "use_queue": use_queue,
+        }
+        root = logging.getLogger()
+        target = logging.FileHandler(filename, encoding="utf-8") if filename else logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+        self._target = target
+        self.filter = ContextFilter(sample_rates, redact=redact)
+        if use_queue:
+            self.handler = NonBlockingQueueHandler(queue.Queue(queue_size), redact=redact)
+            self._start_listener()
+        else:
+            self.handler = target
+        self.handler.addFilter(self.filter)
+        self.access_log = access_log
+        root.addHandler(self.handler)
+        root.setLevel(level)
+        # Statements go through the queue like everything else, instead of SQLAlchemy's echo handler.
+        logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO if sql else logging.WARNING)
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def reset(self):
+        """Stops the writer and takes this handler off the root logger."""
+        self.stop()
+        if self.handler is not None:
+            logging.getLogger().removeHandler(self.handler)
+            self._target.close()
+        self.handler = self._target = self.filter = None
+        self.settings = {}
+
+    def _start_listener(self):
+        self.listener = logging.handlers.QueueListener(self.handler.queue, self._target)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def ensure_started(self):
+        # The writer thread doesn't survive a fork (gunicorn --preload); each worker starts its own.
+        if isinstance(self.handler, NonBlockingQueueHandler) and self._pid != os.getpid():
+            self.handler.queue = queue.Queue(self.settings["queue_size"])
+            self._start_listener()
+
+    def flush(self):
+        """Blocks until every queued record has been written."""
+        if self.listener is not None:
+            self.handler.queue.join()
+            self._target.flush()
+
+    def stop(self):
+        """Writes out the queue and stops the writer thread."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+
+    def _start_request(self):
+        self.ensure_started()
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        g.request_id = incoming if REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        g._log_start = time.perf_counter()
+
+    def _finish_request(self, response):
+        request_id = g.get("request_id")
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        start = g.pop("_log_start", None)
+        # Sampled before the record is even built: the access log is the one written on every request.
+        if (
+            self.access_log and self.filter is not None and start is not None
+            and self.filter.sampled(access_logger.name, logging.INFO)
+        ):
+            access_logger.info(
+                "%s %s %s", request.method, request.path, response.status_code,
+                extra={
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "_sampled": True,
+                },
+            )
+        return response
+
+
+structured_logging = StructuredLogging()
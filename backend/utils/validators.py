@@ -1,28 +1,167 @@
 import re # regular expression module for email validation
-from email_validator import validate_email, EmailNotValidError 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from email_validator import validate_email, EmailNotValidError
 import logging
+import os
+import threading
+import time
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-    
+
+# Compiled once at import instead of on every call.
+PASSWORD_DIGIT = re.compile(r"[0-9]")
+PASSWORD_SPECIAL = re.compile(r"[!@#$%^&*(),.?\":{}|<>]")
+PASSWORD_LETTER = re.compile(r"[a-zA-Z\u0590-\u05FF]")  # תו אות עברית או אנגלית
+ISRAELI_MOBILE = re.compile(r"^05[012345689]\d{7}$")
+
+MAX_FULL_NAME = 20
+MAX_ADDRESS = 20
+
+
+def normalize_email(email: str) -> str:
+    """Canonical form used for storing and looking up emails (the users.email unique index is on it)."""
+    return email.strip().lower()
+
+
+def resolve_mail_domain(domain: str):
+    """
+    Default deliverability resolver: True if the domain has MX records (or, lacking those, an A/AAAA
+    record), False if DNS says it can't receive mail, None if DNS couldn't answer (not cached).
+    """
+    # dnspython is ~40ms to import; only pay for it once a lookup actually happens.
+    import dns.exception
+    import dns.resolver
+
+    try:
+        answer = dns.resolver.resolve(domain, "MX", lifetime=3)
+        # A "null MX" (RFC 7505, a single record pointing at ".") explicitly refuses mail.
+        return not all(str(record.exchange) == "." for record in answer)
+    except dns.resolver.NXDOMAIN:
+        return False
+    except dns.resolver.NoAnswer:
+        pass
+    except dns.exception.DNSException:
+        return None
+    for rdtype in ("A", "AAAA"):
+        try:
+            dns.resolver.resolve(domain, rdtype, lifetime=3)
+            return True
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            continue
+        except dns.exception.DNSException:
+            return None
+    return False
+
+
+class DeliverabilityChecker:
+    """
+    Optional MX check for signup emails (EMAIL_CHECK_DELIVERABILITY), with an LRU + TTL cache of
+    per-domain results so a signup flood from a handful of providers costs a handful of lookups.
+    Lookups run on a small thread pool: a caller waits at most EMAIL_DELIVERABILITY_TIMEOUT seconds
+    and treats a slow or failed lookup as deliverable (the verification email is the real check);
+    the result is still cached when it arrives. Concurrent checks of the same domain share one lookup.
+    `resolver(domain) -> True/False/None` is replaceable, e.g. with a stub in tests.
+    """
+
+    def __init__(self, app=None, resolver=resolve_mail_domain):
+        self.resolver = resolver
+        self.enabled = True
+        self.timeout = 2.0
+        self.max_entries = 10000
+        self.ttl = 3600.0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("EMAIL_CHECK_DELIVERABILITY", True)
+        self.timeout = app.config.get("EMAIL_DELIVERABILITY_TIMEOUT", 2.0)
+        self.max_entries = app.config.get("EMAIL_DOMAIN_CACHE_SIZE", 10000)
+        self.ttl = app.config.get("EMAIL_DOMAIN_CACHE_TTL", 3600.0)
+        app.extensions["email_deliverability"] = self
+
+    def is_deliverable(self, domain: str) -> bool:
+        if not self.enabled:
+            return True
+        domain = domain.lower()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(domain)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            future = self._pending.get(domain)
+            if future is None:
+                future = self._get_executor().submit(self._lookup, domain)
+                self._pending[domain] = future
+        try:
+            result = future.result(self.timeout)
+        except FutureTimeoutError:
+            logger.warning("MX lookup for %s timed out; accepting the address", domain)
+            return True
+        return result is not False
+
+    def _lookup(self, domain):
+        try:
+            result = self.resolver(domain)
+        except Exception:
+            logger.exception("MX lookup for %s failed", domain)
+            result = None
+        with self._lock:
+            self._pending.pop(domain, None)
+            if result is not None:
+                self._entries[domain] = (time.monotonic() + self.ttl, result)
+                self._entries.move_to_end(domain)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+    def _get_executor(self):
+        # Threads don't survive a fork, so each worker process starts its own.
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending.clear()
+            self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mx-lookup")
+        return self._executor
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+deliverability = DeliverabilityChecker()
+
+
 def is_valid_email(email: str) -> bool:
     try:
-        validate_email(email)
-        logger.info(f"✅ Email validated successfully: {email}")
-        return True
+        # Syntax only; the DNS part goes through the cached checker above.
+        domain = validate_email(email, check_deliverability=False).ascii_domain
     except EmailNotValidError as e:
-        logger.warning(f"❌ Invalid email '{email}': {e}")
+        # Only the reason: the address itself is PII, and invalid ones don't need tracing back.
+        logger.debug("Invalid email address: %s", e)
         return False
+    return deliverability.is_deliverable(domain)
 
 def is_valid_password(password: str) -> bool:
-    if (
-        len(password) < 8 or 
-        not re.search(r"[0-9]", password) or 
-        not re.search(r"[!@#$%^&*(),.?\":{}|<>]", password) or 
-        not re.search(r"[a-zA-Z\u0590-\u05FF]", password)  # תו אות עברית או אנגלית
-    ):
-        return False
-    return True
+    return (
+        len(password) >= 8
+        and PASSWORD_DIGIT.search(password) is not None
+        and PASSWORD_SPECIAL.search(password) is not None
+        and PASSWORD_LETTER.search(password) is not None
+    )
 
 def is_valid_israeli_phone(number: str) -> bool:
     """Validate an Israeli phone number."""
@@ -32,5 +171,26 @@ def is_valid_israeli_phone(number: str) -> bool:
     if number.startswith("+972"):
         number = "0" + number[4:]
 
-    pattern = r"^05[012345689]\d{7}$"
-    return bool(re.match(pattern, number))
\ No newline at end of file
+    return ISRAELI_MOBILE.match(number) is not None
+
+
+def validate_signup(email, password) -> dict:
+    """Returns every problem with a signup as {field: message}; empty means valid. Expects a normalized email."""
+    errors = {}
+    if not is_valid_email(email):
+        errors["email"] = "Invalid email"
+    if not is_valid_password(password):
+        errors["password"] = "Invalid password"
+    return errors
+
+
+def validate_profile(full_name=None, phone_number=None, address=None) -> dict:
+    """Returns every problem with the profile fields as {field: message}, in the order PUT /profile reports them."""
+    errors = {}
+    if full_name and len(full_name) > MAX_FULL_NAME:
+        errors["full_name"] = f"Full name must be {MAX_FULL_NAME} characters or fewer"
+    if address and len(address) > MAX_ADDRESS:
+        errors["address"] = f"Address must be {MAX_ADDRESS} characters or fewer"
+    if phone_number and not is_valid_israeli_phone(phone_number):
+        errors["phone_number"] = "Invalid Israeli phone number"
+    return errors
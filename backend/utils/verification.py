@@ -0,0 +1,212 @@
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from extensions import db, limiter
+from models import EmailOutbox, LoginFailure, RefreshToken, User, UserSession, VerificationToken
+from utils.rate_limit import SQLRateLimitStorage
+from utils.revocation import revocation_store
+from utils.sharding import tag_token, user_shards
+
+logger = logging.getLogger(__name__)
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_verification_token(user_id, ttl=timedelta(hours=1), replace_existing=False):
+    """
+    Adds a fresh token for `user_id` to the session and returns the raw token.
+    Only its hash is stored; the raw value goes out in the verification email, whose outbox body is cleared
+    once it is sent or given up on.
+    With replace_existing, earlier tokens of the user are deleted (resends).
+    """
+    token = tag_token(str(uuid.uuid4()), user_id)
+    if replace_existing:
+        VerificationToken.query.filter_by(user_id=user_id).delete()
+    db.session.add(
+        VerificationToken(token_hash=hash_token(token), user_id=user_id, expires_at=datetime.utcnow() + ttl)
+    )
+    return token
+
+
+def consume_verification_token(token, user_id=None):
+    """
+    Looks up an unexpired token (optionally restricted to `user_id`) and deletes all of that user's tokens.
+    Returns the owning user id, or None if the token is unknown or expired. Leaves the owner's shard
+    selected. The caller commits.
+    """
+    token_hash = hash_token(token)
+    if user_id is not None:
+        user_shards.use_user(user_id)
+    else:
+        user_shards.use_token(token, lambda: db.session.get(VerificationToken, token_hash) is not None)
+    query = VerificationToken.query.filter(
+        VerificationToken.token_hash == token_hash,
+        VerificationToken.expires_at > datetime.utcnow(),
+    )
+    if user_id is not None:
+        query = query.filter(VerificationToken.user_id == user_id)
+    row = query.first()
+    if row is None:
+        return None
+    owner = row.user_id
+    VerificationToken.query.filter_by(user_id=owner).delete()
+    return owner
+
+
+class VerificationSweeper:
+    """
+    Purges expired verification and refresh tokens, expired sessions, revocations of expired access tokens,
+    expired sql:// rate-limit counters, stale login-failure counters, accounts that stayed unverified for UNVERIFIED_ACCOUNT_TTL_DAYS and outbox
+    emails that were sent or gave up more than OUTBOX_RETENTION_DAYS ago.
+    Deletes run in chunks of SWEEPER_BATCH_SIZE rows, each in its own short transaction, with
+    SWEEPER_BATCH_PAUSE seconds between chunks so a large purge never holds long table locks.
+    With SWEEPER_AUTOSTART it runs every SWEEPER_INTERVAL seconds in a daemon thread; otherwise
+    use `flask sweep-verification` from cron.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.batch_size = 500
+        self.batch_pause = 0.05
+        self.interval = 300.0
+        self.unverified_ttl = timedelta(days=7)
+        self.outbox_retention = timedelta(days=7)
+        self.login_failure_window = 900.0
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get("SWEEPER_BATCH_SIZE", 500)
+        self.batch_pause = app.config.get("SWEEPER_BATCH_PAUSE", 0.05)
+        self.interval = app.config.get("SWEEPER_INTERVAL", 300.0)
+        self.unverified_ttl = timedelta(days=app.config.get("UNVERIFIED_ACCOUNT_TTL_DAYS", 7))
+        self.outbox_retention = timedelta(days=app.config.get("OUTBOX_RETENTION_DAYS", 7))
+        self.login_failure_window = app.config.get("LOGIN_FAILURE_WINDOW", 900.0)
+        app.extensions["verification_sweeper"] = self
+        if app.config.get("SWEEPER_AUTOSTART", False):
+            app.before_request(self.ensure_started)
+
+    def sweep(self):
+        """Runs one full pass inside an app context and returns the number of rows removed per table."""
+        now = datetime.utcnow()
+        expired_tokens = expired_refresh_tokens = expired_sessions = unverified_users = finished_emails = 0
+        for shard in user_shards.each():
+            expired_tokens += self._delete_in_chunks(
+                db.select(VerificationToken.token_hash).where(VerificationToken.expires_at <= now),
+                self._delete_tokens,
+            )
+            expired_refresh_tokens += self._delete_in_chunks(
+                db.select(RefreshToken.token_hash).where(RefreshToken.expires_at <= now),
+                self._delete_refresh_tokens,
+            )
+            expired_sessions += self._delete_in_chunks(
+                db.select(UserSession.id).where(UserSession.expires_at <= now),
+                self._delete_sessions,
+            )
+            unverified_users += self._delete_in_chunks(
+                db.select(User.id).where(User.is_verified.is_(False), User.created_at < now - self.unverified_ttl),
+                self._delete_users,
+            )
+            finished_emails += self._delete_in_chunks(
+                db.select(EmailOutbox.id).where(
+                    EmailOutbox.status.in_(("sent", "failed")),
+                    EmailOutbox.created_at < now - self.outbox_retention,
+                ),
+                self._delete_emails,
+            )
+        # Keys that stopped failing a window ago and aren't locked start from zero anyway.
+        epoch_now = time.time()
+        stale_login_failures = self._delete_in_chunks(
+            db.select(LoginFailure.key).where(
+                LoginFailure.last_failure_at < epoch_now - self.login_failure_window,
+                db.or_(LoginFailure.locked_until.is_(None), LoginFailure.locked_until < epoch_now),
+            ),
+            self._delete_login_failures,
+        )
+        expired_revocations = revocation_store.purge_expired(self.batch_size, self.batch_pause)
+        expired_rate_limits = 0
+        if isinstance(limiter.storage, SQLRateLimitStorage):
+            expired_rate_limits = limiter.storage.purge_expired(self.batch_size, self.batch_pause)
+        removed = {
+            "expired_tokens": expired_tokens,
+            "expired_refresh_tokens": expired_refresh_tokens,
+            "expired_sessions": expired_sessions,
+            "expired_revocations": expired_revocations,
+            "expired_rate_limits": expired_rate_limits,
+            "stale_login_failures": stale_login_failures,
+            "unverified_users": unverified_users,
+            "finished_emails": finished_emails,
+        }
+        logger.info("Verification sweep removed %s", removed)
+        return removed
+
+    def _delete_in_chunks(self, select_keys, delete_chunk):
+        removed = 0
+        while True:
+            keys = db.session.execute(select_keys.limit(self.batch_size)).scalars().all()
+            if not keys:
+                db.session.rollback()
+                return removed
+            removed += delete_chunk(keys)
+            db.session.commit()
+            if len(keys) < self.batch_size:
+                return removed
+            time.sleep(self.batch_pause)
+
+    def _delete_tokens(self, token_hashes):
+        return VerificationToken.query.filter(VerificationToken.token_hash.in_(token_hashes)).delete(
+            synchronize_session=False
+        )
+
+    def _delete_refresh_tokens(self, token_hashes):
+        return RefreshToken.query.filter(RefreshToken.token_hash.in_(token_hashes)).delete(
+            synchronize_session=False
+        )
+
+    def _delete_sessions(self, session_ids):
+        return UserSession.query.filter(UserSession.id.in_(session_ids)).delete(synchronize_session=False)
+
+    def _delete_login_failures(self, keys):
+        return LoginFailure.query.filter(LoginFailure.key.in_(keys)).delete(synchronize_session=False)
+
+    def _delete_emails(self, message_ids):
+        return EmailOutbox.query.filter(EmailOutbox.id.in_(message_ids)).delete(synchronize_session=False)
+
+    def _delete_users(self, user_ids):
+        VerificationToken.query.filter(VerificationToken.user_id.in_(user_ids)).delete(synchronize_session=False)
+        return User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="verification-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    self.sweep()
+            except Exception:
+                logger.exception("Verification sweep failed")
+
+
+sweeper = VerificationSweeper()
@@ -6,6 +6,49 @@ document.addEventListener("DOMContentLoaded", async () => {
   const signupMsg = document.getElementById("signup-msg");
 
   const inDashboard = window.location.pathname.includes("dashboard.html");
+  const API = "http://127.0.0.1:5000";
+
+  const clearTokens = () => {
+    localStorage.removeItem("access_token");
+    localStorage.removeItem("refresh_token");
+  };
+
+  // Access tokens live for minutes; on a 401 trade the refresh token for a new pair and retry once.
+  const refreshTokens = async () => {
+    const refreshToken = localStorage.getItem("refresh_token");
+    if (!refreshToken) return false;
+    const res = await fetch(`${API}/token/refresh`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ refresh_token: refreshToken }),
+    });
+    if (!res.ok) return false;
+    const data = await res.json();
+    localStorage.setItem("access_token", data.access_token);
+    localStorage.setItem("refresh_token", data.refresh_token);
+    return true;
+  };
+
+  // The access token carries the profile as claims (see issue_access_token); no request needed to read them.
+  const tokenClaims = (token) => {
+    try {
+      const payload = token.split(".")[1].replace(/-/g, "+").replace(/_/g, "/");
+      return JSON.parse(new TextDecoder().decode(Uint8Array.from(atob(payload), (c) => c.charCodeAt(0))));
+    } catch (err) {
+      return null;
+    }
+  };
+
+  const authFetch = async (path, options = {}) => {
+    const send = () =>
+      fetch(`${API}${path}`, {
+        ...options,
+        headers: { ...(options.headers || {}), Authorization: `Bearer ${localStorage.getItem("access_token")}` },
+      });
+    const res = await send();
+    if (res.status === 401 && (await refreshTokens())) return send();
+    return res;
+  };
 
   // ========== DASHBOARD PAGE LOGIC ==========
   if (inDashboard) {
@@ -18,17 +61,18 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 
     try {
-      const res = await fetch("http://127.0.0.1:5000/profile", {
-        headers: { Authorization: `Bearer ${token}` },
-      });
+      // An expired token's claims may be stale: refresh first, which also brings current claims.
+      let data = tokenClaims(token);
+      if (!data || data.exp * 1000 <= Date.now()) {
+        data = (await refreshTokens()) ? tokenClaims(localStorage.getItem("access_token")) : null;
+      }
 
-      if (!res.ok) {
-        localStorage.removeItem("access_token");
+      if (!data) {
+        clearTokens();
         window.location.href = "index.html";
         return;
       }
 
-      const data = await res.json();
       document.getElementById("fullname").value = data.full_name || "";
       document.getElementById("address").value = data.address || "";
       document.getElementById("phone").value = data.phone_number || "";
@@ -43,18 +87,16 @@ document.addEventListener("DOMContentLoaded", async () => {
         };
 
         try {
-          const putRes = await fetch("http://127.0.0.1:5000/profile", {
+          const putRes = await authFetch("/profile", {
             method: "PUT",
-            headers: {
-              "Content-Type": "application/json",
-              Authorization: `Bearer ${token}`,
-            },
+            headers: { "Content-Type": "application/json" },
             body: JSON.stringify(updatedProfile),
           });
 
           const result = await putRes.json();
 
           if (putRes.ok) {
+            if (result.access_token) localStorage.setItem("access_token", result.access_token);
             msg.style.color = "green";
             msg.textContent = result.message || "Profile updated successfully.";
           } else {
@@ -84,14 +126,23 @@ document.addEventListener("DOMContentLoaded", async () => {
 
 
       // Logout
-      document.getElementById("logout-btn")?.addEventListener("click", () => {
-        localStorage.removeItem("access_token");
+      document.getElementById("logout-btn")?.addEventListener("click", async () => {
+        try {
+          await authFetch("/logout", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ refresh_token: localStorage.getItem("refresh_token") }),
+          });
+        } catch (err) {
+          console.error("Logout request failed", err);
+        }
+        clearTokens();
         window.location.href = "index.html";
       });
 
     } catch (err) {
-      console.error("Error fetching profile", err);
-      localStorage.removeItem("access_token");
+      console.error("Error loading profile", err);
+      clearTokens();
       window.location.href = "index.html";
     }
 
@@ -183,6 +234,7 @@ document.addEventListener("DOMContentLoaded", async () => {
       const data = await res.json();
       if (res.ok && data.access_token) {
         localStorage.setItem("access_token", data.access_token);
+        localStorage.setItem("refresh_token", data.refresh_token);
         window.location.href = "dashboard.html";
       } else {
         loginMsg.style.color = "red";